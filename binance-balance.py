@@ -1,6 +1,10 @@
-import Tkinter as tk
-import ttk
-import tkFileDialog
+try:
+    import Tkinter as tk
+    import ttk
+    import tkFileDialog
+    from tkinter import messagebox
+except ImportError:
+    tk = None #headless mode only
 import pandas as pd
 from binance.client import Client
 from binance.websockets import BinanceSocketManager
@@ -9,14 +13,50 @@ from binance.exceptions import *
 import numpy as np
 from datetime import datetime
 import time
-from tkinter import messagebox
 import Queue
 from twisted.internet import reactor
+from twisted.internet import defer, task, threads
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+from autobahn.twisted.websocket import WebSocketServerFactory, WebSocketServerProtocol
 import os.path
+import signal
+import sys
 import ConfigParser
-from collections import deque
+import argparse
+import cProfile
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import timeit
+import traceback
+from collections import deque, namedtuple
+from multiprocessing.pool import ThreadPool
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+try:
+    from urllib import urlencode
+    from urlparse import parse_qsl
+except ImportError:
+    from urllib.parse import parse_qsl, urlencode
 from scipy.signal import detrend
 
+GUI_BASE = tk.Frame if tk is not None else object
+
 def round_decimal(num, decimal):
     '''
     Round a given floating point down number 'num' to the nearest integer
@@ -31,759 +71,5085 @@ def round_decimal(num, decimal):
     return '{0:.8f}'.format(x).rstrip('0').rstrip('.')
 
 
-class TrendLine:
-    def __init__(self, window, dt):
-        self.t = deque()
-        self.y = deque()
-        self.window = window
-        self.dt = dt
-        self.trend = 0
-
-    def append(self,t,y):
-        if self.t and t - self.t[0] > self.window:
-            self.t.popleft()
-            self.y.popleft()
-        self.t.append(t)
-        self.y.append(y)
+def coalesce_tickers(batch):
+    '''
+    Drop every 24hrTicker message in 'batch' which is superseded by a later
+    ticker for the same symbol. All other messages are kept in their
+    original order.
+    '''
+    latest = {}
+    for n, msg in enumerate(batch):
+        if msg['e'] == '24hrTicker':
+            latest[msg['s']] = n
+    return [msg for n, msg in enumerate(batch)
+            if msg['e'] != '24hrTicker' or latest[msg['s']] == n]
 
-    def trend(self):
-        p = np.polyfit(self.t, self.y, 2)
-        localstd = self.local_stdev(self.t,self.y,self.dt)
-        dy = p[0]*(2*self.t[-1]*self.dt + self.dt**2) + p[1]*self.dt
-        if np.absolute(dy) - localstd > 0:
-            if dy > 0:
-                self.trend = 1
-            else:
-                self.trend = -1
-        else:
-            self.trend = 0
-    
-    def local_stdev(self):
-        start = self.t[0]
-        end = self.t[-1] - dt
-        t = np.array(self.t)
-        y = np.array(self.y)
-        localstd = []
-        while start < end:
-            inds = [(t >= start) * (t < start + self.dt)]
-            localy = y[inds]
-            localstd.append(np.std(localy))
-            start += dt
-        return np.min(localstd)
-    
-class BalanceGUI(tk.Frame):
-    def __init__(self, parent, coins):
-        ''' Initialize the GUI and read the config file '''
-        tk.Frame.__init__(self, parent)
-        parent.protocol('WM_DELETE_WINDOW', self.on_closing)
-        self.parent = parent
-        parent.deiconify()
-        self.coins = coins
-        self.coins_base = coins
-        self.queue = Queue.Queue()
-        self.trades_placed = 0
-        self.trades_completed = 0
-        self.trades = []
-        self.headers = self.column_headers()
-        self.read_config()
-        self.initalize_records()
-        
-        #portfolio display
-        self.portfolio_view = tk.LabelFrame(parent, text='Portfolio')
-        self.portfolio_view.grid(row=0, column=0, columnspan=2, sticky=tk.E + tk.W + tk.N + tk.S)
-        self.portfolio = ttk.Treeview(self.portfolio_view, height = len(self.coins), selectmode = 'extended')
-        self.portfolio['columns']=('Stored',
-                                   'Exchange',
-                                   'Locked',
-                                   'Target',
-                                   'Actual',
-                                   'Bid',
-                                   'Ask',
-                                   'Action',
-                                   'Status',
-                                   'Event'
-                                   )
-        for label in self.portfolio['columns']:
-            if label == 'Status' or label == 'Event':
-                self.portfolio.column(label, width=200)
-            elif label == 'Action':
-                self.portfolio.column(label, width=120)
-            else:
-                self.portfolio.column(label, width=100)
-            self.portfolio.heading(label, text=label)
-        self.portfolio.grid(row=0,column=0)
 
-        for i in range(2):
-            self.parent.columnconfigure(i,weight=1, uniform='parent')
-            
-        #options display
-        self.controls_view = tk.LabelFrame(parent, text='Controls')
-        for i in range(4):
-            self.controls_view.columnconfigure(i,weight=1, uniform='controls')
-        self.controls_view.grid(row=1, column=0, sticky=tk.E + tk.W + tk.N + tk.S)
-        
-        self.key_label = tk.Label(self.controls_view, text='API Key', relief='ridge')
-        self.key_label.grid(row=0, column=0,sticky=tk.E + tk.W)
-        
-        self.secret_label = tk.Label(self.controls_view, text='API Secret', relief='ridge')
-        self.secret_label.grid(row=1, column=0,sticky=tk.E + tk.W)
-        
-        self.key_entry = tk.Entry(self.controls_view, show='*')
-        self.key_entry.grid(row=0, column=1, columnspan=2,sticky=tk.E + tk.W)
-        
-        self.secret_entry = tk.Entry(self.controls_view, show='*')
-        self.secret_entry.grid(row=1, column=1, columnspan=2, sticky=tk.E + tk.W)
-        
-        self.login = tk.Button(self.controls_view,
-                               text='Login',
-                               command = self.api_enter)
-        self.login.grid(row=0, column=3, rowspan=2, sticky=tk.E + tk.W + tk.N+tk.S)
+class TrendLine(object):
+    '''
+    Detects the trend of a price series from a quadratic least squares fit
+    over the last 'window' seconds, compared against the standard deviation
+    of the price over the last 'dt' seconds. Both come from running sums
+    which are updated as points enter and leave their window, so appending
+    a point and reading the trend take constant time however many points
+    the window holds.
 
-        #Statistics display
-        self.stats_view = tk.LabelFrame(parent, text='Statistics')
-        self.stats_view.grid(row=1, column=1, sticky=tk.E + tk.W + tk.N + tk.S)
-        for i in range(4):
-            self.stats_view.columnconfigure(i,weight=1, uniform='stats')
+    Times are measured from an origin near the start of the window in units
+    of the window length and prices from a recent reference price, which
+    keeps the power sums well conditioned. The sums are shifted in constant
+    time whenever the window has slid a full length past the origin.
+    '''
+    def __init__(self, window, dt):
+        self.window = float(window)
+        self.dt = float(dt)
+        self.points = deque()
+        self.local = deque()
+        self.direction = 0
+        self.reset(0.0, 0.0)
 
-        
-        self.trade_currency_value_label = tk.Label(self.stats_view, text=self.trade_currency + ' Value:', relief='ridge')
-        self.trade_currency_value_label.grid(row=0, column=0, sticky=tk.E + tk.W)
-        self.trade_currency_value_string = tk.StringVar()
-        self.trade_currency_value_string.set('0')
-        self.trade_currency_value = tk.Label(self.stats_view, textvariable=self.trade_currency_value_string)
-        self.trade_currency_value.grid(row=0, column=1, sticky=tk.E + tk.W)
+    def __len__(self):
+        return self.n
 
-        self.imbalance_label = tk.Label(self.stats_view, text='Imbalance:', relief='ridge')
-        self.imbalance_label.grid(row=1, column=0, sticky=tk.E + tk.W)
-        self.imbalance_string = tk.StringVar()
-        self.imbalance_string.set('0%')
-        self.imbalance_value = tk.Label(self.stats_view, textvariable=self.imbalance_string)
-        self.imbalance_value.grid(row=1, column=1, sticky=tk.E + tk.W)
+    def reset(self, origin, reference):
+        ''' Clear the running sums and measure from a new origin and reference '''
+        self.origin = origin
+        self.reference = reference
+        self.n = 0
+        self.u1 = self.u2 = self.u3 = self.u4 = 0.0
+        self.v0 = self.v1 = self.v2 = 0.0
+        self.m = 0
+        self.l1 = self.l2 = 0.0
 
+    def append(self, t, y):
+        ''' Add a point and drop every point which has left its window '''
+        while self.points and t - self.points[0][0] > self.window:
+            self.add(*self.points.popleft(), sign=-1.0)
+        while self.local and t - self.local[0][0] > self.dt:
+            self.add_local(self.local.popleft()[1], sign=-1.0)
+        if not self.points:
+            self.local.clear()
+            self.reset(t, y)
+        elif self.points[0][0] - self.origin > self.window:
+            self.rebase(self.points[0][0], y)
+        self.points.append((t, y))
+        self.local.append((t, y))
+        self.add(t, y, 1.0)
+        self.add_local(y, 1.0)
 
-        self.messages_queued_label = tk.Label(self.stats_view, text='Status', relief='ridge')
-        self.messages_queued_label.grid(row=0, column=2, sticky=tk.E + tk.W)
-        
-        self.messages_string = tk.StringVar()
-        self.messages_string.set('Up to Date')
-        self.messages_queued = tk.Label(self.stats_view, textvariable=self.messages_string)
-        self.messages_queued.grid(row=0, column=3, sticky=tk.E + tk.W)
+    def add(self, t, y, sign):
+        u = (t - self.origin) / self.window
+        v = y - self.reference
+        uu = u * u
+        self.n += int(sign)
+        self.u1 += sign * u
+        self.u2 += sign * uu
+        self.u3 += sign * uu * u
+        self.u4 += sign * uu * uu
+        self.v0 += sign * v
+        self.v1 += sign * u * v
+        self.v2 += sign * uu * v
 
-        
-        self.trades_label = tk.Label(self.stats_view, text='Trades Placed:', relief='ridge')
-        self.trades_label.grid(row=1, column=2, sticky=tk.E + tk.W)
-        self.trades_count = tk.IntVar()
-        self.trades_count.set(0)
-        self.trades_count_display = tk.Label(self.stats_view, textvariable=self.trades_count)
-        self.trades_count_display.grid(row=1, column=3, sticky=tk.E + tk.W)
+    def add_local(self, y, sign):
+        v = y - self.reference
+        self.m += int(sign)
+        self.l1 += sign * v
+        self.l2 += sign * v * v
 
-    def read_config(self):
-        s_to_ms = 1000
-        config = ConfigParser.RawConfigParser(allow_no_value=False)
-        config.read('config.ini')
-        self.trade_currency = config.get('trades', 'trade_currency')
-        if self.trade_currency != 'BTC':
-            self.display_error('Config Error',
-                               '{0} trading pairs are not supported yet, only BTC'.format(self.trade_currency),
-                               quit_on_exit=True)
-        self.rebalance_time = int(config.get('trades', 'rebalance_period')) * s_to_ms
-        if self.rebalance_time <= 0:
-            self.display_error('Config Error',
-                               'Rebalance period must be a positive integer (seconds)',
-                               quit_on_exit=True)
-        self.min_trade_value = float(config.get('trades', 'min_trade_value'))
-        if self.min_trade_value <= 0:
-            self.min_trade_value = None
-        self.trade_type = config.get('trades', 'trade_type')
-        if self. trade_type != 'MARKET' and self.trade_type != 'LIMIT':
-            self.display_error('Config Error',
-                               '{0} is not a supported trade type. Use MARKET or LIMIT'.format(trade_type),
-                               quit_on_exit=True)
-        self.ignore_backlog = int(config.get('websockets', 'ignore_backlog'))
-        
-    def on_closing(self):
-        ''' Check that all trades have executed
-        before starting the save and exit process
-        '''
-        if self.trades_placed > 0 and self.trades_completed < self.trades_placed:
-            if messagebox.askokcancel('Quit', 'Not all trades have completed. Quit anyway?'):
-                self.save_and_quit()
-        else:
-            self.save_and_quit()
+    def rebase(self, origin, reference):
+        ''' Shift the running sums to a new origin and reference price '''
+        d = (origin - self.origin) / self.window
+        e = reference - self.reference
+        n = self.n
+        u1, u2, u3, u4 = self.u1, self.u2, self.u3, self.u4
+        v0, v1, v2 = self.v0, self.v1, self.v2
+        self.u1 = u1 - n * d
+        self.u2 = u2 - 2 * d * u1 + n * d * d
+        self.u3 = u3 - 3 * d * u2 + 3 * d * d * u1 - n * d ** 3
+        self.u4 = u4 - 4 * d * u3 + 6 * d * d * u2 - 4 * d ** 3 * u1 + n * d ** 4
+        self.v0 = v0 - n * e
+        self.v1 = v1 - d * v0 - e * self.u1
+        self.v2 = v2 - 2 * d * v1 + d * d * v0 - e * self.u2
+        self.l2 = self.l2 - 2 * e * self.l1 + self.m * e * e
+        self.l1 = self.l1 - self.m * e
+        self.origin = origin
+        self.reference = reference
 
-    def save_and_quit(self):
+    def fit(self):
         '''
-        If trades have been executed in the current session,
-        save them to file. Stop all websockets and exit the GUI.
+        Coefficients (a2, a1, a0) of the quadratic fit in window units, or
+        None if the window holds fewer than three distinct points.
         '''
-        if self.trades:
-            df = pd.DataFrame(self.trades)
-            if os.path.isfile('trade_history.csv'):
-                with open('trade_history.csv','a') as f:
-                    df.to_csv(f, sep=',', header=False, index=False)
-            else:
-                with open('trade_history.csv','w') as f:
-                    df.to_csv(f, sep=',', header=True, index=False)
-        for coin in self.coins['coin']:
-            pair = coin+self.trade_currency
-            self.records[pair].close()
-        try:
-            self.bm.close()
-            reactor.stop()
-        except AttributeError:
-            self.parent.destroy()
-        else:
-            self.parent.destroy()
+        n = float(self.n)
+        u1, u2, u3, u4 = self.u1, self.u2, self.u3, self.u4
+        v0, v1, v2 = self.v0, self.v1, self.v2
+        det = u4 * (u2 * n - u1 * u1) - u3 * (u3 * n - u1 * u2) + u2 * (u3 * u1 - u2 * u2)
+        if self.n < 3 or det <= 0:
+            return None
+        a2 = v2 * (u2 * n - u1 * u1) - u3 * (v1 * n - u1 * v0) + u2 * (v1 * u1 - u2 * v0)
+        a1 = u4 * (v1 * n - u1 * v0) - v2 * (u3 * n - u1 * u2) + u2 * (u3 * v0 - v1 * u2)
+        a0 = u4 * (u2 * v0 - v1 * u1) - u3 * (u3 * v0 - v1 * u2) + v2 * (u3 * u1 - u2 * u2)
+        return a2 / det, a1 / det, a0 / det + self.reference
 
-    def exit_error(self):
-        if self.quit_on_exit:
-            self.top.destroy()
-            self.save_and_quit()
-        else:
-            self.top.destroy()
+    def change(self):
+        ''' Change in price the fit predicts over the next 'dt' seconds '''
+        p = self.fit()
+        if p is None:
+            return 0.0
+        u = (self.points[-1][0] - self.origin) / self.window
+        du = self.dt / self.window
+        return p[0] * (2 * u * du + du * du) + p[1] * du
 
-    def display_error(self, title, error, quit_on_exit=False):
-        self.quit_on_exit = quit_on_exit
-        self.top = tk.Toplevel()
-        self.top.title('Login Error')
-        msg = tk.Message(self.top, text=error)
-        msg.grid(row=0, column=0)
-        button = tk.Button(self.top, text="Dismiss", command=self.exit_error)
-        button.grid(row=1, column=0)
-        self.top.attributes('-topmost', 'true')
-            
-    def api_enter(self):
+    def local_stdev(self):
+        ''' Standard deviation of the price over the last 'dt' seconds '''
+        if not self.m:
+            return 0.0
+        mean = self.l1 / self.m
+        return max(self.l2 / self.m - mean * mean, 0.0) ** 0.5
+
+    def trend(self):
         '''
-        Log in to Binance with the provided credentials,
-        update user portfolio and start listening to price and
-        account update websockets.
+        Update and return the direction of the trend: 1 or -1 when the
+        predicted change exceeds the local deviation, otherwise 0.
         '''
-        api_key = self.key_entry.get()
-        self.key_entry.delete(0,'end')
-        api_secret = self.secret_entry.get()
-        self.secret_entry.delete(0,'end')
-        
-        try:
-            self.client = Client(api_key, api_secret)
-            status = self.client.get_system_status()
-        except (BinanceRequestException,
-                BinanceAPIException) as e:
-            self.display_error('Login Error', e.message)
+        dy = self.change()
+        if abs(dy) - self.local_stdev() > 0:
+            self.direction = 1 if dy > 0 else -1
         else:
-            try:
-                self.populate_portfolio()
-            except BinanceAPIException as e:
-                self.display_error('API Error', e.message, quit_on_exit=True)
-            else:
-                self.start_websockets()
-            
-            
-            
-    def start_websockets(self):
-        '''
-        Start websockets to get price updates for all coins in the portfolio,
-        trade execution reports, and user account balance updates.
-        Start the message queue processor.
-        '''
-        self.bm = BinanceSocketManager(self.client)
-        trade_currency = self.trade_currency
-        symbols = self.coins['symbol'].tolist()
-        symbols.remove(trade_currency+trade_currency)
-        self.sockets = {}
-        for symbol in symbols:
-            self.sockets[symbol] = self.bm.start_symbol_ticker_socket(symbol, self.queue_msg)
-            self.sockets[symbol+'kline'] = self.bm.start_kline_socket(symbol, self.queue_msg)
-        self.sockets['user'] = self.bm.start_user_socket(self.queue_msg)
-        self.bm.start()
-        self.parent.after_idle(self.parent.after,1,self.process_queue)
-
-    def initalize_records(self):
-        self.records = dict()
-        for coin in self.coins['coin']:
-            pair = coin+self.trade_currency
-            self.records[pair] = open(pair + '.csv','a+',1) #unbuffered
-            
-    def populate_portfolio(self):
-        '''
-        Get all symbol info from Binance needed to
-        populate user portfolio data and execute trades
-        '''
-        self.coins = self.coins_base
-        self.portfolio.delete(*self.portfolio.get_children())
-        exchange_coins = []
-        trade_currency = self.trade_currency
-        self.trade_coin = trade_currency
-        self.trendlines = {}
+            self.direction = 0
+        return self.direction
 
 
-        #update the GUI context
-        self.key_label.destroy()
-        self.key_entry.destroy()
-        self.secret_label.destroy()
-        self.secret_entry.destroy()
-        self.login.destroy()
-        
-        updatetext = tk.StringVar()
-        updatetext.set('Initializing')
-        self.progresslabel = tk.Label(self.controls_view, textvariable=updatetext)
-        self.progresslabel.grid(row=1, column=0, columnspan=4, sticky=tk.E + tk.W)
-        progress_var = tk.DoubleVar()
-        progress = 0
-        progress_var.set(progress)
-        self.progressbar = ttk.Progressbar(self.controls_view, variable=progress_var, maximum=len(self.coins))
-        self.progressbar.grid(row=0, column=0, columnspan=4, sticky=tk.E + tk.W)
-        for coin in self.coins['coin']:
-            self.progressbar.update()
-            progress += 1
-            progress_var.set(progress)
-            updatetext.set('Fetching {0} account information'.format(coin))
-            self.progresslabel.update()
-            pair = coin+trade_currency
-            balance = self.client.get_asset_balance(asset=coin)
-            if coin != trade_currency:
-                price = float(self.client.get_symbol_ticker(symbol=pair)['price'])
-                symbolinfo = self.client.get_symbol_info(symbol=pair)['filters']
-                minvalue = float(symbolinfo[3]['minNotional'])
-                if self.min_trade_value is not None:
-                    minvalue = self.min_trade_value
-                row = {'coin':              coin,
-                       'exchange_balance':  float(balance['free']),
-                       'locked_balance':    float(balance['locked']),
-                       'minprice':          float(symbolinfo[0]['minPrice']),
-                       'maxprice':          float(symbolinfo[0]['maxPrice']),
-                       'ticksize':          float(symbolinfo[0]['tickSize']),
-                       'minqty':            float(symbolinfo[2]['minQty']),
-                       'maxqty':            float(symbolinfo[2]['maxQty']),
-                       'stepsize':          float(symbolinfo[2]['stepSize']),                   
-                       'minnotional':       minvalue,
-                       'symbol':            pair,
-                       'askprice' :         price,
-                       'bidprice':          price,
-                       'price':             price,
-                       'last_placement':    None,
-                       'last_execution':    None
-                       }
-                self.trendlines[coin] = TrendLine(1,1)
-            else:
-                fixed_balance = self.coins.loc[self.coins['coin'] == coin]['fixed_balance']
-                row = {'coin':              coin,
-                       'exchange_balance':  float(balance['free']),
-                       'locked_balance':    float(balance['locked']),
-                       'minprice':          0,
-                       'maxprice':          0,
-                       'ticksize':          0,
-                       'minqty':            0,
-                       'maxqty':            0,
-                       'stepsize':          0,                   
-                       'minnotional':       0,
-                       'symbol':            coin+coin,
-                       'askprice' :         1.0,
-                       'bidprice':          1.0,
-                       'price':             1.0,
-                       'last_placement':    None,
-                       'last_execution':    None
-                       }
-            exchange_coins.append(row)
-        exchange_coins = pd.DataFrame(exchange_coins)
-        self.coins = pd.merge(self.coins, exchange_coins, on='coin', how='outer')
-        self.coins['value'] = self.coins.apply(lambda row: row.price * (row.exchange_balance +
-                                                                        row.fixed_balance), axis=1)
-        self.total = np.sum(self.coins['value'])
-        self.coins['actual'] = self.coins.apply(lambda row: 100.0 * row.value/self.total, axis=1)
-        self.update_status()
-        i = 0
-        for row in self.coins.itertuples():
-            self.portfolio.insert('' ,
-                                  i,
-                                  iid=row.coin,
-                                  text=row.coin,
-                                  values=(row.fixed_balance,
-                                          row.exchange_balance,
-                                          row.locked_balance,
-                                          '{0} %'.format(row.allocation),
-                                          '{0:.2f} %'.format(row.actual),
-                                          round_decimal(row.price, row.ticksize),
-                                          round_decimal(row.price, row.ticksize),
-                                          '',
-                                          ''
-                                          )
-                                  )
-            i += 1
-        updatetext.set('Testing connection'.format(coin))
-        self.dryrun()
-        self.progressbar.destroy()
-        self.progresslabel.destroy()
+class PortfolioState(object):
+    '''
+    Array-backed store for the per-coin portfolio data. Every coin is mapped
+    to a fixed row index so that a single-coin update is a handful of O(1)
+    array writes instead of boolean mask scans over a DataFrame.
 
-        self.automate=tk.BooleanVar()
-        self.automate.set(False)
-        self.automate_text = tk.StringVar()
-        self.automate_text.set('Start Automation')
-        self.toggle_automate = tk.Button(self.controls_view,
-                                         textvariable=self.automate_text,
-                                         command=lambda: self.automation(toggle=True))
-        self.toggle_automate.grid(row=0, column=0, rowspan=2, columnspan=2, sticky=tk.E + tk.W + tk.N + tk.S)
-        self.sell_button = tk.Button(self.controls_view,
-                                     text='Execute Sells',
-                                     command=self.execute_sells)
-        self.sell_button.grid(row=0, column=2, columnspan=2, sticky=tk.E + tk.W)
-        self.buy_button = tk.Button(self.controls_view,
-                                    text='Execute Buys',
-                                    command=self.execute_buys)
-        self.buy_button.grid(row=1, column=2, columnspan=2, sticky=tk.E + tk.W)
-        
-    def update_status(self):
-        '''Update the statistics frame whenever a change occurs in balance or price'''
-        value = '{0:.8f}'.format(self.total)
-        diff = np.diff(self.coins['actual'].values - self.coins['allocation'].values)
-        imbalance = '{0:.2f}%'.format(np.sum(np.absolute(diff)))
-        self.trade_currency_value_string.set(value)
-        self.imbalance_string.set(imbalance)
-        
-    def queue_msg(self, msg):
-        '''
-        Whenever a weboscket receives a message, check for errors.
-        If an error occurs, restart websockets. If no error, add it to
-        the message queue.
-        '''
-        if msg['e'] == 'error':
-            self.bm.close()
-            reactor.stop()
-            self.start_websockets()
-        else:
-            self.queue.put(msg)
+    The portfolio total is kept up to date incrementally from the change in
+    value of each updated coin and is resynced from scratch every
+    'resync_interval' updates so that floating point drift cannot build up.
+    Actual allocations are only recomputed when they are read.
+    '''
+    columns = ('fixed_balance',
+               'allocation',
+               'exchange_balance',
+               'locked_balance',
+               'minprice',
+               'maxprice',
+               'ticksize',
+               'minqty',
+               'maxqty',
+               'stepsize',
+               'minnotional',
+               'askprice',
+               'bidprice',
+               'price',
+               'value',
+               'last_placement',
+               'last_order',
+               'last_execution',
+               'open_orders')
 
-    def get_msg(self):
-        '''Reroute new websocket messages to the appropriate handler'''
-        try:
-            msg = self.queue.get(block=False)
-        except Queue.Empty:
-            pass
-        else:
-            if msg['e'] == '24hrTicker':
-                self.update_price(msg)
-            elif msg['e'] == 'outboundAccountInfo':
-                self.update_balance(msg)
-            elif msg['e'] == 'executionReport':
-                self.update_trades(msg)
-            elif msg['e'] == 'kline':
-                self.update_trends(msg)
-                
-    def process_queue(self, flush=False):
-        '''
-        Check for new messages in the queue periodically.
-        Recursively calls itself to perpetuate the process.
-        '''
-        if flush:
-            while not self.queue.empty():
-                self.get_msg()
-        else:
-            self.get_msg()
-            self.master.after_idle(self.master.after,1,self.process_queue)
-        n = self.queue.qsize()
-        if n > self.ignore_backlog:
-            self.messages_string.set('{0} Updates Queued'.format(n))
-        else:
-            self.messages_string.set('Up to Date')
+    def __init__(self, coins, fixed_balance, allocation, trade_currency, resync_interval=1000):
+        self.coins = list(coins)
+        self.trade_currency = trade_currency
+        self.symbols = [coin + trade_currency for coin in self.coins]
+        self.index = {coin: i for i, coin in enumerate(self.coins)}
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.trade_index = self.index[trade_currency]
+        self.symbols[self.trade_index] = trade_currency + trade_currency
+        n = len(self.coins)
+        for column in self.columns:
+            setattr(self, column, np.zeros(n))
+        self.fixed_balance[:] = np.asarray(fixed_balance, dtype=float)
+        self.allocation[:] = np.asarray(allocation, dtype=float)
+        self.last_placement[:] = np.nan
+        self.last_order[:] = np.nan
+        self.last_execution[:] = np.nan
+        self._actual = np.zeros(n)
+        self._actual_stale = True
+        self.total = 0.0
+        self.resync_interval = resync_interval
+        self.updates = 0
 
-    def update_trends(self, msg):
-        if msg['k']['x']:
-            coin = msg['s'][:-len(self.trade_coin)]
-            self.trendlines[coin].append(float(msg['k']['T'])/1000., float(msg['k']['c'])/1000.)
+    def __len__(self):
+        return len(self.coins)
 
-    def update_trades(self, msg):
-        ''' Update balances whenever a partial execution occurs '''
-        coin = msg['s'][:-len(self.trade_coin)]
-        savemsg = {self.headers[key] : value for key, value in msg.items()}
-        filled = float(savemsg['cumulative_filled_quantity'])
-        orderqty = float(savemsg['order_quantity'])
-        side = savemsg['side']
-        if filled >= orderqty:
-            self.coins.loc[self.coins['coin'] == coin, 'last_execution'] = time.mktime(datetime.now().timetuple())
-            self.trades_completed += 1
-            self.trades_count.set(self.trades_completed)
-        self.portfolio.set(coin, column='Event', value = '{0} {1}/{2} {3}'.format(side, filled, orderqty,datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        self.trades.append(savemsg)    
+    def set_row(self, coin, **fields):
+        ''' Set any number of columns for a single coin '''
+        i = self.index[coin]
+        for column, value in fields.items():
+            getattr(self, column)[i] = value
+        return i
 
-    def update_balance(self, msg):
-        '''
-        Update user balances internally and on the
-        display whenever an account update message is received.
-        '''
-        balances = msg['B']
-        coins = self.coins['coin'].values
-        for balance in balances:
-            coin = balance['a']
-            if coin in coins:
-                exchange_balance = float(balance['f']) + float(balance['l'])
-                locked_balance = float(balance['l'])
-                self.portfolio.set(coin, column='Exchange', value=round_decimal(exchange_balance,self.coins.loc[self.coins['coin'] == coin]['stepsize'].values[0]))
-                self.portfolio.set(coin, column='Locked', value=round_decimal(locked_balance,self.coins.loc[self.coins['coin'] == coin]['stepsize'].values[0]))
-                self.coins.loc[self.coins['coin'] == coin, 'exchange_balance'] = exchange_balance
-                self.coins.loc[self.coins['coin'] == coin, 'locked_balance'] = locked_balance
-                ask = self.coins.loc[self.coins['coin'] == coin, 'askprice'].values[0]
-                value = (self.coins.loc[self.coins['coin'] == coin, 'exchange_balance'].values[0] +
-                         self.coins.loc[self.coins['coin'] == coin, 'fixed_balance'].values[0]) * ask
-                self.coins.loc[self.coins['coin'] == coin, 'value'] = value
-
-        self.total = np.sum(self.coins['value']) 
-        self.coins['actual'] = self.coins.apply(lambda row: 100.0 * row.value / self.total, axis=1)
-        for row in self.coins.itertuples():
-            coin = row.coin
-            actual = '{0:.2f}%'.format(self.coins.loc[self.coins['coin'] == coin, 'actual'].values[0])
-            self.portfolio.set(coin, column='Actual', value=actual)
-        self.update_actions()
-        self.update_status()
-        
-    def update_price(self, msg):
-        '''
-        Update symbol prices and user allocations internally
-        and on the display whenever a price update is received.
-        '''
-        coin = msg['s'][:-len(self.trade_currency)]
-        ask = float(msg['a'])
-        bid = float(msg['b'])
-        askprice = round_decimal(ask,self.coins.loc[self.coins['coin'] == coin, 'ticksize'].values[0])
-        bidprice = round_decimal(bid,self.coins.loc[self.coins['coin'] == coin, 'ticksize'].values[0])
-        self.portfolio.set(coin, column='Ask', value=askprice)
-        self.coins.loc[self.coins['coin'] == coin, 'askprice'] = ask
-        self.portfolio.set(coin, column='Bid', value=bidprice)
-        self.coins.loc[self.coins['coin'] == coin, 'bidprice'] = bid
-        value = (self.coins.loc[self.coins['coin'] == coin, 'exchange_balance'].values[0] +
-                 self.coins.loc[self.coins['coin'] == coin, 'fixed_balance'].values[0]) * ask
-        self.coins.loc[self.coins['coin'] == coin, 'value'] = value
-        self.total = np.sum(self.coins['value'])
-        self.coins['actual'] = self.coins.apply(lambda row: 100.0 * row.value / self.total, axis=1)
-        for row in self.coins.itertuples():
-            coin = row.coin
-            actual = '{0:.2f}%'.format(self.coins.loc[self.coins['coin'] == coin, 'actual'].values[0])
-            self.portfolio.set(coin, column='Actual', value=actual)
-        self.update_actions()
-        self.update_status()
-        self.print_price(msg)
+    @property
+    def actual(self):
+        ''' Actual allocation of every coin in percent, recomputed on demand '''
+        if self._actual_stale:
+            np.multiply(self.value, 100.0 / self.total, out=self._actual)
+            self._actual_stale = False
+        return self._actual
 
-    def print_price(self, msg):
-        pair = msg['s']
-        avg_price = float(msg['w'])
-        time = float(msg['E'])
-        mid_price = (float(msg['b']) + float(msg['a']))/2.0
-        self.records[pair].write('{0},{1},{2}\n'.format(time,avg_price,mid_price))
+    def set_price(self, i, bid, ask):
+        ''' Store a new bid/ask for row i and revalue the holding at the ask '''
+        self.bidprice[i] = bid
+        self.askprice[i] = ask
+        self.price[i] = ask
+        self.set_value(i, (self.exchange_balance[i] + self.fixed_balance[i]) * ask)
 
-    def update_actions(self):
+    def set_balance(self, i, exchange_balance, locked_balance):
+        ''' Store new exchange balances for row i and revalue the holding '''
+        self.exchange_balance[i] = exchange_balance
+        self.locked_balance[i] = locked_balance
+        self.set_value(i, (exchange_balance + self.fixed_balance[i]) * self.askprice[i])
+
+    def set_value(self, i, value):
+        ''' Apply the change in value of row i to the running total '''
+        self.total += value - self.value[i]
+        self.value[i] = value
+        self._actual_stale = True
+        self.updates += 1
+        if self.updates >= self.resync_interval:
+            self.resync()
+
+    def resync(self):
+        ''' Recompute the portfolio total from every holding '''
+        self.total = np.sum(self.value)
+        self._actual_stale = True
+        self.updates = 0
+
+    def initialize_values(self):
+        ''' Value every holding at its reference price '''
+        self.value[:] = self.price * (self.exchange_balance + self.fixed_balance)
+        self.resync()
+
+    def pending_orders(self):
+        ''' Mask of the coins with an order which is on the book or has not been acknowledged yet '''
+        with np.errstate(invalid='ignore'):
+            placed = ~np.isnan(self.last_placement) & ~(self.last_execution >= self.last_placement)
+        return placed | (self.open_orders > 0)
+
+    def imbalance(self):
+        ''' Total deviation from the target allocation in percent '''
+        return np.sum(np.absolute(np.diff(self.actual - self.allocation)))
+
+    def tradecoin_free(self):
+        ''' Unlocked balance of the trade currency held on the exchange '''
+        i = self.trade_index
+        return self.exchange_balance[i] - self.locked_balance[i]
+
+
+class DriftTrigger(object):
+    '''
+    Decides when the portfolio has drifted far enough from its target
+    allocation to be rebalanced: when a coin's actual allocation is more
+    than 'coin_band' percentage points off its target, or the imbalance
+    is over 'total_band' percent. A band of 0 is never crossed. Coins with
+    an order placed in the last 'cooldown' seconds are left out, a drift
+    must last 'debounce' seconds, and no rebalance is due within
+    'min_interval' seconds of the last one.
+    '''
+    def __init__(self, coin_band, total_band, min_interval, debounce, cooldown):
+        self.coin_band = coin_band
+        self.total_band = total_band
+        self.min_interval = min_interval
+        self.debounce = debounce
+        self.cooldown = cooldown
+        self.enabled = coin_band > 0 or total_band > 0
+        self.drifting_since = None
+        self.last_rebalance = 0.0
+
+    def drift(self, state, now):
+        ''' Why the portfolio counts as drifted, or None '''
+        deviation = state.actual - state.allocation
+        with np.errstate(invalid='ignore'):
+            #last_placement is cleared once the order fills, last_order is not
+            deviation[now - state.last_order < self.cooldown] = 0.0
+        if self.coin_band > 0:
+            #the trade currency only moves when other coins are traded
+            off = np.absolute(deviation)
+            off[state.trade_index] = 0.0
+            i = np.argmax(off)
+            if off[i] > self.coin_band:
+                return '{0} is {1:+.2f}% off target'.format(state.coins[i], deviation[i])
+        if self.total_band > 0:
+            #as PortfolioState.imbalance, without the coins cooling down
+            imbalance = np.sum(np.absolute(np.diff(deviation)))
+            if imbalance > self.total_band:
+                return 'Imbalance is {0:.2f}%'.format(imbalance)
+        return None
+
+    def check(self, state, now):
+        ''' The reason to rebalance now, or None '''
+        reason = self.drift(state, now)
+        if reason is None:
+            self.drifting_since = None
+            return None
+        if self.drifting_since is None:
+            self.drifting_since = now
+        if now - self.drifting_since < self.debounce or now - self.last_rebalance < self.min_interval:
+            return None
+        return reason
+
+    def rebalanced(self, now):
+        self.last_rebalance = now
+        self.drifting_since = None
+
+
+class RebalancePlan(object):
+    '''
+    The trade required to bring every coin back to its target allocation.
+    Built for the whole portfolio in one vectorized pass by plan_rebalance
+    and shared by the display and the order executor.
+    '''
+    READY = 0
+    TRADE_READY = 1
+    TOO_SMALL = 2
+    TOO_LARGE = 3
+    NO_COIN = 4
+    NO_TRADE_COIN = 5
+    PENDING = 6
+    reasons = {READY:           'Ready',
+               TRADE_READY:     'Trade Ready',
+               TOO_SMALL:       'Trade value too small ({percent:.0f}%)',
+               TOO_LARGE:       'Trade quantity too large',
+               NO_COIN:         'Insufficient {coin} for sale',
+               NO_TRADE_COIN:   'Insufficient {trade_coin} for purchase',
+               PENDING:         'Order pending'}
+
+    def __init__(self, state, buy, qty, price, status, percent):
+        self.state = state
+        self.buy = buy
+        self.qty = qty
+        self.price = price
+        self.status = status
+        self.percent = percent
+
+    def side(self, i):
+        return SIDE_BUY if self.buy[i] else SIDE_SELL
+
+    def action(self, i):
+        return '{0} {1}'.format(self.side(i), round_decimal(self.qty[i], self.state.stepsize[i]))
+
+    def reason(self, i):
+        return self.reasons[self.status[i]].format(percent=self.percent[i],
+                                                   coin=self.state.coins[i],
+                                                   trade_coin=self.state.trade_currency)
+
+    def rows(self, side):
+        ''' Indices of every coin which needs a trade on 'side' '''
+        return np.flatnonzero(self.buy if side == SIDE_BUY else ~self.buy)
+
+
+def plan_rebalance(state):
+    '''
+    Work out the side, quantity, price and status of the trade required
+    for every coin in 'state' without any per-coin Python code.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dif = (state.allocation - state.actual) / 100.0 * state.total / state.price
+        buy = dif > 0
+        qty = np.absolute(dif)
+        price = np.where(buy, state.askprice, state.bidprice)
+        value = qty * price
+        percent = 100.0 * value / state.minnotional
+    status = np.select([np.arange(len(state)) == state.trade_index,
+                        (qty < state.minqty) | (value < state.minnotional),
+                        qty > state.maxqty,
+                        ~buy & (qty > state.exchange_balance - state.locked_balance),
+                        buy & (value > state.tradecoin_free()),
+                        state.pending_orders()],
+                       [RebalancePlan.READY,
+                        RebalancePlan.TOO_SMALL,
+                        RebalancePlan.TOO_LARGE,
+                        RebalancePlan.NO_COIN,
+                        RebalancePlan.NO_TRADE_COIN,
+                        RebalancePlan.PENDING],
+                       RebalancePlan.TRADE_READY)
+    #the buys of a pass are placed together and paid from the same free balance, so once
+    #their running total in row order exceeds it the rest have to wait for the next pass
+    ready = buy & (status == RebalancePlan.TRADE_READY)
+    committed = np.cumsum(np.where(ready, value, 0.0))
+    status[ready & (committed > state.tradecoin_free())] = RebalancePlan.NO_TRADE_COIN
+    return RebalancePlan(state, buy, qty, price, status, percent)
+
+
+OpenOrder = namedtuple('OpenOrder', ['order_id',
+                                     'client_id',
+                                     'symbol',
+                                     'side',
+                                     'type',
+                                     'price',
+                                     'quantity',
+                                     'filled',
+                                     'created'])
+
+#order statuses of execution reports for orders which are still on the book
+LIVE_ORDER_STATUSES = ('NEW', 'PARTIALLY_FILLED', 'PENDING_CANCEL')
+
+#prefix of the client order ids of orders placed by this app
+CLIENT_ORDER_PREFIX = 'bbal-'
+
+
+class OrderIndex(object):
+    '''
+    The live orders of the account by order id and by symbol. Loaded from
+    a single open orders snapshot, then kept up to date from execution
+    reports, so no per-symbol order queries are needed. 'cancelling'
+    holds the ids of orders whose cancellation has been requested.
+    '''
+    def __init__(self):
+        self.orders = {}
+        self.symbols = {}
+        self.cancelling = set()
+
+    def load(self, open_orders):
+        ''' Replace the index with a get_open_orders snapshot '''
+        self.orders = {}
+        self.symbols = {}
+        for order in open_orders:
+            self.add(OpenOrder(order['orderId'], order['clientOrderId'], order['symbol'], order['side'],
+                               order['type'], float(order['price']), float(order['origQty']),
+                               float(order['executedQty']), order['time'] / 1000.0))
+        self.cancelling &= set(self.orders)
+
+    def add(self, order):
+        self.orders[order.order_id] = order
+        self.symbols.setdefault(order.symbol, {})[order.order_id] = order
+
+    def remove(self, order_id):
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            del self.symbols[order.symbol][order_id]
+        self.cancelling.discard(order_id)
+        return order
+
+    def update(self, msg):
         '''
-        Calcuate required trades and update the main GUI
+        Apply an executionReport. Returns the order if the report ended it
+        (filled, cancelled, rejected or expired), otherwise None.
         '''
-        for row in self.coins.itertuples():
-            tradecoin_balance = np.squeeze(self.coins[self.coins['coin'] == self.trade_coin]['exchange_balance'].values)
-            tradecoin_locked = np.squeeze(self.coins[self.coins['coin'] == self.trade_coin]['locked_balance'].values)
-            tradecoin_free = tradecoin_balance - tradecoin_locked
-            dif = (row.allocation - row.actual) / 100.0 * self.total / row.price
+        if msg['X'] in LIVE_ORDER_STATUSES:
+            self.add(OpenOrder(msg['i'], msg['c'], msg['s'], msg['S'], msg['o'], float(msg['p']),
+                               float(msg['q']), float(msg['z']), msg['O'] / 1000.0))
+            return None
+        return self.remove(msg['i'])
 
-            if dif < 0:
-                side = SIDE_SELL
-            if dif > 0:
-                side = SIDE_BUY
-            
-            status = ''
-            coin = row.coin
-            pair = coin + self.trade_coin
-            balance = float(row.exchange_balance) - float(row.locked_balance)
-            actual = row.actual
-            qty = np.absolute(dif)
-
-            action = '{0} {1}'.format(side, round_decimal(qty, row.stepsize))
-            if side == SIDE_SELL:
-                price = row.bidprice
-            if side == SIDE_BUY:
-                price = row.askprice
-            if side == SIDE_SELL and qty > balance and coin != self.trade_coin:
-                status = 'Insufficient ' + coin + ' for sale'
-            if coin == self.trade_coin:
-                status = 'Ready'
-            elif qty < row.minqty or qty * price < row.minnotional:
-                status = status = 'Trade value too small ({0:.0f}%)'.format(100.0 * qty * price / row.minnotional)
-            elif qty > row.maxqty:
-                status = 'Trade quantity too large'
-            elif side == SIDE_BUY and qty * price > tradecoin_free:
-                status = 'Insufficient ' + self.trade_coin + ' for purchase'
-            else:
-                status = 'Trade Ready'
-            self.portfolio.set(coin, column='Status', value=status)
-            self.portfolio.set(coin, column='Action', value=action)
-            
-    def execute_transactions(self, side, dryrun):
-        '''
-        Calculate the required trade for each coin and execute
-        them if they belong to the appropriate side
-        '''
-        for row in self.coins.itertuples():
-            self.process_queue(flush=True)
-            tradecoin_balance = np.squeeze(self.coins[self.coins['coin'] == self.trade_coin]['exchange_balance'].values)
-            tradecoin_locked = np.squeeze(self.coins[self.coins['coin'] == self.trade_coin]['locked_balance'].values)
-            tradecoin_free = tradecoin_balance - tradecoin_locked
-            dif = (row.allocation - row.actual) / 100.0 * self.total / row.price
-            if dif < 0 and side == SIDE_BUY:
+    def count(self, symbol):
+        return len(self.symbols.get(symbol, ()))
+
+    def stale(self, now, max_age, max_distance, quote):
+        '''
+        LIMIT orders placed by this app which are older than 'max_age'
+        seconds, or priced more than 'max_distance' percent away from
+        quote(symbol, side). A limit of 0 is never exceeded.
+        '''
+        stale = []
+        for order in self.orders.values():
+            if (order.order_id in self.cancelling or order.type != ORDER_TYPE_LIMIT or
+                    not order.client_id.startswith(CLIENT_ORDER_PREFIX)):
                 continue
-            if dif > 0 and side == SIDE_SELL:
+            price = quote(order.symbol, order.side)
+            if price is None:
                 continue
-            status = ''
-            coin = row.coin
-            pair = coin + self.trade_coin
-            balance = float(row.exchange_balance) - float(row.locked_balance)
-            actual = row.actual
-            qty = np.absolute(dif)
-            action = '{0} {1}'.format(side, round_decimal(qty, row.stepsize))
-            last_placement = np.squeeze(self.coins[self.coins['coin'] == coin]['last_placement'].values)
-            last_execution = np.squeeze(self.coins[self.coins['coin'] == coin]['last_execution'].values)            
-            if side == SIDE_SELL:
-                price = row.bidprice
-            if side == SIDE_BUY:
-                price = row.askprice
-            if side == SIDE_SELL and qty > balance and coin != self.trade_coin:
-                status = 'Insufficient ' + coin + ' for sale'
-            if coin == self.trade_coin:
-                status = 'Ready'
-            elif qty < row.minqty or qty * price < row.minnotional:
-                status = 'Trade value too small ({0:.0f}%)'.format(100.0 * qty * price / row.minnotional)
-            elif qty > row.maxqty:
-                status = 'Trade quantity too large'
-            elif side == SIDE_BUY and qty * price > tradecoin_free:
-                status = 'Insufficient ' + self.trade_coin + ' for purchase'
-            elif last_placement == None or last_execution >= last_placement:
-                trade_currency = self.trade_coin
-                try:
-                    self.place_order(coin, pair, self.trade_type, qty, price, side, dryrun, row.stepsize, row.ticksize)
-                except (BinanceRequestException,
-                        BinanceAPIException,
-                        BinanceOrderException,
-                        BinanceOrderMinAmountException,
-                        BinanceOrderMinPriceException,
-                        BinanceOrderMinTotalException,
-                        BinanceOrderUnknownSymbolException,
-                        BinanceOrderInactiveSymbolException) as e:
-                    self.portfolio.set(coin, column='Event', value=e.message)
-                else:
-                    status = 'Trade Ready'
-                    if not dryrun:
-                        self.trades_placed += 1
-                        status = 'Trade Placed'
-                        self.portfolio.set(coin, column='Event', value='Trade Placed')
-            self.portfolio.set(coin, column='Status', value=status)
-            self.portfolio.set(coin, column='Action', value=action)
-            
-            
-    def automation(self, toggle=False):
-        if toggle:
-            if not self.automate.get():
-                self.automate_text.set('Stop Automation')
-            else:
-                self.automate_text.set('Start Automation')
-            self.automate.set(not self.automate.get())
-        if self.automate.get():
-            self.execute_sells()
-            self.execute_buys()
-            self.rebalance_callback = self.parent.after(self.rebalance_time, self.automation)
-        else:
-            self.parent.after_cancel(self.rebalance_callback)
-    
-    def execute_sells(self):
+            if ((max_age > 0 and now - order.created > max_age) or
+                    (max_distance > 0 and abs(order.price - price) > max_distance / 100.0 * price)):
+                stale.append(order)
+        return stale
+
+
+SymbolRules = namedtuple('SymbolRules', ['minprice',
+                                         'maxprice',
+                                         'ticksize',
+                                         'minqty',
+                                         'maxqty',
+                                         'stepsize',
+                                         'minnotional'])
+
+#error code returned by the exchange when an order violates a symbol filter
+FILTER_FAILURE = -1013
+#errors of a rejected or failed order, which are reported for its coin
+ORDER_ERRORS = (BinanceAPIException,
+                BinanceRequestException,
+                BinanceOrderException,
+                BinanceOrderMinAmountException,
+                BinanceOrderMinPriceException,
+                BinanceOrderMinTotalException,
+                BinanceOrderUnknownSymbolException,
+                BinanceOrderInactiveSymbolException,
+                IOError)
+
+
+def parse_symbol_rules(info):
+    '''
+    Build the SymbolRules of a symbol from its exchange info entry.
+    Filters are looked up by their filterType rather than their
+    position, which the exchange does not guarantee.
+    '''
+    filters = {f['filterType']: f for f in info['filters']}
+    price = filters.get('PRICE_FILTER', {})
+    lot = filters.get('LOT_SIZE', {})
+    notional = filters.get('MIN_NOTIONAL', filters.get('NOTIONAL', {}))
+    return SymbolRules(minprice=float(price.get('minPrice', 0)),
+                       maxprice=float(price.get('maxPrice', 0)),
+                       ticksize=float(price.get('tickSize', 0)),
+                       minqty=float(lot.get('minQty', 0)),
+                       maxqty=float(lot.get('maxQty', 0)),
+                       stepsize=float(lot.get('stepSize', 0)),
+                       minnotional=float(notional.get('minNotional', 0)))
+
+
+class SymbolRulesCache(object):
+    '''
+    On-disk cache of the trading rules of every symbol on the exchange so
+    that warm starts need no exchange info request. The whole cache is
+    considered stale 'ttl' seconds after it was downloaded. All methods
+    are safe to call from worker threads.
+    '''
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.rules = {}
+        self.fetched = 0.0
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.rules = {symbol: SymbolRules(*fields) for symbol, fields in data['symbols'].items()}
+            self.fetched = float(data['fetched'])
+        except (IOError, ValueError, KeyError, TypeError):
+            self.rules = {}
+            self.fetched = 0.0
+
+    def save(self):
+        data = {'fetched': self.fetched,
+                'symbols': {symbol: list(rules) for symbol, rules in self.rules.items()}}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        try:
+            os.rename(tmp, self.path)
+        except OSError:
+            #windows will not rename over an existing file
+            os.remove(self.path)
+            os.rename(tmp, self.path)
+
+    def age(self):
+        return time.time() - self.fetched
+
+    def covers(self, symbols):
+        ''' True if fresh rules are cached for every one of 'symbols' '''
+        with self.lock:
+            return self.age() < self.ttl and all(symbol in self.rules for symbol in symbols)
+
+    def get(self, symbol):
+        with self.lock:
+            return self.rules.get(symbol)
+
+    def update(self, exchange_info):
+        ''' Replace the cache with the rules in an exchange info response '''
+        rules = {info['symbol']: parse_symbol_rules(info) for info in exchange_info['symbols']}
+        with self.lock:
+            self.rules = rules
+            self.fetched = time.time()
+            self.save()
+
+    def refresh(self, fetch):
+        ''' Download the exchange info with 'fetch' and replace the cache '''
+        self.update(fetch())
+
+    def refresh_async(self, fetch, callback):
         '''
-        Perform any sells required by overachieving coins
+        Refresh the cache in a background thread and call 'callback' from
+        that thread once it succeeds. Does nothing if a refresh is running.
         '''
-        self.execute_transactions(side=SIDE_SELL, dryrun=False)
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        def run():
+            try:
+                self.refresh(fetch)
+            except (BinanceRequestException,
+                    BinanceAPIException,
+                    IOError):
+                return
+            finally:
+                self.refreshing = False
+            callback()
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
 
-    def execute_buys(self):
+    def invalidate(self, symbol):
+        ''' Drop the rules of 'symbol' and mark the whole cache stale '''
+        with self.lock:
+            self.rules.pop(symbol, None)
+            self.fetched = 0.0
+
+
+#HTTP status codes used by the exchange when rate limits are exceeded
+TOO_MANY_REQUESTS = 429
+IP_BANNED = 418
+
+
+def retry_after(e):
+    ''' Seconds to wait according to the Retry-After header of a failed request, if any '''
+    response = getattr(e, 'response', None)
+    try:
+        return float(response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    '''
+    Thread-safe token bucket holding up to 'capacity' tokens
+    which refills at 'rate' tokens per second.
+    '''
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def take(self, tokens):
+        ''' Take 'tokens' if available, otherwise return the seconds until they will be '''
+        tokens = min(tokens, self.capacity)
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        ''' Block until 'tokens' can be taken '''
+        wait = self.take(tokens)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.take(tokens)
+
+    def refund(self, tokens):
+        ''' Give back 'tokens' taken for a request which was not sent after all '''
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+
+class RateLimiter(object):
+    '''
+    Keeps REST traffic from every thread within the exchange's request
+    weight and order rate limits, and pauses all of it after the exchange
+    answers with 429 (too many requests) or 418 (IP banned).
+    '''
+    def __init__(self, weight_per_minute, orders_per_second, max_backoff=300):
+        self.weight = TokenBucket(weight_per_minute / 60.0, weight_per_minute)
+        self.orders = TokenBucket(orders_per_second, orders_per_second)
+        self.max_backoff = max_backoff
+        self.resume_at = 0.0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, weight=1, order=False):
+        ''' Block until a request of 'weight' (and an order, if 'order') may be sent '''
+        wait = self.resume_at - time.time()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.resume_at - time.time()
+        self.weight.acquire(weight)
+        if order:
+            self.orders.acquire(1)
+
+    def poll(self, weight=1, order=False):
         '''
-        Perform any buys required by underachieving coins
+        Take a request of 'weight' (and an order, if 'order') if it may be
+        sent now, otherwise return the seconds to wait before polling again.
+        The non-blocking acquire, for the async REST client.
         '''
-        self.execute_transactions(side=SIDE_BUY, dryrun=False)
+        wait = self.resume_at - time.time()
+        if wait > 0:
+            return wait
+        wait = self.weight.take(weight)
+        if wait > 0 or not order:
+            return wait
+        wait = self.orders.take(1)
+        if wait > 0:
+            self.weight.refund(weight)
+        return wait
 
-    def dryrun(self):
+    def backoff(self, delay=None):
         '''
-        perform a dry run to list what trades are required
+        Pause all requests for 'delay' seconds, or for an exponentially
+        growing time if the exchange did not say how long to wait.
         '''
-        self.execute_transactions(side=SIDE_SELL, dryrun=True)
-        self.execute_transactions(side=SIDE_BUY, dryrun=True)        
-        
-    def place_order(self, coin, pair, trade_type,
-                    quantity, price, side, dryrun,
-                    stepsize, ticksize):
+        with self.lock:
+            self.failures += 1
+            if delay is None:
+                delay = min(2 ** self.failures, self.max_backoff)
+            self.resume_at = max(self.resume_at, time.time() + delay)
+        return delay
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+
+
+#status code and headers of a failed async REST request, for retry_after
+RestResponse = namedtuple('RestResponse', ['status_code', 'headers'])
+
+
+class RestError(BinanceAPIException):
+    '''
+    Error response to an AsyncRestClient request. Carries the attributes
+    of the python-binance exception, so that the same handlers deal with
+    the errors of both clients.
+    '''
+    def __init__(self, status_code, data, headers):
+        Exception.__init__(self, data.get('msg', 'HTTP error {0}'.format(status_code)))
+        self.status_code = status_code
+        self.code = data.get('code', 0)
+        self.message = self.args[0]
+        self.response = RestResponse(status_code, headers)
+
+
+class RestConnectionError(IOError):
+    ''' An AsyncRestClient request which got no response '''
+
+
+def gather(deferreds):
+    ''' Deferred list of the results of 'deferreds', failing with the first error itself '''
+    def first_error(failure):
+        failure.trap(defer.FirstError)
+        return failure.value.subFailure
+    return defer.gatherResults(deferreds, consumeErrors=True).addErrback(first_error)
+
+
+class AsyncRestClient(object):
+    '''
+    The Binance REST requests of the engine on the Twisted reactor, which
+    return Deferreds instead of blocking a thread each. Requests go
+    through the 'agent' and its pool of persistent connections, so most
+    skip the TCP and TLS handshakes, with at most as many in flight as
+    'semaphore' allows. Each waits for its weight under 'limiter' on the
+    reactor. Requests are signed with 'api_secret' where the exchange
+    requires it. Must be used from the reactor thread.
+    '''
+    def __init__(self, agent, semaphore, limiter, api_key=None, api_secret=None):
+        self.agent = agent
+        self.semaphore = semaphore
+        self.limiter = limiter
+        self.api_key = api_key
+        self.api_secret = api_secret
+
+    @defer.inlineCallbacks
+    def request(self, method, path, params=None, signed=False, weight=1, order=False):
+        ''' Deferred JSON response to a request for Client.API_URL/'path' '''
+        yield self.semaphore.acquire()
+        try:
+            wait = self.limiter.poll(weight, order)
+            while wait > 0:
+                yield task.deferLater(reactor, wait, lambda: None)
+                wait = self.limiter.poll(weight, order)
+            params = sorted((params or {}).items())
+            headers = Headers({'Accept': ['application/json']})
+            if self.api_key is not None:
+                headers.addRawHeader('X-MBX-APIKEY', self.api_key)
+            if signed:
+                #timestamped after waiting for the limiter, to stay in the receive window
+                params.append(('timestamp', int(time.time() * 1000)))
+                query = urlencode(params)
+                signature = hmac.new(self.api_secret.encode('utf-8'), query.encode('utf-8'), hashlib.sha256)
+                params.append(('signature', signature.hexdigest()))
+            url = '{0}/{1}'.format(Client.API_URL, path)
+            if params:
+                url += '?' + urlencode(params)
+            try:
+                response = yield self.agent.request(method, url, headers)
+                body = yield readBody(response)
+            except Exception as e: #the transport failures of twisted.web have no common base
+                raise RestConnectionError('{0} {1} failed: {2}'.format(method, path, e))
+        finally:
+            self.semaphore.release()
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = {}
+        if not 200 <= response.code < 300:
+            headers = {name: values[-1] for name, values in response.headers.getAllRawHeaders()}
+            raise RestError(response.code, data if isinstance(data, dict) else {}, headers)
+        defer.returnValue(data)
+
+    def get_account(self):
+        return self.request('GET', 'v3/account', signed=True, weight=5)
+
+    def get_open_orders(self):
+        return self.request('GET', 'v3/openOrders', signed=True, weight=40)
+
+    def get_orderbook_tickers(self):
+        return self.request('GET', 'v3/ticker/bookTicker', weight=2)
+
+    def create_order(self, **params):
+        return self.request('POST', 'v3/order', params, signed=True, order=True)
+
+    def create_test_order(self, **params):
+        return self.request('POST', 'v3/order/test', params, signed=True)
+
+    def cancel_order(self, **params):
+        return self.request('DELETE', 'v3/order', params, signed=True)
+
+
+class LatencyHistogram(object):
+    '''
+    Log-bucketed latency histogram in the style of HdrHistogram. Values
+    between 'lowest' and 'highest' seconds fall into buckets which are
+    'precision' apart in relative terms, so quantiles carry a bounded
+    relative error at a fixed memory cost however many values are seen.
+    '''
+    def __init__(self, lowest=1e-6, highest=3600.0, precision=0.01):
+        self.lowest = lowest
+        self.ratio = 1.0 + precision
+        self.scale = 1.0 / math.log(self.ratio)
+        self.counts = np.zeros(int(math.log(highest / lowest) * self.scale) + 2, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, value):
+        if value > self.lowest:
+            k = min(int(math.log(value / self.lowest) * self.scale) + 1, len(self.counts) - 1)
+        else:
+            k = 0
+        self.counts[k] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        ''' Upper bound of the bucket holding quantile 'q' '''
+        if not self.count:
+            return 0.0
+        k = np.searchsorted(np.cumsum(self.counts), q * self.count)
+        return self.lowest * self.ratio ** k
+
+
+class Metrics(object):
+    '''
+    Message latency histograms by stage and event type, and gauges, of
+    one engine. Read by the GUI and rendered in the Prometheus text
+    format for the metrics endpoint.
+
+    Stages measured for every websocket message:
+        exchange  exchange event time to receipt by the websocket thread
+        queue     receipt to being taken off the message queue
+        handler   time spent in the handler
+        age       exchange event time to the end of the handler
+    '''
+    quantiles = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {}
+
+    def histogram(self, stage, event):
+        histogram = self.histograms.get((stage, event))
+        if histogram is None:
+            histogram = self.histograms[stage, event] = LatencyHistogram()
+        return histogram
+
+    def observe(self, stage, event, value):
+        self.histogram(stage, event).record(value)
+
+    def observe_message(self, event, event_time, received, dequeued, start, done):
+        ''' Record the latency stamps of one handled websocket message '''
+        if event_time is not None:
+            event_time /= 1000.0
+            self.histogram('exchange', event).record(received - event_time)
+            self.histogram('age', event).record(done - event_time)
+        self.histogram('queue', event).record(dequeued - received)
+        self.histogram('handler', event).record(done - start)
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def render(self):
+        ''' All metrics in the Prometheus text exposition format '''
+        return render_metrics([(None, self)])
+
+
+def render_metrics(sources):
+    '''
+    The metrics of several (portfolio, Metrics) pairs in the Prometheus
+    text exposition format, labelled by portfolio unless it is None.
+    '''
+    lines = ['# TYPE binance_balance_latency_seconds summary']
+    gauges = {}
+    for portfolio, metrics in sources:
+        prefix = '' if portfolio is None else 'portfolio="{0}",'.format(portfolio)
+        for (stage, event), histogram in sorted(metrics.histograms.items()):
+            labels = '{0}stage="{1}",event="{2}"'.format(prefix, stage, event)
+            for q in metrics.quantiles:
+                lines.append('binance_balance_latency_seconds{{{0},quantile="{1}"}} {2:.9f}'.format(
+                    labels, q, histogram.quantile(q)))
+            lines.append('binance_balance_latency_seconds_sum{{{0}}} {1:.9f}'.format(labels, histogram.sum))
+            lines.append('binance_balance_latency_seconds_count{{{0}}} {1}'.format(labels, histogram.count))
+        labels = '{{{0}}}'.format(prefix[:-1]) if prefix else ''
+        for name, value in metrics.gauges.items():
+            gauges.setdefault(name, []).append('binance_balance_{0}{1} {2}'.format(name, labels, value))
+    for name in sorted(gauges):
+        lines.append('# TYPE binance_balance_{0} gauge'.format(name))
+        lines.extend(gauges[name])
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass #keep scrapes out of the console
+
+
+class MetricsServer(object):
+    '''
+    Serves the render() output of 'metrics' at http://address:port/metrics
+    from a background thread.
+    '''
+    def __init__(self, metrics, address, port):
+        self.server = HTTPServer((address, port), MetricsHandler)
+        self.server.metrics = metrics
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Profiler(object):
+    '''
+    Runtime switchable timers around chosen methods of the engine and the
+    GUI, keeping the call count, total and maximum time of each. While on,
+    each timer is an instance attribute which shadows its method; when
+    switched off the attributes are deleted, so the methods cost nothing
+    extra. Can also capture a cProfile, or samples of the stack, of the
+    main thread for a fixed time into a file in 'directory'.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.targets = []
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.capturing = False
+
+    def add_targets(self, obj, names):
+        self.targets.append((obj, names))
+        if self.enabled:
+            for name in names:
+                self.wrap(obj, name)
+
+    def wrap(self, obj, name):
+        method = getattr(type(obj), name).__get__(obj)
+        stats = self.stats.setdefault('{0}.{1}'.format(type(obj).__name__, name), [0, 0.0, 0.0])
+        clock = timeit.default_timer
+        lock = self.lock
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                with lock:
+                    stats[0] += 1
+                    stats[1] += elapsed
+                    if elapsed > stats[2]:
+                        stats[2] = elapsed
+        setattr(obj, name, timed)
+
+    def start(self):
+        ''' Install the timers and start counting from zero '''
+        if self.enabled:
+            return
+        self.enabled = True
+        self.stats = {}
+        for obj, names in self.targets:
+            for name in names:
+                self.wrap(obj, name)
+
+    def stop(self):
+        ''' Remove the timers and save their report, returning its path '''
+        if not self.enabled:
+            return None
+        self.enabled = False
+        for obj, names in self.targets:
+            for name in names:
+                obj.__dict__.pop(name, None)
+        path = self.path('timers', 'txt')
+        with open(path, 'w') as f:
+            f.write(self.report())
+        return path
+
+    def report(self):
+        lines = ['{0:<40} {1:>10} {2:>12} {3:>12} {4:>12}'.format('function', 'calls', 'total s',
+                                                                 'mean us', 'max ms')]
+        with self.lock:
+            stats = sorted(self.stats.items(), key=lambda item: -item[1][1])
+            for name, (calls, total, longest) in stats:
+                lines.append('{0:<40} {1:>10} {2:>12.3f} {3:>12.1f} {4:>12.3f}'.format(
+                    name, calls, total, 1e6 * total / max(calls, 1), 1e3 * longest))
+        return '\n'.join(lines) + '\n'
+
+    def path(self, kind, extension):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        name = '{0}-{1}.{2}'.format(kind, datetime.now().strftime('%Y%m%d-%H%M%S'), extension)
+        return os.path.join(self.directory, name)
+
+    def capture(self, scheduler, seconds, mode, interval, callback):
         '''
-        Format and place an order using the Binance API
+        Profile the calling thread for 'seconds' and call 'callback' with
+        the path of the output. 'cprofile' mode saves cProfile stats;
+        'stacks' mode samples the stack every 'interval' seconds from
+        another thread and saves the counts in the folded format used by
+        flame graph tools. Returns False if a capture is already running.
         '''
-        if trade_type == 'LIMIT':
-            if dryrun:
-                order = self.client.create_test_order(symbol=pair,
-                                                      side=side,
-                                                      type=ORDER_TYPE_LIMIT,
-                                                      timeInForce=TIME_IN_FORCE_GTC,
-                                                      quantity=round_decimal(quantity, stepsize),
-                                                      price=round_decimal(price, ticksize))
-            else:
-                order = self.client.create_order(symbol=pair,
-                                                 side=side,
-                                                 type=ORDER_TYPE_LIMIT,
-                                                 timeInForce=TIME_IN_FORCE_GTC,
-                                                 quantity=round_decimal(quantity, stepsize),
-                                                 price=round_decimal(price, ticksize))
-        elif trade_type == 'MARKET':
-            if dryrun:
-                order = self.client.create_test_order(symbol=pair,
-                                                      side=side,
-                                                      type=ORDER_TYPE_MARKET,
-                                                      quantity=round_decimal(quantity, stepsize))
-            else:
-                order = self.client.create_order(symbol=pair,
-                                                 side=side,
-                                                 type=ORDER_TYPE_MARKET,
-                                                 quantity=round_decimal(quantity, stepsize))
-        if not dryrun:
-            self.coins.loc[self.coins['coin'] == coin, 'last_placement'] = time.mktime(datetime.now().timetuple())
-            
-    def column_headers(self):
-        ''' define human readable aliases for the headers in trade execution reports. '''
-        return {'e': 'event_type',
-                'E': 'event_time',
-                's': 'symbol',
-                'c': 'client_order_id',
-                'S': 'side',
-                'o': 'type',
-                'O': 'order_creation_time',
-                'f': 'time_in_force',
-                'q': 'order_quantity',
-                'p': 'order_price',
-                'P': 'stop_price',
-                'F': 'iceberg_quantity',
-                'g': 'ignore_1',
-                'C': 'original_client_order_id',
-                'x': 'current_execution_type',
-                'X': 'current_order_status',
-                'r': 'order_reject_reason',
-                'i': 'order_id',
-                'l': 'last_executed_quantity',
-                'z': 'cumulative_filled_quantity',
-                'Z': 'cumulative_quote_asset_transacted_qty',
-                'L': 'last_executed_price',
-                'n': 'commission_amount',
-                'N': 'commission_asset',
-                'T': 'transaction_time',
-                't': 'trade_id',
-                'I': 'ignore_2',
-                'w': 'order_working',
-                'm': 'maker_side',
-                'M': 'ignore_3',
-                'Y': 'last_quote_asset_transacted_qty'}
- 
-def main():
-    portfolio = 'allocation.csv'
-    coins = pd.read_csv(portfolio)
-    if not np.sum(coins['allocation']) == 100:
-        messagebox.showinfo('Bad Configuration','Your coin allocations to not sum to 100%')
-    else:
-        root = tk.Tk()
-        root.withdraw()
-        BalanceGUI(root, coins).grid(row=0, column=0)
-        root.wm_title('BinanceBalance')
-        root.mainloop()
+        if self.capturing:
+            return False
+        self.capturing = True
+        if mode == 'cprofile':
+            path = self.path('profile', 'prof')
+            profile = cProfile.Profile()
+            def done():
+                profile.disable()
+                profile.dump_stats(path)
+                self.capturing = False
+                callback(path)
+            profile.enable()
+            scheduler.after(int(seconds * 1000), done)
+        else:
+            path = self.path('stacks', 'folded')
+            ident = threading.current_thread().ident
+            def sample():
+                counts = {}
+                end = time.time() + seconds
+                while time.time() < end:
+                    frame = sys._current_frames().get(ident)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append('{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                            code.co_firstlineno))
+                        frame = frame.f_back
+                    key = ';'.join(reversed(stack))
+                    counts[key] = counts.get(key, 0) + 1
+                    time.sleep(interval)
+                with open(path, 'w') as f:
+                    for key, count in sorted(counts.items()):
+                        f.write('{0} {1}\n'.format(key, count))
+                self.capturing = False
+                callback(path)
+            thread = threading.Thread(target=sample)
+            thread.daemon = True
+            thread.start()
+        return True
+
+
+class StreamSupervisor(object):
+    '''
+    Watches one websocket connection: when it last delivered an event and
+    how many times in a row it has failed. 'start' opens the connection
+    and returns its key. 'symbols' are the pairs whose prices the
+    connection carries, or None for the user data stream. Connections
+    which are expected to be busy are considered stale after
+    'stale_after' seconds without an event.
+    '''
+    def __init__(self, name, start, symbols, stale_after=None, base_delay=1.0, max_delay=300.0):
+        self.name = name
+        self.start = start
+        self.symbols = symbols
+        self.stale_after = stale_after
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.conn_key = None
+        self.failures = 0
+        self.reconnecting = False
+        self.last_event = time.time()
+
+    def connect(self):
+        self.conn_key = self.start()
+        self.last_event = time.time()
+        self.reconnecting = False
+
+    def touch(self):
+        ''' Record an event, called from the websocket thread '''
+        self.last_event = time.time()
+        self.failures = 0
+
+    def stale(self, now):
+        return (self.stale_after is not None and not self.reconnecting
+                and now - self.last_event > self.stale_after)
+
+    def backoff(self):
+        ''' Seconds to wait before the next reconnect, with full jitter around the exponential delay '''
+        delay = min(self.max_delay, self.base_delay * 2 ** self.failures)
+        self.failures += 1
+        return delay * random.uniform(0.5, 1.5)
+
+
+#latest-value row of a symbol in a SharedTickerTable. 'seq' is odd while
+#the row is being written; 'tickers' and 'klines' count the updates so that
+#readers can tell which of them changed. Times are exchange times in ms
+#apart from the receipt times, in seconds
+INGEST_ROW_DTYPE = np.dtype([('seq', '<u8'),
+                             ('tickers', '<u8'),
+                             ('klines', '<u8'),
+                             ('time', '<i8'),
+                             ('received', '<f8'),
+                             ('bid', '<f8'),
+                             ('ask', '<f8'),
+                             ('close_time', '<i8'),
+                             ('close_received', '<f8'),
+                             ('close', '<f8')])
+#state of one connection of the ingest process, guarded the same way
+INGEST_CONNECTION_DTYPE = np.dtype([('seq', '<u8'),
+                                    ('retry_in', '<f8'),
+                                    ('reconnecting', 'u1'),
+                                    ('message', 'S111')])
+
+
+class SharedTickerTable(object):
+    '''
+    Latest ticker and last closed kline of each of 'symbols', and the
+    state of the 'connections' carrying them, in a memory mapped file
+    shared by the ingest process which writes it and the engines which
+    read it. Every row and connection record has a single writer, which
+    brackets its updates with the 'seq' counter, so readers can take
+    consistent copies without locking or pickling anything.
+    '''
+    def __init__(self, path, symbols, connections, create=False):
+        self.path = path
+        self.symbols = list(symbols)
+        header = connections * INGEST_CONNECTION_DTYPE.itemsize
+        size = header + len(self.symbols) * INGEST_ROW_DTYPE.itemsize
+        #plain ndarray views, indexing a memmap is several times slower
+        buffer = np.memmap(path, dtype=np.uint8, mode='w+' if create else 'r+', shape=(size,)).view(np.ndarray)
+        self.connections = buffer[:header].view(INGEST_CONNECTION_DTYPE)
+        self.rows = buffer[header:].view(INGEST_ROW_DTYPE)
+        self.seq = self.rows['seq']
+
+    def write_ticker(self, i, time, received, bid, ask):
+        row = self.rows[i]
+        row['seq'] += 1
+        row['time'] = time
+        row['received'] = received
+        row['bid'] = bid
+        row['ask'] = ask
+        row['tickers'] += 1
+        row['seq'] += 1
+
+    def write_kline(self, i, close_time, received, close):
+        row = self.rows[i]
+        row['seq'] += 1
+        row['close_time'] = close_time
+        row['close_received'] = received
+        row['close'] = close
+        row['klines'] += 1
+        row['seq'] += 1
+
+    def read(self, ids):
+        ''' Copies of rows 'ids' and a mask of those which were not caught mid-write '''
+        before = self.seq[ids]
+        rows = self.rows[ids]
+        after = self.seq[ids]
+        return rows, (before == after) & (before % 2 == 0)
+
+    def set_connection(self, k, reconnecting, retry_in, message):
+        record = self.connections[k]
+        record['seq'] += 1
+        record['reconnecting'] = reconnecting
+        record['retry_in'] = retry_in
+        record['message'] = message[:INGEST_CONNECTION_DTYPE['message'].itemsize]
+        record['seq'] += 1
+
+    def connection(self, k):
+        ''' (seq, reconnecting, retry_in, message) of connection k, or None if caught mid-write '''
+        seq = self.connections['seq'][k]
+        record = self.connections[k].copy()
+        if seq % 2 or self.connections['seq'][k] != seq:
+            return None
+        return seq, bool(record['reconnecting']), record['retry_in'], record['message']
+
+
+class IngestFeed(object):
+    '''
+    The rows of one engine's symbols in a SharedTickerTable. Polling
+    turns the tickers and kline closes written since the last poll into
+    payloads shaped like the websocket ones, with the numbers already
+    converted. Only the latest ticker and kline close of a symbol are
+    kept, so updates between two polls are coalesced.
+    '''
+    def __init__(self, table, symbols):
+        self.table = table
+        ids = {symbol: k for k, symbol in enumerate(table.symbols)}
+        symbols = [symbol for symbol in symbols if symbol in ids]
+        self.ids = np.array([ids[symbol] for symbol in symbols], dtype=np.intp)
+        self.symbols = np.array(symbols, dtype=object)
+        self.tickers = np.zeros(len(symbols), dtype=np.uint64)
+        self.klines = np.zeros(len(symbols), dtype=np.uint64)
+
+    def poll(self):
+        ''' (event type, payload, exchange time in ms, receipt time) of every update since the last poll '''
+        rows, consistent = self.table.read(self.ids)
+        events = []
+        tickers = consistent & (rows['tickers'] != self.tickers)
+        if tickers.any():
+            new = rows[tickers]
+            self.tickers[tickers] = new['tickers']
+            for symbol, sent, received, bid, ask in zip(self.symbols[tickers], new['time'].tolist(),
+                                                        new['received'].tolist(), new['bid'].tolist(),
+                                                        new['ask'].tolist()):
+                events.append(('24hrTicker', {'s': symbol, 'E': sent, 'b': bid, 'a': ask}, sent, received))
+        klines = consistent & (rows['klines'] != self.klines)
+        if klines.any():
+            new = rows[klines]
+            self.klines[klines] = new['klines']
+            for symbol, sent, received, close in zip(self.symbols[klines], new['close_time'].tolist(),
+                                                     new['close_received'].tolist(), new['close'].tolist()):
+                events.append(('kline', {'s': symbol, 'k': {'T': sent, 'c': close, 'x': True}}, sent, received))
+        return events
+
+
+class IngestStream(object):
+    '''
+    Parent process view of connection 'k' of the ingest process, which
+    carries the prices of 'symbols' into 'table'. The ingest process
+    reconnects it by itself; the hub only passes on its state changes.
+    '''
+    def __init__(self, name, table, k, symbols):
+        self.name = name
+        self.table = table
+        self.k = k
+        self.symbols = symbols
+        self.seq = 0
+
+    @property
+    def reconnecting(self):
+        return bool(self.table.connections['reconnecting'][self.k])
+
+    def changed(self):
+        ''' (reconnecting, retry_in, message) if the state changed since the last call, else None '''
+        state = self.table.connection(self.k)
+        if state is None or state[0] == self.seq:
+            return None
+        self.seq = state[0]
+        return state[1:]
+
+
+#fixed-width tick record and the segment index entry, both little endian. Prices are
+#single precision, about 7 significant digits, and the mid price is derived when read
+TICK_DTYPE = np.dtype([('time', '<i8'),
+                       ('pair', '<u2'),
+                       ('avg_price', '<f4'),
+                       ('bid', '<f4'),
+                       ('ask', '<f4')])
+TICK_INDEX_DTYPE = np.dtype([('time', '<i8'),
+                             ('count', '<i8')])
+DAY_MS = 86400000
+
+
+def load_pairs(directory):
+    ''' The pair names of a recording directory, indexed by pair id '''
+    try:
+        with open(os.path.join(directory, 'pairs.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return []
+
+
+def segment_paths(directory):
+    ''' Every day segment in a recording directory in date order '''
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.endswith('.ticks')]
+
+
+def index_path(path):
+    return os.path.splitext(path)[0] + '.idx'
+
+
+def build_index(times, stride, count=0, latest=None):
+    '''
+    Index entries for the records with event 'times' appended after
+    'count' earlier records: the running maximum event time at the end of
+    every complete block of 'stride' records. 'latest' is the running
+    maximum of the earlier records.
+    '''
+    running = np.maximum.accumulate(times)
+    if latest is not None and len(running):
+        np.maximum(running, latest, out=running)
+    ends = np.arange(count + 1, count + len(times) + 1)
+    block = ends % stride == 0
+    entries = np.empty(np.count_nonzero(block), dtype=TICK_INDEX_DTYPE)
+    entries['time'] = running[block]
+    entries['count'] = ends[block]
+    return entries, (running[-1] if len(running) else latest)
+
+
+def read_segment(path, start=None, end=None):
+    '''
+    Memory-map a day segment and return its records with start <= time
+    < end. The index is used to skip every block recorded entirely
+    before 'start'. Without bounds the mapping itself is returned.
+    '''
+    count = os.path.getsize(path) // TICK_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=TICK_DTYPE)
+    records = np.memmap(path, dtype=TICK_DTYPE, mode='r', shape=(count,))
+    if start is None and end is None:
+        return records
+    if start is not None and os.path.isfile(index_path(path)):
+        index = np.fromfile(index_path(path), dtype=TICK_INDEX_DTYPE)
+        k = np.searchsorted(index['time'], start, side='left')
+        if k > 0:
+            records = records[min(index['count'][k - 1], count):]
+    mask = np.ones(len(records), dtype=bool)
+    if start is not None:
+        mask &= records['time'] >= start
+    if end is not None:
+        mask &= records['time'] < end
+    return records[mask]
+
+
+class TickSegmentWriter(object):
+    '''
+    Appends tick records to one day segment and keeps its index up to
+    date. An existing segment is reopened for appending after dropping
+    any partial record left by a crash, and its index is rebuilt.
+    '''
+    def __init__(self, path, stride):
+        self.path = path
+        self.stride = stride
+        self.count = 0
+        self.latest = None
+        if os.path.isfile(path):
+            size = os.path.getsize(path)
+            self.count = size // TICK_DTYPE.itemsize
+            if size != self.count * TICK_DTYPE.itemsize:
+                with open(path, 'r+b') as f:
+                    f.truncate(self.count * TICK_DTYPE.itemsize)
+        index = np.empty(0, dtype=TICK_INDEX_DTYPE)
+        if self.count:
+            times = np.array(read_segment(path)['time'])
+            index, self.latest = build_index(times, stride)
+        with open(index_path(path), 'wb') as f:
+            f.write(index.tobytes())
+        self.data = open(path, 'ab')
+        self.index = open(index_path(path), 'ab')
+
+    def append(self, records):
+        entries, self.latest = build_index(records['time'], self.stride, self.count, self.latest)
+        self.data.write(records.tobytes())
+        self.data.flush()
+        if len(entries):
+            self.index.write(entries.tobytes())
+            self.index.flush()
+        self.count += len(records)
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+class BackgroundWriter(object):
+    '''
+    Base for writers which accept items on the message thread with a
+    single deque append and write them in batches from a background
+    thread every 'interval' seconds. Subclasses implement write_batch and
+    must call this constructor last, as it starts the thread.
+    '''
+    def __init__(self, interval):
+        self.interval = interval
+        self.pending = deque()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        ''' Write every pending item '''
+        n = len(self.pending)
+        if n:
+            self.write_batch([self.pending.popleft() for _ in range(n)])
+
+    def close(self):
+        ''' Write the remaining items and stop the writer thread '''
+        self.stopped.set()
+        self.thread.join()
+
+
+class TickRecorder(BackgroundWriter):
+    '''
+    Records price ticks as fixed-width binary records in one segment file
+    per UTC day. The writer thread packs the pending ticks and writes them
+    every 'flush_interval' seconds. Pair names are stored once in
+    pairs.json and referred to by id in the records.
+    '''
+    def __init__(self, directory, flush_interval=1.0, stride=4096):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.stride = stride
+        self.pairs = load_pairs(directory)
+        self.pair_ids = {pair: k for k, pair in enumerate(self.pairs)}
+        self.lock = threading.Lock()
+        self.segment = None
+        self.day = None
+        BackgroundWriter.__init__(self, flush_interval)
+
+    def pair_id(self, pair):
+        k = self.pair_ids.get(pair)
+        if k is None:
+            with self.lock:
+                k = self.pair_ids.get(pair)
+                if k is None:
+                    k = len(self.pairs)
+                    self.pairs.append(pair)
+                    with open(os.path.join(self.directory, 'pairs.json'), 'w') as f:
+                        json.dump(self.pairs, f)
+                    self.pair_ids[pair] = k
+        return k
+
+    def record(self, pair, time, avg_price, bid, ask):
+        ''' Queue one tick for the writer thread '''
+        self.pending.append((time, self.pair_id(pair), avg_price, bid, ask))
+
+    def write_batch(self, ticks):
+        self.write(np.array(ticks, dtype=TICK_DTYPE))
+
+    def write(self, records):
+        ''' Append 'records' to the segments of the days they belong to '''
+        days = records['time'] // DAY_MS
+        with self.lock:
+            for day in np.unique(days):
+                if day != self.day:
+                    if self.segment is not None:
+                        self.segment.close()
+                    name = datetime.utcfromtimestamp(day * DAY_MS / 1000).strftime('%Y%m%d.ticks')
+                    self.segment = TickSegmentWriter(os.path.join(self.directory, name), self.stride)
+                    self.day = day
+                self.segment.append(records[days == day])
+
+    def close(self):
+        BackgroundWriter.close(self)
+        with self.lock:
+            if self.segment is not None:
+                self.segment.close()
+                self.segment = None
+                self.day = None
+
+
+class TickArchive(object):
+    '''
+    Read access to a recording directory for replays. Each day segment is
+    split by pair once and shared by the readers of every pair, which are
+    expected to move through the days roughly in step.
+    '''
+    def __init__(self, directory):
+        self.pairs = load_pairs(directory)
+        self.paths = segment_paths(directory)
+        self.days = {}
+
+    def day(self, path):
+        ''' The (time, mid_price) arrays of every pair recorded in a segment '''
+        if path not in self.days:
+            if len(self.days) >= 2:
+                del self.days[min(self.days)]
+            records = read_segment(path)
+            order = np.argsort(records['pair'], kind='mergesort')
+            pairs = records['pair'][order]
+            times = records['time'][order]
+            mids = (records['bid'][order].astype(np.float64) + records['ask'][order]) / 2.0
+            bounds = np.searchsorted(pairs, np.arange(len(self.pairs) + 1))
+            self.days[path] = {pair: (times[bounds[k]:bounds[k + 1]], mids[bounds[k]:bounds[k + 1]])
+                               for k, pair in enumerate(self.pairs)}
+        return self.days[path]
+
+    def chunks(self, pair):
+        ''' The (time, mid_price) arrays of 'pair', one day at a time '''
+        for path in self.paths:
+            ticks = self.day(path).get(pair)
+            if ticks is not None and len(ticks[0]):
+                yield ticks
+
+
+def csv_rows(path, pair_id, chunksize=100000):
+    ''' Tick tuples of a <PAIR>.csv record, using the mid price for the bid and ask '''
+    for chunk in pd.read_csv(path, header=None, names=['time', 'avg_price', 'mid_price'],
+                             chunksize=chunksize):
+        for t, avg_price, mid_price in zip(chunk['time'].values.astype(np.int64),
+                                           chunk['avg_price'].values,
+                                           chunk['mid_price'].values):
+            yield (t, pair_id, avg_price, mid_price, mid_price)
+
+
+def convert_csv_records(pairs, source, recorder, batch_size=100000):
+    '''
+    Merge the <PAIR>.csv records of 'pairs' found in 'source' into one
+    time-ordered stream and write it through 'recorder'. Returns the
+    number of ticks converted.
+    '''
+    streams = []
+    for pair in pairs:
+        path = os.path.join(source, pair + '.csv')
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            streams.append(csv_rows(path, recorder.pair_id(pair)))
+    count = 0
+    batch = []
+    for row in heapq.merge(*streams):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            recorder.write(np.array(batch, dtype=TICK_DTYPE))
+            count += len(batch)
+            batch = []
+    if batch:
+        recorder.write(np.array(batch, dtype=TICK_DTYPE))
+        count += len(batch)
+    return count
+
+
+def journal_paths(directory):
+    ''' Every trade journal segment in a directory, oldest first '''
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.startswith('trades-') and name.endswith('.jsonl')]
+
+
+def journal_start(path):
+    ''' Event time of the first report in a journal segment, taken from its name '''
+    return int(os.path.basename(path)[len('trades-'):-len('.jsonl')])
+
+
+def recover_tail(path, block=65536):
+    '''
+    Truncate a journal segment after its last complete line, dropping a
+    report which was only partly written when the process died. Returns
+    the size of the segment.
+    '''
+    with open(path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        size = end = f.tell()
+        while end > 0:
+            start = max(0, end - block)
+            f.seek(start)
+            k = f.read(end - start).rfind(b'\n')
+            if k >= 0:
+                end = start + k + 1
+                break
+            end = start
+        if end != size:
+            f.truncate(end)
+    return end
+
+
+class TradeJournal(BackgroundWriter):
+    '''
+    Append-only journal of execution reports, one JSON object per line.
+    Reports are group committed: the writer thread writes every report
+    which arrived during the last 'commit_interval' seconds and syncs them
+    to disk together. A new segment is started once the current one
+    exceeds 'max_bytes'. Segments are named after the event time of their
+    first report so that loads can skip them without reading. Raw reports
+    are journaled with their keys renamed through 'headers', which is done
+    on the writer thread.
+    '''
+    def __init__(self, directory, commit_interval=0.2, max_bytes=16 * 2**20, headers=None):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.headers = headers or {}
+        self.max_bytes = max_bytes
+        self.file = None
+        self.size = 0
+        paths = journal_paths(directory)
+        if paths:
+            self.size = recover_tail(paths[-1])
+            self.file = open(paths[-1], 'ab')
+        BackgroundWriter.__init__(self, commit_interval)
+
+    def append(self, report):
+        ''' Queue an execution report for the next commit '''
+        self.pending.append(report)
+
+    def write_batch(self, reports):
+        headers = self.headers
+        reports = [{headers.get(key, key): value for key, value in report.items()} for report in reports]
+        if self.file is None or self.size >= self.max_bytes:
+            self.rotate(reports[0]['event_time'])
+        data = ''.join(json.dumps(report, sort_keys=True) + '\n' for report in reports).encode('utf-8')
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.size += len(data)
+
+    def rotate(self, event_time):
+        ''' Start a new segment with a report of time 'event_time' '''
+        if self.file is not None:
+            self.file.close()
+        path = os.path.join(self.directory, 'trades-{0:013d}.jsonl'.format(int(event_time)))
+        self.file = open(path, 'ab')
+        self.size = os.path.getsize(path)
+
+    def close(self):
+        BackgroundWriter.close(self)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def load_trades(directory, symbol=None, start=None, end=None):
+    '''
+    Load the journaled execution reports with start <= event_time < end,
+    optionally only those of 'symbol', as a DataFrame. Segments written
+    entirely outside the time range are not opened and lines of other
+    symbols are skipped without being parsed.
+    '''
+    paths = journal_paths(directory)
+    starts = [journal_start(path) for path in paths]
+    needle = '"symbol": {0}'.format(json.dumps(symbol)) if symbol is not None else None
+    trades = []
+    for k, path in enumerate(paths):
+        if end is not None and starts[k] >= end:
+            break
+        if start is not None and k + 1 < len(paths) and starts[k + 1] < start:
+            continue
+        with open(path) as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break #report still being written
+                if needle is not None and needle not in line:
+                    continue
+                report = json.loads(line)
+                t = report['event_time']
+                if (start is None or t >= start) and (end is None or t < end):
+                    trades.append(report)
+    return pd.DataFrame(trades)
+
+
+class TreeviewRenderer(object):
+    '''
+    Buffer cell updates for a ttk.Treeview. Only cells whose displayed
+    text actually changed are recorded, and they are pushed to the widget
+    together when flush is called, once per frame.
+    '''
+    def __init__(self, tree):
+        self.tree = tree
+        self.cells = {}
+        self.dirty = {}
+
+    def insert(self, index, iid, values):
+        ''' Insert a row and remember the text of its cells '''
+        self.tree.insert('', index, iid=iid, text=iid, values=values)
+        for column, value in zip(self.tree['columns'], values):
+            self.cells[(iid, column)] = value
+
+    def clear(self):
+        ''' Remove every row from the widget '''
+        self.tree.delete(*self.tree.get_children())
+        self.cells.clear()
+        self.dirty.clear()
+
+    def set(self, iid, column, value):
+        ''' Record the new text of a cell if it differs from what is displayed '''
+        key = (iid, column)
+        if self.cells.get(key) != value:
+            self.dirty[key] = value
+        else:
+            self.dirty.pop(key, None)
+
+    def flush(self):
+        ''' Push every changed cell to the widget '''
+        for (iid, column), value in self.dirty.items():
+            self.tree.set(iid, column=column, value=value)
+            self.cells[(iid, column)] = value
+        self.dirty.clear()
+
+
+class ConfigError(Exception):
+    ''' Raised when config.ini holds an unsupported or invalid setting '''
+    pass
+
+
+class LoopScheduler(object):
+    '''
+    Minimal stand-in for the Tk event loop used when running headless.
+    Provides the after/after_idle/after_cancel interface of a Tk widget
+    and runs all callbacks on the thread which calls run().
+    '''
+    def __init__(self, resolution=0.05):
+        self.resolution = resolution
+        self.timers = []
+        self.cancelled = set()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.running = False
+
+    def after(self, ms, func, *args):
+        handle = next(self.counter)
+        with self.lock:
+            heapq.heappush(self.timers, (time.time() + ms / 1000.0, handle, func, args))
+        return handle
+
+    def after_idle(self, func, *args):
+        return self.after(0, func, *args)
+
+    def after_cancel(self, handle):
+        with self.lock:
+            self.cancelled.add(handle)
+
+    def run(self):
+        ''' Run due callbacks until stop is called '''
+        self.running = True
+        while self.running:
+            now = time.time()
+            with self.lock:
+                due = []
+                while self.timers and self.timers[0][0] <= now:
+                    due.append(heapq.heappop(self.timers))
+                wait = self.timers[0][0] - now if self.timers else self.resolution
+            for _, handle, func, args in due:
+                if handle in self.cancelled:
+                    self.cancelled.discard(handle)
+                else:
+                    try:
+                        func(*args)
+                    except Exception:
+                        self.report_callback_exception(*sys.exc_info())
+            if not due:
+                time.sleep(min(wait, self.resolution))
+
+    def report_callback_exception(self, exc, val, tb):
+        '''
+        Report a callback which raised and carry on, as Tk does. Logged as
+        a JSON record when headless logging is set up, else printed.
+        '''
+        logger = logging.getLogger('binance-balance')
+        if logger.handlers:
+            logger.error('callback_error', extra={'fields': {
+                'message': '{0}: {1}'.format(exc.__name__, val),
+                'traceback': ''.join(traceback.format_exception(exc, val, tb))}})
+        else:
+            traceback.print_exception(exc, val, tb)
+
+    def stop(self):
+        self.running = False
+
+
+class MarketHub(object):
+    '''
+    Market data shared by every portfolio engine in the process. Holds one
+    set of combined ticker and kline streams for the union of the engines'
+    symbols, and fans each event out to the message queues of the engines
+    which hold its symbol. The symbol rules cache and its refresh, the tick
+    recorder, the REST pool, the request rate limits and the metrics
+    endpoint are shared the same way, so connections and request weight
+    grow with the number of symbols rather than with portfolios x symbols.
+    Market stream events are handled on the websocket thread, as far as
+    recording and routing them; everything else runs on 'scheduler'.
+
+    With ingest_process on, the market streams are run, decoded and
+    recorded by a child process instead (see IngestWorker), which writes
+    the latest prices into SharedTickerTables that the engines poll. The
+    user data streams stay in this process.
+
+    With async_client on, snapshots, orders and cancellations go through
+    AsyncRestClients on the reactor instead of the REST pool, sharing
+    one pool of persistent connections. The reactor is then started as
+    soon as the hub is, rather than with the first stream.
+    '''
+    def __init__(self, scheduler, config_file='config.ini'):
+        self.scheduler = scheduler
+        self.config_file = config_file
+        self.engines = []
+        self.routes = {}
+        self.bm = None
+        self.streams = {}
+        self.stream_check = None
+        self.rules_callback = None
+        self.metrics_server = None
+        self.tables = []
+        self.ingest = None
+        self.ingest_commands = []
+        self.read_config(config_file)
+        self.rest_pool = ThreadPool(self.rest_workers)
+        self.limiter = RateLimiter(self.weight_per_minute, self.orders_per_second)
+        self.rules = SymbolRulesCache(self.rules_cache, self.rules_ttl)
+        self.agent = None
+        self.semaphore = None
+        self.rest = None
+        self.reactor_thread = None
+        if self.async_rest:
+            self.start_async_client()
+        #the ingest process records the ticks itself
+        self.recorder = None
+        if not self.ingest_process:
+            self.recorder = TickRecorder(self.records_directory, self.records_flush)
+
+    def read_config(self, config_file):
+        s_to_ms = 1000
+        config = ConfigParser.RawConfigParser(allow_no_value=False)
+        config.read(config_file)
+        self.streams_per_connection = int(config.get('websockets', 'streams_per_connection'))
+        if not 2 <= self.streams_per_connection <= 1024:
+            raise ConfigError('Streams per connection must be between 2 and 1024')
+        self.stale_after = float(config.get('websockets', 'stale_after'))
+        self.max_backoff = float(config.get('websockets', 'max_backoff'))
+        if self.stale_after <= 0 or self.max_backoff <= 0:
+            raise ConfigError('Stream staleness and backoff limits must be positive (seconds)')
+        self.stale_check = max(1, int(self.stale_after * s_to_ms / 4))
+        self.ingest_process = config.getboolean('websockets', 'ingest_process')
+        self.metrics_address = config.get('metrics', 'address')
+        self.metrics_port = int(config.get('metrics', 'port'))
+        if not 0 <= self.metrics_port <= 65535:
+            raise ConfigError('Metrics port must be between 0 (disabled) and 65535')
+        self.rules_cache = config.get('rest', 'rules_cache')
+        self.rules_ttl = int(config.get('rest', 'rules_ttl'))
+        if self.rules_ttl <= 0:
+            raise ConfigError('Symbol rules TTL must be a positive integer (seconds)')
+        self.rest_workers = int(config.get('rest', 'max_workers'))
+        if self.rest_workers <= 0:
+            raise ConfigError('REST worker count must be a positive integer')
+        self.weight_per_minute = int(config.get('rest', 'weight_per_minute'))
+        self.orders_per_second = int(config.get('rest', 'orders_per_second'))
+        if self.weight_per_minute <= 0 or self.orders_per_second <= 0:
+            raise ConfigError('Rate limits must be positive integers')
+        self.async_rest = config.getboolean('rest', 'async_client')
+        self.records_directory = config.get('records', 'directory')
+        self.records_flush = float(config.get('records', 'flush_interval'))
+        if self.records_flush <= 0:
+            raise ConfigError('Record flush interval must be positive (seconds)')
+
+    def add(self, engine):
+        self.engines.append(engine)
+
+    def subscribe(self, engine, symbols):
+        ''' Route the market events of 'symbols' to 'engine' from now on '''
+        for symbol in symbols:
+            if self.recorder is not None:
+                self.recorder.pair_id(symbol)
+            #replace rather than extend, the websocket thread reads the routes
+            self.routes[symbol] = self.routes.get(symbol, []) + [engine.queue]
+
+    def remove(self, engine):
+        ''' Stop routing events to 'engine', closing the hub after the last one '''
+        self.engines.remove(engine)
+        for symbol, queues in list(self.routes.items()):
+            if engine.queue in queues:
+                self.routes[symbol] = [queue for queue in queues if queue is not engine.queue]
+        if not self.engines:
+            self.close()
+
+    def close(self):
+        if self.rules_callback is not None:
+            self.scheduler.after_cancel(self.rules_callback)
+            self.rules_callback = None
+        if self.stream_check is not None:
+            self.scheduler.after_cancel(self.stream_check)
+            self.stream_check = None
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
+        if self.recorder is not None:
+            self.recorder.close()
+        self.rest_pool.close()
+        if self.ingest is not None:
+            self.stop_ingest()
+            self.ingest = None
+        for table in self.tables:
+            os.remove(table.path)
+        self.tables = []
+        if self.bm is not None:
+            self.bm.close()
+            self.bm = None
+            reactor.stop()
+        elif self.reactor_thread is not None:
+            reactor.callFromThread(reactor.stop)
+        self.reactor_thread = None
+
+    def notify(self, event, *args):
+        ''' Tell the listeners of every engine about a market stream event '''
+        for engine in self.engines:
+            engine.notify(event, *args)
+
+    def broadcast(self, msg):
+        ''' Queue a message for every engine, from any thread '''
+        for engine in list(self.engines):
+            engine.queue.put(msg)
+
+    def start_async_client(self):
+        '''
+        Set up the connection pool of the async REST clients, and the
+        hub's own client for public requests, and run the reactor. The
+        socket manager finds the reactor running when it starts.
+        '''
+        pool = HTTPConnectionPool(reactor, persistent=True)
+        pool.maxPersistentPerHost = self.rest_workers
+        self.agent = Agent(reactor, pool=pool)
+        self.semaphore = defer.DeferredSemaphore(self.rest_workers)
+        self.rest = AsyncRestClient(self.agent, self.semaphore, self.limiter)
+        if not reactor.running:
+            self.reactor_thread = threading.Thread(target=reactor.run, kwargs={'installSignalHandlers': False})
+            self.reactor_thread.daemon = True
+            self.reactor_thread.start()
+
+    def async_client(self, api_key, api_secret):
+        ''' An async REST client signing with the keys of an engine, or None if async_client is off '''
+        if self.agent is None:
+            return None
+        return AsyncRestClient(self.agent, self.semaphore, self.limiter, api_key, api_secret)
+
+    def submit(self, func, func_async, *args):
+        '''
+        Run 'func' on the REST pool, or 'func_async' on the reactor when
+        async_client is on, without waiting for either.
+        '''
+        if self.agent is None:
+            self.rest_pool.apply_async(func, args)
+        else:
+            reactor.callFromThread(func_async, *args)
+
+    def call(self, func, *args):
+        ''' Run 'func' on the reactor and wait for the result of the Deferred it returns '''
+        return threads.blockingCallFromThread(reactor, func, *args)
+
+    @property
+    def client(self):
+        ''' Client for public market data requests, any logged in engine's will do '''
+        for engine in self.engines:
+            if engine.client is not None:
+                return engine.client
+        return None
+
+    def start(self):
+        '''
+        Open combined streams for every routed symbol which no stream
+        carries yet, start the socket manager and the stream checks the
+        first time round, and serve the metrics of all engines.
+        '''
+        covered = set()
+        for stream in self.streams.values():
+            covered.update(stream.symbols)
+        symbols = sorted(symbol for symbol in self.routes if symbol not in covered)
+        #the socket manager also runs the reactor for the user data streams
+        if self.bm is None:
+            self.bm = BinanceSocketManager(self.client)
+        n = self.streams_per_connection // 2
+        chunks = [symbols[k:k + n] for k in range(0, len(symbols), n)]
+        if self.ingest_process:
+            if chunks:
+                self.add_table(symbols, chunks)
+            chunks = []
+        added = []
+        for chunk in chunks:
+            streams = []
+            for symbol in chunk:
+                streams.append(symbol.lower() + '@ticker')
+                streams.append(symbol.lower() + '@kline_' + KLINE_INTERVAL_1MINUTE)
+            name = 'market{0}'.format(len(self.streams))
+            callback = self.stream_callback(name)
+            start = lambda streams=streams, callback=callback: self.bm.start_multiplex_socket(streams, callback)
+            self.streams[name] = StreamSupervisor(name, start, chunk, self.stale_after, max_delay=self.max_backoff)
+            added.append(self.streams[name])
+        for stream in added:
+            stream.connect()
+        if self.stream_check is None:
+            self.bm.start()
+            self.stream_check = self.scheduler.after(self.stale_check, self.check_streams)
+        if self.metrics_port and self.metrics_server is None:
+            try:
+                self.metrics_server = MetricsServer(self, self.metrics_address, self.metrics_port)
+            except (IOError, OSError) as e:
+                self.notify('metrics_error', 'Cannot serve metrics on {0}:{1}: {2}'.format(
+                    self.metrics_address, self.metrics_port, e))
+
+    def render(self):
+        ''' The metrics of every engine, labelled by portfolio name when there are several '''
+        if len(self.engines) == 1:
+            return self.engines[0].metrics.render()
+        return render_metrics([(engine.name, engine.metrics) for engine in self.engines])
+
+    def stream_callback(self, name):
+        '''
+        Handler of market stream 'name': record tickers and pass every
+        event on to the engines holding its symbol. Errors go to every
+        engine, which hand them back to stream_failed on the main thread.
+        '''
+        def callback(msg):
+            if msg.get('e') == 'error':
+                self.broadcast({'e': 'streamError', 'stream': name, 'message': msg.get('m', '')})
+                return
+            self.streams[name].touch()
+            msg = msg.get('data', msg)
+            msg['received'] = time.time()
+            if msg['e'] == '24hrTicker':
+                self.recorder.record(msg['s'], msg['E'], float(msg['w']), float(msg['b']), float(msg['a']))
+            for queue in self.routes.get(msg['s'], ()):
+                queue.put(msg)
+        return callback
+
+    def check_streams(self):
+        ''' Reconnect every market stream which has gone quiet for too long '''
+        if self.ingest_process:
+            self.check_ingest()
+            return
+        now = time.time()
+        for stream in self.streams.values():
+            if stream.stale(now):
+                self.stream_failed(stream.name, 'No events for {0:.0f} s'.format(now - stream.last_event))
+        self.stream_check = self.scheduler.after(self.stale_check, self.check_streams)
+
+    def stream_failed(self, name, message):
+        ''' Close a failed market stream and schedule its reconnection after a backoff '''
+        stream = self.streams[name]
+        if stream.reconnecting:
+            return
+        stream.reconnecting = True
+        if stream.conn_key is not None:
+            self.bm.stop_socket(stream.conn_key)
+            stream.conn_key = None
+        delay = stream.backoff()
+        self.notify('stream_status', name, '{0}, reconnecting in {1:.0f} s'.format(message, delay))
+        self.scheduler.after(int(delay * 1000), self.reconnect_stream, name)
+
+    def reconnect_stream(self, name):
+        ''' Reopen a market stream and refresh the prices it carries '''
+        stream = self.streams[name]
+        try:
+            stream.connect()
+        except ORDER_ERRORS as e:
+            stream.reconnecting = False
+            self.stream_failed(name, 'Reconnect failed: {0}'.format(e))
+            return
+        self.notify('stream_status', name, 'Reconnected')
+        self.submit(self.fetch_snapshot, self.fetch_snapshot_async, stream)
+
+    def fetch_snapshot(self, stream):
+        ''' Queue a REST snapshot of the prices of a market stream's symbols for every engine '''
+        try:
+            self.limiter.acquire(weight=2)
+            symbols = set(stream.symbols)
+            tickers = [ticker for ticker in self.client.get_orderbook_tickers()
+                       if ticker['symbol'] in symbols]
+            self.broadcast({'e': 'resync', 'stream': stream.name, 'tickers': tickers})
+        except (BinanceRequestException,
+                BinanceAPIException,
+                IOError) as e:
+            self.broadcast({'e': 'streamError', 'stream': stream.name,
+                            'message': 'Resync failed: {0}'.format(e)})
+
+    @defer.inlineCallbacks
+    def fetch_snapshot_async(self, stream):
+        ''' fetch_snapshot on the reactor '''
+        try:
+            symbols = set(stream.symbols)
+            tickers = yield self.rest.get_orderbook_tickers()
+            self.broadcast({'e': 'resync', 'stream': stream.name,
+                            'tickers': [ticker for ticker in tickers if ticker['symbol'] in symbols]})
+        except (BinanceAPIException,
+                IOError) as e:
+            self.broadcast({'e': 'streamError', 'stream': stream.name,
+                            'message': 'Resync failed: {0}'.format(e)})
+
+    def fetch_exchange_info(self):
+        self.limiter.acquire(weight=1)
+        return self.client.get_exchange_info()
+
+    def add_table(self, symbols, chunks):
+        '''
+        Have the ingest process stream 'symbols', one connection per chunk
+        of 'chunks', into a new table. Starts the process the first time.
+        '''
+        #tmpfs where there is one, the table is never meant to reach a disk
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, path = tempfile.mkstemp(prefix='binance-balance-', suffix='.table', dir=directory)
+        os.close(fd)
+        table = SharedTickerTable(path, symbols, len(chunks), create=True)
+        self.tables.append(table)
+        names = []
+        for k, chunk in enumerate(chunks):
+            name = 'market{0}'.format(len(self.streams))
+            self.streams[name] = IngestStream(name, table, k, chunk)
+            names.append(name)
+        command = {'table': path, 'symbols': symbols, 'names': names, 'streams': chunks}
+        self.ingest_commands.append(command)
+        if self.ingest is None:
+            self.start_ingest()
+        else:
+            self.send_ingest(command)
+
+    def feeds(self, symbols):
+        ''' Readers of 'symbols' for the tables holding any of them '''
+        symbols = set(symbols)
+        return [IngestFeed(table, symbols)
+                for table in self.tables if not symbols.isdisjoint(table.symbols)]
+
+    def start_ingest(self):
+        ''' Start the ingest process and hand it every table '''
+        self.ingest = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                        '--ingest', '--config', self.config_file],
+                                       stdin=subprocess.PIPE)
+        for command in self.ingest_commands:
+            self.send_ingest(command)
+
+    def send_ingest(self, command):
+        try:
+            self.ingest.stdin.write(json.dumps(command) + '\n')
+            self.ingest.stdin.flush()
+        except IOError:
+            pass #the process has died, check_ingest restarts it
+
+    def stop_ingest(self, timeout=5.0):
+        ''' Close the input of the ingest process, which makes it exit, killing it if it takes too long '''
+        try:
+            self.ingest.stdin.close()
+        except IOError:
+            pass
+        deadline = time.time() + timeout
+        while self.ingest.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if self.ingest.poll() is None:
+            self.ingest.kill()
+            self.ingest.wait()
+
+    def check_ingest(self):
+        '''
+        Restart the ingest process if it has died, resyncing every price,
+        and tell the engines about the connections it lost or got back.
+        '''
+        if self.ingest is not None and self.ingest.poll() is not None:
+            self.notify('stream_status', 'ingest',
+                        'Ingest process exited with code {0}, restarting'.format(self.ingest.returncode))
+            self.start_ingest()
+            for stream in self.streams.values():
+                self.submit(self.fetch_snapshot, self.fetch_snapshot_async, stream)
+        for stream in self.streams.values():
+            state = stream.changed()
+            if state is None:
+                continue
+            reconnecting, retry_in, message = state
+            if reconnecting:
+                self.notify('stream_status', stream.name, '{0}, reconnecting in {1:.0f} s'.format(message, retry_in))
+            else:
+                self.notify('stream_status', stream.name, 'Reconnected')
+                self.submit(self.fetch_snapshot, self.fetch_snapshot_async, stream)
+        self.stream_check = self.scheduler.after(self.stale_check, self.check_streams)
+
+    def schedule_rules_refresh(self):
+        ''' Refresh the symbol rules in the background when they expire, once for all engines '''
+        if self.rules_callback is None:
+            delay = max(0, self.rules_ttl - self.rules.age())
+            self.rules_callback = self.scheduler.after(int(delay * 1000), self.refresh_rules)
+
+    def refresh_rules(self):
+        self.rules.refresh_async(self.fetch_exchange_info, self.rules_refreshed)
+        self.rules_callback = self.scheduler.after(self.rules_ttl * 1000, self.refresh_rules)
+
+    def rules_refreshed(self):
+        ''' Called from the refresh thread, hand over to the message queues '''
+        self.broadcast({'e': 'symbolRules'})
+
+
+class IngestWorker(object):
+    '''
+    The market streams of a MarketHub run in the ingest process (see
+    run_ingest). For every table the hub hands over, opens the combined
+    ticker and kline streams of its connections and writes each ticker
+    and kline close into the table from the websocket thread, recording
+    the ticks as well. Stale or failed connections are reconnected here
+    as the hub would, with their state written to the table for the hub
+    to pass on. Everything but the stream callbacks runs on 'scheduler'.
+    '''
+    def __init__(self, scheduler, config_file='config.ini'):
+        self.scheduler = scheduler
+        self.bm = None
+        self.streams = {}
+        self.connections = {}
+        self.stream_check = None
+        self.read_config(config_file)
+        self.recorder = TickRecorder(self.records_directory, self.records_flush)
+
+    def read_config(self, config_file):
+        ''' Read the settings the hub has already checked '''
+        s_to_ms = 1000
+        config = ConfigParser.RawConfigParser(allow_no_value=False)
+        config.read(config_file)
+        self.stale_after = float(config.get('websockets', 'stale_after'))
+        self.max_backoff = float(config.get('websockets', 'max_backoff'))
+        self.stale_check = max(1, int(self.stale_after * s_to_ms / 4))
+        self.records_directory = config.get('records', 'directory')
+        self.records_flush = float(config.get('records', 'flush_interval'))
+
+    def add_table(self, command):
+        ''' Open the table of a command from the hub and stream its symbols into it '''
+        table = SharedTickerTable(command['table'], command['symbols'], len(command['streams']))
+        rows = {symbol: i for i, symbol in enumerate(table.symbols)}
+        if self.bm is None:
+            self.bm = BinanceSocketManager(None) #no client needed without user streams
+        added = []
+        for k, (name, chunk) in enumerate(zip(command['names'], command['streams'])):
+            streams = []
+            for symbol in chunk:
+                streams.append(symbol.lower() + '@ticker')
+                streams.append(symbol.lower() + '@kline_' + KLINE_INTERVAL_1MINUTE)
+            callback = self.stream_callback(name, table, rows)
+            start = lambda streams=streams, callback=callback: self.bm.start_multiplex_socket(streams, callback)
+            self.streams[name] = StreamSupervisor(name, start, chunk, self.stale_after, max_delay=self.max_backoff)
+            self.connections[name] = table, k
+            added.append(self.streams[name])
+        for stream in added:
+            stream.connect()
+        if self.stream_check is None:
+            self.bm.start()
+            self.stream_check = self.scheduler.after(self.stale_check, self.check_streams)
+
+    def stream_callback(self, name, table, rows):
+        ''' Handler of stream 'name', writing into 'table' where 'rows' gives the row of each symbol '''
+        def callback(msg):
+            if msg.get('e') == 'error':
+                self.scheduler.after_idle(self.stream_failed, name, msg.get('m', ''))
+                return
+            self.streams[name].touch()
+            received = time.time()
+            msg = msg.get('data', msg)
+            if msg['e'] == '24hrTicker':
+                bid = float(msg['b'])
+                ask = float(msg['a'])
+                table.write_ticker(rows[msg['s']], msg['E'], received, bid, ask)
+                self.recorder.record(msg['s'], msg['E'], float(msg['w']), bid, ask)
+            elif msg['e'] == 'kline' and msg['k']['x']:
+                table.write_kline(rows[msg['s']], msg['k']['T'], received, float(msg['k']['c']))
+        return callback
+
+    def check_streams(self):
+        now = time.time()
+        for stream in self.streams.values():
+            if stream.stale(now):
+                self.stream_failed(stream.name, 'No events for {0:.0f} s'.format(now - stream.last_event))
+        self.stream_check = self.scheduler.after(self.stale_check, self.check_streams)
+
+    def stream_failed(self, name, message):
+        stream = self.streams[name]
+        if stream.reconnecting:
+            return
+        stream.reconnecting = True
+        if stream.conn_key is not None:
+            self.bm.stop_socket(stream.conn_key)
+            stream.conn_key = None
+        delay = stream.backoff()
+        table, k = self.connections[name]
+        table.set_connection(k, True, delay, message)
+        self.scheduler.after(int(delay * 1000), self.reconnect_stream, name)
+
+    def reconnect_stream(self, name):
+        stream = self.streams[name]
+        try:
+            stream.connect()
+        except ORDER_ERRORS as e:
+            stream.reconnecting = False
+            self.stream_failed(name, 'Reconnect failed: {0}'.format(e))
+            return
+        table, k = self.connections[name]
+        table.set_connection(k, False, 0.0, '')
+
+    def close(self):
+        if self.stream_check is not None:
+            self.scheduler.after_cancel(self.stream_check)
+            self.stream_check = None
+        self.recorder.close()
+        if self.bm is not None:
+            self.bm.close()
+            self.bm = None
+            reactor.stop()
+
+
+class RebalanceEngine(object):
+    '''
+    Portfolio state, market data handling, trade decisions and automation
+    with no dependency on Tk. Views subscribe to the engine and are told
+    about changes through on_<event> methods. Timed work goes through
+    'scheduler', which must provide the after/after_idle/after_cancel
+    interface of a Tk widget (see LoopScheduler for headless use).
+    Market data comes from 'hub', which may be shared with the engines of
+    other portfolios; an engine given none gets a hub of its own. 'name'
+    tells portfolios sharing a hub apart.
+    '''
+    #methods timed while profiling is on
+    profiled_methods = ('update_price', 'update_balance', 'update_trades', 'update_trends',
+                        'update_rules', 'orders_submitted', 'cancel_failed', 'stream_failed', 'resync',
+                        'execute_transactions', 'place_order')
+
+    def __init__(self, coins, scheduler, config_file='config.ini', hub=None, name=None):
+        self.coins = coins
+        self.name = name
+        self.scheduler = scheduler
+        self.listeners = []
+        self.queue = Queue.Queue()
+        self.state = None
+        self.client = None
+        self.rest = None
+        self.bm = None
+        self.trades_placed = 0
+        self.trades_completed = 0
+        self.messages_processed = 0
+        self.messages_coalesced = 0
+        self.automate = False
+        self.rebalance_callback = None
+        self.headers = self.column_headers()
+        self.read_config(config_file)
+        if name is not None:
+            self.journal_directory = os.path.join(self.journal_directory, name)
+            self.profile_directory = os.path.join(self.profile_directory, name)
+        if hub is None:
+            hub = MarketHub(scheduler, config_file)
+        self.hub = hub
+        hub.add(self)
+        self.rest_pool = hub.rest_pool
+        self.limiter = hub.limiter
+        self.rules = hub.rules
+        self.journal = TradeJournal(self.journal_directory, self.journal_commit, self.journal_max_bytes,
+                                    self.headers)
+        self.rebalance_started = None
+        self.sell_rows = []
+        self.sell_deadline = 0.0
+        self.streams = {}
+        self.feeds = []
+        self.orders = OrderIndex()
+        self.repricing = set()
+        self.order_check = None
+        self.order_ids = itertools.count()
+        self.drift = DriftTrigger(self.coin_band, self.total_band, self.min_interval,
+                                  self.drift_debounce, self.drift_cooldown)
+        self.metrics = Metrics()
+        self.profiler = Profiler(self.profile_directory)
+        self.profiler.add_targets(self, self.profiled_methods)
+
+    def read_config(self, config_file):
+        s_to_ms = 1000
+        config = ConfigParser.RawConfigParser(allow_no_value=False)
+        config.read(config_file)
+        self.trade_currency = config.get('trades', 'trade_currency')
+        if self.trade_currency != 'BTC':
+            raise ConfigError('{0} trading pairs are not supported yet, only BTC'.format(self.trade_currency))
+        self.trade_coin = self.trade_currency
+        self.rebalance_time = int(config.get('trades', 'rebalance_period')) * s_to_ms
+        if self.rebalance_time <= 0:
+            raise ConfigError('Rebalance period must be a positive integer (seconds)')
+        self.min_trade_value = float(config.get('trades', 'min_trade_value'))
+        if self.min_trade_value <= 0:
+            self.min_trade_value = None
+        self.trade_type = config.get('trades', 'trade_type')
+        if self.trade_type != 'MARKET' and self.trade_type != 'LIMIT':
+            raise ConfigError('{0} is not a supported trade type. Use MARKET or LIMIT'.format(self.trade_type))
+        self.order_max_age = float(config.get('orders', 'max_age'))
+        self.order_max_distance = float(config.get('orders', 'max_distance'))
+        self.order_check_interval = int(float(config.get('orders', 'check_interval')) * s_to_ms)
+        if self.order_max_age < 0 or self.order_max_distance < 0 or self.order_check_interval <= 0:
+            raise ConfigError('Order age and price distance limits must not be negative, nor the check interval zero')
+        self.coin_band = float(config.get('drift', 'coin_band'))
+        self.total_band = float(config.get('drift', 'total_band'))
+        self.min_interval = float(config.get('drift', 'min_interval'))
+        self.drift_debounce = float(config.get('drift', 'debounce'))
+        self.drift_cooldown = float(config.get('drift', 'cooldown'))
+        if min(self.coin_band, self.total_band, self.min_interval, self.drift_debounce, self.drift_cooldown) < 0:
+            raise ConfigError('Drift bands and intervals must not be negative')
+        frame_rate = float(config.get('display', 'frame_rate'))
+        if frame_rate <= 0:
+            raise ConfigError('Frame rate must be positive (frames per second)')
+        self.frame_interval = max(1, int(s_to_ms / frame_rate))
+        self.batch_size = int(config.get('websockets', 'batch_size'))
+        self.frame_budget = float(config.get('websockets', 'frame_budget')) / s_to_ms
+        if self.batch_size <= 0 or self.frame_budget <= 0:
+            raise ConfigError('Batch size and frame budget must be positive')
+        self.order_retries = int(config.get('rest', 'order_retries'))
+        self.sell_timeout = int(config.get('trades', 'sell_timeout'))
+        self.resync_interval = int(config.get('portfolio', 'resync_interval'))
+        if self.resync_interval <= 0:
+            raise ConfigError('Resync interval must be a positive integer (updates)')
+        self.trend_window = int(config.get('trends', 'window'))
+        self.trend_interval = int(config.get('trends', 'interval'))
+        if self.trend_window <= 0 or self.trend_interval <= 0:
+            raise ConfigError('Trend window and interval must be positive integers (seconds)')
+        self.journal_directory = config.get('journal', 'directory')
+        self.journal_commit = float(config.get('journal', 'commit_interval'))
+        self.journal_max_bytes = int(config.get('journal', 'max_bytes'))
+        if self.journal_commit <= 0 or self.journal_max_bytes <= 0:
+            raise ConfigError('Journal commit interval and segment size must be positive')
+        self.profile_directory = config.get('profiling', 'directory')
+        self.capture_seconds = float(config.get('profiling', 'capture_seconds'))
+        self.capture_mode = config.get('profiling', 'capture')
+        self.sample_interval = float(config.get('profiling', 'sample_interval'))
+        if self.capture_mode != 'stacks' and self.capture_mode != 'cprofile':
+            raise ConfigError('{0} is not a supported profile capture. Use stacks or cprofile'.format(self.capture_mode))
+        if self.capture_seconds <= 0 or self.sample_interval <= 0:
+            raise ConfigError('Profile capture length and sample interval must be positive (seconds)')
+
+    def subscribe(self, listener):
+        ''' Register a view to be notified of engine events '''
+        self.listeners.append(listener)
+
+    def notify(self, event, *args):
+        ''' Call on_<event> on every listener which handles it '''
+        for listener in self.listeners:
+            handler = getattr(listener, 'on_' + event, None)
+            if handler is not None:
+                handler(*args)
+
+    def login(self, api_key, api_secret):
+        ''' Create the Binance clients and check the exchange is reachable '''
+        self.client = Client(api_key, api_secret)
+        self.client.get_system_status()
+        self.rest = self.hub.async_client(api_key, api_secret)
+
+    def shutdown(self):
+        '''
+        Commit the trade journal and stop the user data stream. The market
+        data hub stops with its last engine.
+        '''
+        self.set_automation(False)
+        if self.order_check is not None:
+            self.scheduler.after_cancel(self.order_check)
+        self.profiler.stop()
+        self.journal.close()
+        if self.bm is not None:
+            self.bm.close()
+        self.hub.remove(self)
+
+    def start_websockets(self):
+        '''
+        Start the user data stream for trade execution reports and account
+        balance updates, and have the hub stream the prices and klines of
+        all coins in the portfolio. Start the message queue processor.
+        '''
+        self.bm = BinanceSocketManager(self.client)
+        callback = self.stream_callback('user', self.queue_msg)
+        start = lambda: self.bm.start_user_socket(callback)
+        self.streams = {'user': StreamSupervisor('user', start, None, max_delay=self.hub.max_backoff)}
+        self.streams['user'].connect()
+        trade_currency = self.trade_currency
+        symbols = list(self.state.symbols)
+        symbols.remove(trade_currency+trade_currency)
+        self.hub.subscribe(self, symbols)
+        self.hub.start()
+        self.feeds = self.hub.feeds(symbols)
+        self.scheduler.after_idle(self.scheduler.after,1,self.process_queue)
+        self.order_check = self.scheduler.after(self.order_check_interval, self.check_orders)
+
+    def stream_callback(self, name, handler):
+        '''
+        Wrap the message handler of stream 'name' so that every event is
+        recorded by its supervisor and errors are reported to the engine
+        instead of being handled on the websocket thread.
+        '''
+        def callback(msg):
+            if msg.get('e') == 'error':
+                self.queue.put({'e': 'streamError', 'stream': name, 'message': msg.get('m', '')})
+            else:
+                self.streams[name].touch()
+                msg.get('data', msg)['received'] = time.time()
+                handler(msg)
+        return callback
+
+    def stream_failed(self, name, message):
+        ''' Close a failed stream and schedule its reconnection after a backoff '''
+        if name in self.hub.streams:
+            self.hub.stream_failed(name, message)
+            return
+        stream = self.streams[name]
+        if stream.reconnecting:
+            return
+        stream.reconnecting = True
+        if stream.conn_key is not None:
+            self.bm.stop_socket(stream.conn_key)
+            stream.conn_key = None
+        delay = stream.backoff()
+        self.notify('stream_status', name, '{0}, reconnecting in {1:.0f} s'.format(message, delay))
+        self.scheduler.after(int(delay * 1000), self.reconnect_stream, name)
+
+    def reconnect_stream(self, name):
+        ''' Reopen a stream and refresh the state it carries, which may have changed meanwhile '''
+        stream = self.streams[name]
+        try:
+            stream.connect()
+        except ORDER_ERRORS as e:
+            #the user stream asks for a listen key over REST, which may fail like any request
+            stream.reconnecting = False
+            self.stream_failed(name, 'Reconnect failed: {0}'.format(e))
+            return
+        self.notify('stream_status', name, 'Reconnected')
+        self.hub.submit(self.fetch_snapshot, self.fetch_snapshot_async, stream)
+
+    def fetch_snapshot(self, stream):
+        '''
+        Take a REST snapshot of the account balances and open orders and
+        queue it. Runs on the REST pool. A failure is treated as a failure
+        of the stream.
+        '''
+        try:
+            self.limiter.acquire(weight=5)
+            balances = self.client.get_account()['balances']
+            self.limiter.acquire(weight=40)
+            orders = self.client.get_open_orders()
+            self.queue.put({'e': 'resync', 'stream': stream.name, 'balances': balances, 'orders': orders})
+        except (BinanceRequestException,
+                BinanceAPIException,
+                IOError) as e:
+            self.queue.put({'e': 'streamError', 'stream': stream.name,
+                            'message': 'Resync failed: {0}'.format(e)})
+
+    @defer.inlineCallbacks
+    def fetch_snapshot_async(self, stream):
+        ''' fetch_snapshot on the reactor, with both requests in flight at once '''
+        try:
+            account, orders = yield gather([self.rest.get_account(), self.rest.get_open_orders()])
+            self.queue.put({'e': 'resync', 'stream': stream.name, 'balances': account['balances'], 'orders': orders})
+        except (BinanceAPIException,
+                IOError) as e:
+            self.queue.put({'e': 'streamError', 'stream': stream.name,
+                            'message': 'Resync failed: {0}'.format(e)})
+
+    def resync(self, msg):
+        ''' Apply a REST snapshot taken after a stream reconnected '''
+        state = self.state
+        for ticker in msg.get('tickers', []):
+            i = state.symbol_index.get(ticker['symbol'])
+            if i is None:
+                continue
+            state.set_price(i, float(ticker['bidPrice']), float(ticker['askPrice']))
+            self.notify('price', i)
+        for balance in msg.get('balances', []):
+            i = state.index.get(balance['asset'])
+            if i is not None:
+                locked_balance = float(balance['locked'])
+                state.set_balance(i, float(balance['free']) + locked_balance, locked_balance)
+                self.notify('balance', i)
+        if 'orders' in msg:
+            self.orders.load(msg['orders'])
+            self.sync_open_orders()
+
+    def sync_open_orders(self):
+        ''' Count the open orders of every coin. Coins with none are free to be traded again. '''
+        state = self.state
+        for i, symbol in enumerate(state.symbols):
+            state.open_orders[i] = self.orders.count(symbol)
+        state.last_placement[state.open_orders == 0] = np.nan
+
+    def stream_status(self):
+        ''' Number of streams feeding the engine which are not waiting to reconnect, and of all of them '''
+        streams = list(self.streams.values()) + list(self.hub.streams.values())
+        return sum(1 for stream in streams if not stream.reconnecting), len(streams)
+
+    def populate_portfolio(self):
+        '''
+        Get all symbol info from Binance needed to
+        populate user portfolio data and execute trades
+        '''
+        trade_currency = self.trade_currency
+        self.state = PortfolioState(self.coins['coin'],
+                                    self.coins['fixed_balance'].values,
+                                    self.coins['allocation'].values,
+                                    trade_currency,
+                                    self.resync_interval)
+        state = self.state
+        self.price_time = np.zeros(len(state))
+        self.trendlines = {}
+        phases = 4
+        self.notify('progress', 'Fetching account balances', 0, phases)
+        if self.rest is not None:
+            account, open_orders, tickers = self.hub.call(lambda: gather([self.rest.get_account(),
+                                                                          self.rest.get_open_orders(),
+                                                                          self.rest.get_orderbook_tickers()]))
+        else:
+            self.limiter.acquire(weight=5)
+            account = self.client.get_account()
+            self.limiter.acquire(weight=40)
+            open_orders = self.client.get_open_orders()
+            self.notify('progress', 'Fetching prices', 1, phases)
+            self.limiter.acquire(weight=2)
+            tickers = self.client.get_orderbook_tickers()
+        balances = {balance['asset']: balance for balance in account['balances']}
+        self.orders.load(open_orders)
+        tickers = {ticker['symbol']: ticker for ticker in tickers}
+        pairs = [symbol for symbol in state.symbols if symbol != trade_currency+trade_currency]
+        if self.rules.covers(pairs):
+            self.notify('progress', 'Using cached exchange information', 2, phases)
+        else:
+            self.notify('progress', 'Fetching exchange information', 2, phases)
+            self.rules.refresh(self.fetch_exchange_info)
+        for coin in state.coins:
+            pair = coin+trade_currency
+            balance = balances.get(coin, {'free': 0.0, 'locked': 0.0})
+            if coin != trade_currency:
+                rules = self.rules.get(pair)
+                if rules is None or pair not in tickers:
+                    raise ConfigError('{0} is not traded on Binance'.format(pair))
+                bid = float(tickers[pair]['bidPrice'])
+                ask = float(tickers[pair]['askPrice'])
+                i = state.set_row(coin,
+                                  exchange_balance=float(balance['free']),
+                                  locked_balance=float(balance['locked']),
+                                  askprice=ask,
+                                  bidprice=bid,
+                                  price=ask)
+                self.apply_rules(i, rules)
+                self.trendlines[coin] = TrendLine(self.trend_window, self.trend_interval)
+            else:
+                state.set_row(coin,
+                              exchange_balance=float(balance['free']),
+                              locked_balance=float(balance['locked']),
+                              askprice=1.0,
+                              bidprice=1.0,
+                              price=1.0)
+        state.initialize_values()
+        self.sync_open_orders()
+        self.notify('portfolio_loaded')
+        self.notify('progress', 'Testing connection', 3, phases)
+        self.dryrun()
+        self.notify('progress', 'Ready', phases, phases)
+        self.hub.schedule_rules_refresh()
+
+    def fetch_exchange_info(self):
+        self.limiter.acquire(weight=1)
+        return self.client.get_exchange_info()
+
+    def apply_rules(self, i, rules):
+        ''' Copy the trading rules of a symbol into row i of the portfolio '''
+        minvalue = rules.minnotional
+        if self.min_trade_value is not None:
+            minvalue = self.min_trade_value
+        self.state.set_row(self.state.coins[i],
+                           minprice=rules.minprice,
+                           maxprice=rules.maxprice,
+                           ticksize=rules.ticksize,
+                           minqty=rules.minqty,
+                           maxqty=rules.maxqty,
+                           stepsize=rules.stepsize,
+                           minnotional=minvalue)
+
+    def update_rules(self, msg):
+        ''' Apply freshly downloaded symbol rules to the portfolio '''
+        state = self.state
+        for i, symbol in enumerate(state.symbols):
+            rules = self.rules.get(symbol)
+            if i != state.trade_index and rules is not None:
+                self.apply_rules(i, rules)
+
+    def queue_msg(self, msg):
+        '''
+        Add a websocket message to the message queue. Stream errors are
+        handled per stream by the callbacks of start_websockets.
+        '''
+        self.queue.put(msg)
+
+    def get_batch(self):
+        '''Pull up to batch_size messages off the queue without blocking'''
+        batch = []
+        try:
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get(block=False))
+        except Queue.Empty:
+            pass
+        return batch
+
+    def get_msg(self):
+        '''
+        Reroute a batch of new websocket messages to the appropriate
+        handlers, skipping price updates which are already out of date,
+        after the updates polled from the ingest process if there is one.
+        The latency stamps of every websocket message are recorded.
+        Returns the number of messages and updates handled.
+        '''
+        polled = 0
+        read = done = time.time()
+        for feed in self.feeds:
+            for event_type, msg, event_time, received in feed.poll():
+                start = done
+                if event_type == 'kline':
+                    self.update_trends(msg)
+                else:
+                    self.update_price(msg)
+                done = time.time()
+                self.metrics.observe_message(event_type, event_time, received, read, start, done)
+                polled += 1
+        batch = self.get_batch()
+        msgs = coalesce_tickers(batch)
+        dequeued = done = time.time()
+        for msg in msgs:
+            start = done
+            if msg['e'] == '24hrTicker':
+                self.update_price(msg)
+            elif msg['e'] == 'outboundAccountInfo':
+                self.update_balance(msg)
+            elif msg['e'] == 'executionReport':
+                self.update_trades(msg)
+            elif msg['e'] == 'kline':
+                self.update_trends(msg)
+            elif msg['e'] == 'symbolRules':
+                self.update_rules(msg)
+            elif msg['e'] == 'ordersSubmitted':
+                self.orders_submitted(msg)
+            elif msg['e'] == 'cancelFailed':
+                self.cancel_failed(msg)
+            elif msg['e'] == 'streamError':
+                self.stream_failed(msg['stream'], msg['message'])
+            elif msg['e'] == 'resync':
+                self.resync(msg)
+            elif msg['e'] == 'profileSaved':
+                self.notify('profile_saved', msg['path'])
+            done = time.time()
+            received = msg.get('received')
+            if received is not None:
+                self.metrics.observe_message(msg['e'], msg.get('E'), received, dequeued, start, done)
+        self.messages_processed += len(msgs) + polled
+        self.messages_coalesced += len(batch) - len(msgs)
+        return len(batch) + polled
+
+    def process_queue(self, flush=False):
+        '''
+        Check for new messages in the queue periodically, handling batches
+        until the queue is empty or the frame budget is used up.
+        Recursively calls itself to perpetuate the process.
+        '''
+        depth = self.queue.qsize()
+        self.metrics.set('queue_depth', depth)
+        if depth > self.metrics.gauges.get('queue_depth_peak', 0):
+            self.metrics.set('queue_depth_peak', depth)
+        if flush:
+            while self.get_msg():
+                pass
+        else:
+            processed = self.messages_processed
+            deadline = time.time() + self.frame_budget
+            while self.get_msg() and time.time() < deadline:
+                pass
+            if self.messages_processed != processed:
+                self.check_drift()
+            self.scheduler.after_idle(self.scheduler.after,1,self.process_queue)
+
+    def update_trends(self, msg):
+        ''' Feed the close of every finished kline to the trend line of its coin '''
+        k = msg['k']
+        if k['x']:
+            i = self.state.symbol_index.get(msg['s'])
+            if i is None:
+                return
+            trendline = self.trendlines[self.state.coins[i]]
+            trendline.append(k['T'] / 1000.0, float(k['c']))
+            self.notify('trend', i, trendline.trend())
+
+    def update_trades(self, msg):
+        '''
+        Update balances whenever a partial execution occurs. The user data
+        stream reports every order on the account, those of symbols outside
+        the portfolio are ignored.
+        '''
+        state = self.state
+        i = state.symbol_index.get(msg['s'])
+        if i is None:
+            return
+        filled = float(msg['z'])
+        orderqty = float(msg['q'])
+        if filled >= orderqty:
+            state.last_execution[i] = time.mktime(datetime.now().timetuple())
+            self.trades_completed += 1
+        self.notify('execution', i, msg['S'], filled, orderqty)
+        self.journal.append(msg)
+        ended = self.orders.update(msg)
+        state.open_orders[i] = self.orders.count(msg['s'])
+        if ended is not None and state.open_orders[i] == 0:
+            #nothing left on the book, the coin may be traded again
+            state.last_placement[i] = np.nan
+            if i in self.repricing:
+                self.scheduler.after_idle(self.reprice)
+
+    def update_balance(self, msg):
+        ''' Update user balances whenever an account update message is received '''
+        state = self.state
+        index = state.index
+        for balance in msg['B']:
+            i = index.get(balance['a'])
+            if i is not None:
+                locked_balance = float(balance['l'])
+                state.set_balance(i, float(balance['f']) + locked_balance, locked_balance)
+                self.notify('balance', i)
+
+    def update_price(self, msg):
+        ''' Update symbol prices and user allocations whenever a price update is received '''
+        state = self.state
+        try:
+            i = state.symbol_index[msg['s']]
+        except KeyError: #cheaper than get() while the symbol is known, which it nearly always is
+            return
+        state.set_price(i, float(msg['b']), float(msg['a']))
+        self.price_time[i] = msg['E'] / 1000.0
+        self.notify('price', i)
+
+    def execute_transactions(self, side, dryrun, callback=None, only=None):
+        '''
+        Plan the required trade for each coin, or for the rows in 'only',
+        and submit those which belong to the appropriate side concurrently
+        on the REST pool, or the reactor with the async client. Dry runs
+        wait for their test orders. Live orders are submitted in the
+        background and their results are handled through the message
+        queue, after which 'callback' is called if given.
+        '''
+        self.process_queue(flush=True)
+        self.observe_decision_age()
+        plan = plan_rebalance(self.state)
+        rows = []
+        for i in plan.rows(side):
+            if only is not None and i not in only:
+                continue
+            if plan.status[i] == RebalancePlan.TRADE_READY:
+                rows.append(i)
+            else:
+                self.notify('order_status', i, plan.action(i), plan.reason(i))
+        def submit(i):
+            #an error escaping the pool would leave the batch, and a rebalance pass, unfinished
+            try:
+                return self.try_order(i, plan.qty[i], plan.price[i], side, dryrun)
+            except Exception as e:
+                return 'Order failed: {0}: {1}'.format(type(e).__name__, e)
+        submit_async = lambda: gather([self.try_order_async(i, plan.qty[i], plan.price[i], side, dryrun)
+                                       for i in rows])
+        if dryrun:
+            if self.rest is not None:
+                errors = self.hub.call(submit_async)
+            else:
+                errors = self.rest_pool.map(submit, rows)
+            self.orders_submitted({'side': side, 'dryrun': dryrun, 'plan': plan,
+                                   'rows': rows, 'errors': errors, 'callback': callback})
+            return
+        placed = time.mktime(datetime.now().timetuple())
+        for i in rows:
+            self.state.last_placement[i] = placed
+            self.state.last_order[i] = placed
+            self.notify('order_status', i, plan.action(i), 'Placing order')
+        def submitted(errors):
+            self.queue.put({'e': 'ordersSubmitted', 'side': side, 'dryrun': dryrun, 'plan': plan,
+                            'rows': rows, 'errors': errors, 'callback': callback})
+        if not rows:
+            submitted([])
+        elif self.rest is not None:
+            reactor.callFromThread(lambda: submit_async().addCallbacks(
+                submitted, lambda failure: submitted([failure.getErrorMessage()] * len(rows))))
+        else:
+            self.rest_pool.map_async(submit, rows, callback=submitted)
+
+    def observe_decision_age(self):
+        ''' Record how old the stalest price is as a rebalance decision is made '''
+        ages = np.delete(self.price_time, self.state.trade_index)
+        if len(ages) and np.all(ages > 0):
+            age = time.time() - np.min(ages)
+            self.metrics.observe('decision', 'rebalance', age)
+            self.metrics.set('decision_age_seconds', age)
+
+    def orders_submitted(self, msg):
+        ''' Report the outcome of a batch of orders submitted by execute_transactions '''
+        plan = msg['plan']
+        for i, error in zip(msg['rows'], msg['errors']):
+            if error is not None:
+                if not msg['dryrun']:
+                    self.state.last_placement[i] = np.nan
+                    self.state.last_order[i] = np.nan
+                self.notify('order_event', i, error)
+                self.notify('order_status', i, plan.action(i), '')
+            elif msg['dryrun']:
+                self.notify('order_status', i, plan.action(i), plan.reason(i))
+            else:
+                self.trades_placed += 1
+                self.notify('order_event', i, 'Trade Placed')
+                self.notify('order_status', i, plan.action(i), 'Trade Placed')
+        self.notify('rebalance', msg['side'], msg['dryrun'])
+        if msg['callback'] is not None:
+            #not from inside get_msg, the rest of its batch comes first
+            self.scheduler.after_idle(msg['callback'], msg)
+
+    def try_order(self, i, qty, price, side, dryrun):
+        '''
+        Place an order for row i of the portfolio, backing off and retrying
+        when the exchange reports that rate limits were exceeded. Safe to
+        call from worker threads. Returns None on success or the error message.
+        '''
+        state = self.state
+        for attempt in range(self.order_retries + 1):
+            try:
+                self.place_order(state.coins[i], state.symbols[i], self.trade_type, qty, price, side, dryrun,
+                                 state.stepsize[i], state.ticksize[i])
+            except ORDER_ERRORS as e:
+                error = self.order_error(i, e, attempt)
+                if error is not None:
+                    return error
+            else:
+                self.limiter.succeeded()
+                return None
+
+    @defer.inlineCallbacks
+    def try_order_async(self, i, qty, price, side, dryrun):
+        ''' try_order on the reactor, the Deferred fires with None or the error message '''
+        state = self.state
+        for attempt in range(self.order_retries + 1):
+            params = self.order_params(state.symbols[i], self.trade_type, qty, price, side, dryrun,
+                                       state.stepsize[i], state.ticksize[i])
+            try:
+                if dryrun:
+                    yield self.rest.create_test_order(**params)
+                else:
+                    yield self.rest.create_order(**params)
+            except ORDER_ERRORS as e:
+                error = self.order_error(i, e, attempt)
+                if error is not None:
+                    defer.returnValue(error)
+            else:
+                self.limiter.succeeded()
+                defer.returnValue(None)
+
+    def order_error(self, i, e, attempt):
+        '''
+        Deal with error 'e' of attempt 'attempt' at an order for row i,
+        backing off when the exchange reports that rate limits were
+        exceeded. Returns the error message, or None to try again.
+        '''
+        if isinstance(e, BinanceAPIException):
+            if e.status_code in (TOO_MANY_REQUESTS, IP_BANNED):
+                self.limiter.backoff(retry_after(e))
+                if e.status_code == TOO_MANY_REQUESTS and attempt < self.order_retries:
+                    return None
+            if e.code == FILTER_FAILURE:
+                self.rules.invalidate(self.state.symbols[i])
+                self.rules.refresh_async(self.fetch_exchange_info, self.hub.rules_refreshed)
+        if isinstance(e, IOError):
+            return str(e)
+        return e.message
+
+    def check_orders(self):
+        '''
+        While automated, cancel the LIMIT orders of this app which have
+        been on the book longer than max_age or whose price is further
+        than max_distance from the market, to place them again at the
+        current price once they are gone.
+        '''
+        if self.automate:
+            state = self.state
+            def quote(symbol, side):
+                i = state.symbol_index.get(symbol)
+                if i is None:
+                    return None
+                return state.askprice[i] if side == SIDE_BUY else state.bidprice[i]
+            for order in self.orders.stale(time.time(), self.order_max_age, self.order_max_distance, quote):
+                i = state.symbol_index[order.symbol]
+                self.orders.cancelling.add(order.order_id)
+                self.repricing.add(i)
+                self.notify('order_event', i, 'Cancelling stale order')
+                self.hub.submit(self.cancel_order, self.cancel_order_async, order)
+        self.order_check = self.scheduler.after(self.order_check_interval, self.check_orders)
+
+    def cancel_order(self, order):
+        ''' Cancel 'order' on the exchange, runs on the REST pool '''
+        try:
+            self.limiter.acquire(weight=1)
+            self.client.cancel_order(symbol=order.symbol, orderId=order.order_id)
+        except (BinanceRequestException,
+                BinanceAPIException,
+                IOError) as e:
+            self.queue.put({'e': 'cancelFailed', 'order': order, 'message': str(e)})
+
+    @defer.inlineCallbacks
+    def cancel_order_async(self, order):
+        ''' cancel_order on the reactor '''
+        try:
+            yield self.rest.cancel_order(symbol=order.symbol, orderId=order.order_id)
+        except (BinanceAPIException,
+                IOError) as e:
+            self.queue.put({'e': 'cancelFailed', 'order': order, 'message': str(e)})
+
+    def cancel_failed(self, msg):
+        ''' Leave an order whose cancellation failed to be retried at the next check '''
+        order = msg['order']
+        i = self.state.symbol_index[order.symbol]
+        self.orders.cancelling.discard(order.order_id)
+        self.repricing.discard(i)
+        self.notify('order_event', i, 'Cancel failed: {0}'.format(msg['message']))
+
+    def reprice(self):
+        ''' Trade the coins whose stale orders have been cancelled again at the current price '''
+        rows = [i for i in self.repricing if self.state.open_orders[i] == 0]
+        self.repricing.difference_update(rows)
+        if rows and self.automate and self.rebalance_started is None:
+            self.execute_transactions(side=SIDE_SELL, dryrun=False, only=rows)
+            self.execute_transactions(side=SIDE_BUY, dryrun=False, only=rows)
+
+    def set_automation(self, enabled):
+        '''
+        Start or stop automated rebalancing: whenever the portfolio drifts
+        out of its bands, and every rebalance_period seconds without one.
+        '''
+        self.automate = enabled
+        if enabled:
+            self.automation()
+        elif self.rebalance_callback is not None:
+            self.scheduler.after_cancel(self.rebalance_callback)
+            self.rebalance_callback = None
+
+    def set_profiling(self, enabled):
+        '''
+        Start or stop timing the handlers and rebalance passes. Stopping
+        saves the timer report in the profile directory.
+        '''
+        if enabled == self.profiler.enabled:
+            return
+        if enabled:
+            self.profiler.start()
+        else:
+            self.notify('profile_saved', self.profiler.stop())
+        self.notify('profiling', enabled)
+
+    def toggle_profiling(self):
+        self.set_profiling(not self.profiler.enabled)
+
+    def capture_profile(self):
+        '''
+        Profile the main thread for capture_seconds, in the configured
+        capture mode. The path of the output is reported through the
+        message queue once it is written.
+        '''
+        callback = lambda path: self.queue.put({'e': 'profileSaved', 'path': path})
+        if self.profiler.capture(self.scheduler, self.capture_seconds, self.capture_mode,
+                                 self.sample_interval, callback):
+            self.notify('profiling_capture', self.capture_mode, self.capture_seconds)
+
+    def automation(self):
+        ''' Fallback timer, rebalances when no drift has triggered a pass for rebalance_period '''
+        self.rebalance_callback = None
+        if self.automate:
+            self.start_rebalance('Rebalance period elapsed')
+
+    def check_drift(self):
+        ''' Start a rebalance pass if the portfolio has drifted out of its bands '''
+        if self.automate and self.drift.enabled and self.rebalance_started is None:
+            reason = self.drift.check(self.state, time.time())
+            if reason is not None:
+                self.start_rebalance(reason)
+
+    def start_rebalance(self, reason):
+        ''' Start an automated rebalance pass and restart the fallback timer '''
+        if self.rebalance_callback is not None:
+            self.scheduler.after_cancel(self.rebalance_callback)
+        self.rebalance_callback = self.scheduler.after(self.rebalance_time, self.automation)
+        if self.rebalance_started is None:
+            self.drift.rebalanced(time.time())
+            self.notify('rebalance_trigger', reason)
+            self.rebalance()
+
+    def rebalance(self):
+        '''
+        Start a rebalance pass: submit all sells, wait until enough of the
+        trade currency is free or the sells have filled, then submit all
+        buys. Does nothing if a pass is already running.
+        '''
+        if self.rebalance_started is not None:
+            return
+        self.rebalance_started = time.time()
+        self.execute_transactions(side=SIDE_SELL, dryrun=False, callback=self.sells_submitted)
+
+    def sells_submitted(self, msg):
+        self.sell_rows = [i for i, error in zip(msg['rows'], msg['errors']) if error is None]
+        self.sell_deadline = time.time() + self.sell_timeout
+        self.wait_for_sells()
+
+    def wait_for_sells(self):
+        ''' Start the buys once they can be paid for or the sells are done '''
+        state = self.state
+        plan = plan_rebalance(state)
+        buys = plan.rows(SIDE_BUY)
+        buys = buys[(plan.status[buys] == RebalancePlan.TRADE_READY) |
+                    (plan.status[buys] == RebalancePlan.NO_TRADE_COIN)]
+        needed = np.sum(plan.qty[buys] * plan.price[buys])
+        if (state.tradecoin_free() >= needed or
+                not np.any(state.pending_orders()[self.sell_rows]) or
+                time.time() > self.sell_deadline):
+            self.execute_transactions(side=SIDE_BUY, dryrun=False, callback=self.buys_submitted)
+        else:
+            self.scheduler.after(100, self.wait_for_sells)
+
+    def buys_submitted(self, msg):
+        elapsed = time.time() - self.rebalance_started
+        self.rebalance_started = None
+        self.notify('rebalance_time', elapsed)
+
+    def execute_sells(self):
+        '''
+        Perform any sells required by overachieving coins
+        '''
+        self.execute_transactions(side=SIDE_SELL, dryrun=False)
+
+    def execute_buys(self):
+        '''
+        Perform any buys required by underachieving coins
+        '''
+        self.execute_transactions(side=SIDE_BUY, dryrun=False)
+
+    def dryrun(self):
+        '''
+        perform a dry run to list what trades are required
+        '''
+        self.execute_transactions(side=SIDE_SELL, dryrun=True)
+        self.execute_transactions(side=SIDE_BUY, dryrun=True)        
+        
+    def place_order(self, coin, pair, trade_type,
+                    quantity, price, side, dryrun,
+                    stepsize, ticksize):
+        '''
+        Format and place an order using the Binance API
+        '''
+        self.limiter.acquire(weight=1, order=not dryrun)
+        params = self.order_params(pair, trade_type, quantity, price, side, dryrun, stepsize, ticksize)
+        if dryrun:
+            self.client.create_test_order(**params)
+        else:
+            self.client.create_order(**params)
+
+    def order_params(self, pair, trade_type, quantity, price, side, dryrun, stepsize, ticksize):
+        ''' The parameters of an order request, live orders are marked with a client order id '''
+        params = {'symbol': pair,
+                  'side': side,
+                  'quantity': round_decimal(quantity, stepsize)}
+        if trade_type == 'LIMIT':
+            params['type'] = ORDER_TYPE_LIMIT
+            params['timeInForce'] = TIME_IN_FORCE_GTC
+            params['price'] = round_decimal(price, ticksize)
+        elif trade_type == 'MARKET':
+            params['type'] = ORDER_TYPE_MARKET
+        if not dryrun:
+            params['newClientOrderId'] = self.client_order_id()
+        return params
+
+    def client_order_id(self):
+        ''' A unique client order id which marks an order as placed by this app '''
+        return '{0}{1:x}-{2:x}'.format(CLIENT_ORDER_PREFIX, int(time.time() * 1000), next(self.order_ids))
+
+    @staticmethod
+    def column_headers():
+        ''' define human readable aliases for the headers in trade execution reports. '''
+        return {'e': 'event_type',
+                'E': 'event_time',
+                's': 'symbol',
+                'c': 'client_order_id',
+                'S': 'side',
+                'o': 'type',
+                'O': 'order_creation_time',
+                'f': 'time_in_force',
+                'q': 'order_quantity',
+                'p': 'order_price',
+                'P': 'stop_price',
+                'F': 'iceberg_quantity',
+                'g': 'ignore_1',
+                'C': 'original_client_order_id',
+                'x': 'current_execution_type',
+                'X': 'current_order_status',
+                'r': 'order_reject_reason',
+                'i': 'order_id',
+                'l': 'last_executed_quantity',
+                'z': 'cumulative_filled_quantity',
+                'Z': 'cumulative_quote_asset_transacted_qty',
+                'L': 'last_executed_price',
+                'n': 'commission_amount',
+                'N': 'commission_asset',
+                'T': 'transaction_time',
+                't': 'trade_id',
+                'I': 'ignore_2',
+                'w': 'order_working',
+                'm': 'maker_side',
+                'M': 'ignore_3',
+                'Y': 'last_quote_asset_transacted_qty'}
+
+
+class BalanceGUI(GUI_BASE):
+    def __init__(self, parent, engine):
+        ''' Initialize the GUI and subscribe to the rebalancing engine '''
+        tk.Frame.__init__(self, parent)
+        parent.protocol('WM_DELETE_WINDOW', self.on_closing)
+        self.parent = parent
+        parent.deiconify()
+        self.engine = engine
+        self.title = 'BinanceBalance'
+        if engine.name is not None:
+            self.title += ' - ' + engine.name
+        parent.wm_title(self.title)
+        self.trade_currency = engine.trade_currency
+        engine.subscribe(self)
+        
+        #portfolio display
+        self.portfolio_view = tk.LabelFrame(parent, text='Portfolio')
+        self.portfolio_view.grid(row=0, column=0, columnspan=2, sticky=tk.E + tk.W + tk.N + tk.S)
+        self.portfolio = ttk.Treeview(self.portfolio_view, height = len(engine.coins), selectmode = 'extended')
+        self.portfolio['columns']=('Stored',
+                                   'Exchange',
+                                   'Locked',
+                                   'Target',
+                                   'Actual',
+                                   'Bid',
+                                   'Ask',
+                                   'Action',
+                                   'Status',
+                                   'Event'
+                                   )
+        for label in self.portfolio['columns']:
+            if label == 'Status' or label == 'Event':
+                self.portfolio.column(label, width=200)
+            elif label == 'Action':
+                self.portfolio.column(label, width=120)
+            else:
+                self.portfolio.column(label, width=100)
+            self.portfolio.heading(label, text=label)
+        self.portfolio.grid(row=0,column=0)
+        self.cells = TreeviewRenderer(self.portfolio)
+        self.model_changed = False
+
+        for i in range(2):
+            self.parent.columnconfigure(i,weight=1, uniform='parent')
+            
+        #options display
+        self.controls_view = tk.LabelFrame(parent, text='Controls')
+        for i in range(4):
+            self.controls_view.columnconfigure(i,weight=1, uniform='controls')
+        self.controls_view.grid(row=1, column=0, sticky=tk.E + tk.W + tk.N + tk.S)
+        
+        self.key_label = tk.Label(self.controls_view, text='API Key', relief='ridge')
+        self.key_label.grid(row=0, column=0,sticky=tk.E + tk.W)
+        
+        self.secret_label = tk.Label(self.controls_view, text='API Secret', relief='ridge')
+        self.secret_label.grid(row=1, column=0,sticky=tk.E + tk.W)
+        
+        self.key_entry = tk.Entry(self.controls_view, show='*')
+        self.key_entry.grid(row=0, column=1, columnspan=2,sticky=tk.E + tk.W)
+        
+        self.secret_entry = tk.Entry(self.controls_view, show='*')
+        self.secret_entry.grid(row=1, column=1, columnspan=2, sticky=tk.E + tk.W)
+        
+        self.login = tk.Button(self.controls_view,
+                               text='Login',
+                               command = self.api_enter)
+        self.login.grid(row=0, column=3, rowspan=2, sticky=tk.E + tk.W + tk.N+tk.S)
+
+        #Statistics display
+        self.stats_view = tk.LabelFrame(parent, text='Statistics')
+        self.stats_view.grid(row=1, column=1, sticky=tk.E + tk.W + tk.N + tk.S)
+        for i in range(4):
+            self.stats_view.columnconfigure(i,weight=1, uniform='stats')
+
+        
+        self.trade_currency_value_label = tk.Label(self.stats_view, text=self.trade_currency + ' Value:', relief='ridge')
+        self.trade_currency_value_label.grid(row=0, column=0, sticky=tk.E + tk.W)
+        self.trade_currency_value_string = tk.StringVar()
+        self.trade_currency_value_string.set('0')
+        self.trade_currency_value = tk.Label(self.stats_view, textvariable=self.trade_currency_value_string)
+        self.trade_currency_value.grid(row=0, column=1, sticky=tk.E + tk.W)
+
+        self.imbalance_label = tk.Label(self.stats_view, text='Imbalance:', relief='ridge')
+        self.imbalance_label.grid(row=1, column=0, sticky=tk.E + tk.W)
+        self.imbalance_string = tk.StringVar()
+        self.imbalance_string.set('0%')
+        self.imbalance_value = tk.Label(self.stats_view, textvariable=self.imbalance_string)
+        self.imbalance_value.grid(row=1, column=1, sticky=tk.E + tk.W)
+
+
+        self.messages_queued_label = tk.Label(self.stats_view, text='Queue (Peak):', relief='ridge')
+        self.messages_queued_label.grid(row=0, column=2, sticky=tk.E + tk.W)
+        
+        self.messages_string = tk.StringVar()
+        self.messages_string.set('0')
+        self.messages_queued = tk.Label(self.stats_view, textvariable=self.messages_string)
+        self.messages_queued.grid(row=0, column=3, sticky=tk.E + tk.W)
+
+        
+        self.trades_label = tk.Label(self.stats_view, text='Trades Placed:', relief='ridge')
+        self.trades_label.grid(row=1, column=2, sticky=tk.E + tk.W)
+        self.trades_count = tk.IntVar()
+        self.trades_count.set(0)
+        self.trades_count_display = tk.Label(self.stats_view, textvariable=self.trades_count)
+        self.trades_count_display.grid(row=1, column=3, sticky=tk.E + tk.W)
+
+        self.processed_label = tk.Label(self.stats_view, text='Messages Processed:', relief='ridge')
+        self.processed_label.grid(row=2, column=0, sticky=tk.E + tk.W)
+        self.processed_count = tk.IntVar()
+        self.processed_count.set(0)
+        self.processed_count_display = tk.Label(self.stats_view, textvariable=self.processed_count)
+        self.processed_count_display.grid(row=2, column=1, sticky=tk.E + tk.W)
+
+        self.coalesced_label = tk.Label(self.stats_view, text='Messages Coalesced:', relief='ridge')
+        self.coalesced_label.grid(row=2, column=2, sticky=tk.E + tk.W)
+        self.coalesced_count = tk.IntVar()
+        self.coalesced_count.set(0)
+        self.coalesced_count_display = tk.Label(self.stats_view, textvariable=self.coalesced_count)
+        self.coalesced_count_display.grid(row=2, column=3, sticky=tk.E + tk.W)
+
+        self.rebalance_label = tk.Label(self.stats_view, text='Last Rebalance:', relief='ridge')
+        self.rebalance_label.grid(row=3, column=0, sticky=tk.E + tk.W)
+        self.rebalance_string = tk.StringVar()
+        self.rebalance_string.set('-')
+        self.rebalance_value = tk.Label(self.stats_view, textvariable=self.rebalance_string)
+        self.rebalance_value.grid(row=3, column=1, sticky=tk.E + tk.W)
+
+        self.streams_label = tk.Label(self.stats_view, text='Streams:', relief='ridge')
+        self.streams_label.grid(row=3, column=2, sticky=tk.E + tk.W)
+        self.streams_string = tk.StringVar()
+        self.streams_string.set('-')
+        self.streams_value = tk.Label(self.stats_view, textvariable=self.streams_string)
+        self.streams_value.grid(row=3, column=3, sticky=tk.E + tk.W)
+
+        self.age_label = tk.Label(self.stats_view, text='Price Age p50/p99:', relief='ridge')
+        self.age_label.grid(row=4, column=0, sticky=tk.E + tk.W)
+        self.age_string = tk.StringVar()
+        self.age_string.set('-')
+        self.age_value = tk.Label(self.stats_view, textvariable=self.age_string)
+        self.age_value.grid(row=4, column=1, sticky=tk.E + tk.W)
+
+        self.decision_label = tk.Label(self.stats_view, text='Decision Age:', relief='ridge')
+        self.decision_label.grid(row=4, column=2, sticky=tk.E + tk.W)
+        self.decision_string = tk.StringVar()
+        self.decision_string.set('-')
+        self.decision_value = tk.Label(self.stats_view, textvariable=self.decision_string)
+        self.decision_value.grid(row=4, column=3, sticky=tk.E + tk.W)
+
+        #profiling: F11 toggles the timers, F12 captures a profile
+        engine.profiler.add_targets(self, ('render', 'update_status', 'update_queue_status',
+                                           'update_allocations', 'update_actions'))
+        parent.bind('<F11>', lambda event: self.engine.toggle_profiling())
+        parent.bind('<F12>', lambda event: self.engine.capture_profile())
+
+    def on_closing(self):
+        ''' Check that all trades have executed
+        before starting the save and exit process
+        '''
+        engine = self.engine
+        if engine.trades_placed > 0 and engine.trades_completed < engine.trades_placed:
+            if messagebox.askokcancel('Quit', 'Not all trades have completed. Quit anyway?'):
+                self.save_and_quit()
+        else:
+            self.save_and_quit()
+
+    def save_and_quit(self):
+        '''
+        Save the session and stop all websockets, then close the window,
+        exiting the GUI once no other portfolio is open.
+        '''
+        self.engine.shutdown()
+        if self.engine.hub.engines:
+            self.parent.destroy()
+        else:
+            self.parent.nametowidget('.').destroy()
+
+    def exit_error(self):
+        if self.quit_on_exit:
+            self.top.destroy()
+            self.save_and_quit()
+        else:
+            self.top.destroy()
+
+    def display_error(self, title, error, quit_on_exit=False):
+        self.quit_on_exit = quit_on_exit
+        self.top = tk.Toplevel()
+        self.top.title('Login Error')
+        msg = tk.Message(self.top, text=error)
+        msg.grid(row=0, column=0)
+        button = tk.Button(self.top, text="Dismiss", command=self.exit_error)
+        button.grid(row=1, column=0)
+        self.top.attributes('-topmost', 'true')
+            
+    def api_enter(self):
+        '''
+        Log in to Binance with the provided credentials,
+        update user portfolio and start listening to price and
+        account update websockets.
+        '''
+        api_key = self.key_entry.get()
+        self.key_entry.delete(0,'end')
+        api_secret = self.secret_entry.get()
+        self.secret_entry.delete(0,'end')
+        
+        try:
+            self.engine.login(api_key, api_secret)
+        except (BinanceRequestException,
+                BinanceAPIException) as e:
+            self.display_error('Login Error', e.message)
+        else:
+            try:
+                self.populate_portfolio()
+            except BinanceAPIException as e:
+                self.display_error('API Error', e.message, quit_on_exit=True)
+            except ConfigError as e:
+                self.display_error('Config Error', str(e), quit_on_exit=True)
+            else:
+                self.engine.start_websockets()
+
+    def populate_portfolio(self):
+        '''
+        Swap the login controls for a progress bar while the engine
+        loads the portfolio, then show the trading controls.
+        '''
+        self.cells.clear()
+
+        #update the GUI context
+        self.key_label.destroy()
+        self.key_entry.destroy()
+        self.secret_label.destroy()
+        self.secret_entry.destroy()
+        self.login.destroy()
+        
+        self.updatetext = tk.StringVar()
+        self.updatetext.set('Initializing')
+        self.progresslabel = tk.Label(self.controls_view, textvariable=self.updatetext)
+        self.progresslabel.grid(row=1, column=0, columnspan=4, sticky=tk.E + tk.W)
+        self.progress_var = tk.DoubleVar()
+        self.progress_var.set(0)
+        self.progressbar = ttk.Progressbar(self.controls_view, variable=self.progress_var, maximum=len(self.engine.coins))
+        self.progressbar.grid(row=0, column=0, columnspan=4, sticky=tk.E + tk.W)
+        self.engine.populate_portfolio()
+        self.progressbar.destroy()
+        self.progresslabel.destroy()
+        self.render()
+
+        self.automate_text = tk.StringVar()
+        self.automate_text.set('Start Automation')
+        self.toggle_automate = tk.Button(self.controls_view,
+                                         textvariable=self.automate_text,
+                                         command=self.toggle_automation)
+        self.toggle_automate.grid(row=0, column=0, rowspan=2, columnspan=2, sticky=tk.E + tk.W + tk.N + tk.S)
+        self.sell_button = tk.Button(self.controls_view,
+                                     text='Execute Sells',
+                                     command=self.engine.execute_sells)
+        self.sell_button.grid(row=0, column=2, columnspan=2, sticky=tk.E + tk.W)
+        self.buy_button = tk.Button(self.controls_view,
+                                    text='Execute Buys',
+                                    command=self.engine.execute_buys)
+        self.buy_button.grid(row=1, column=2, columnspan=2, sticky=tk.E + tk.W)
+
+    def toggle_automation(self):
+        if not self.engine.automate:
+            self.automate_text.set('Stop Automation')
+        else:
+            self.automate_text.set('Start Automation')
+        self.engine.set_automation(not self.engine.automate)
+
+    def on_progress(self, text, done, total):
+        self.updatetext.set(text)
+        self.progressbar.configure(maximum=total)
+        self.progress_var.set(done)
+        self.progressbar.update()
+        self.progresslabel.update()
+
+    def on_portfolio_loaded(self):
+        state = self.engine.state
+        self.update_status()
+        for i, coin in enumerate(state.coins):
+            self.cells.insert(i,
+                              coin,
+                              values=(state.fixed_balance[i],
+                                      state.exchange_balance[i],
+                                      state.locked_balance[i],
+                                      '{0} %'.format(state.allocation[i]),
+                                      '{0:.2f} %'.format(state.actual[i]),
+                                      round_decimal(state.price[i], state.ticksize[i]),
+                                      round_decimal(state.price[i], state.ticksize[i]),
+                                      '',
+                                      ''
+                                      )
+                              )
+
+    def on_price(self, i):
+        state = self.engine.state
+        coin = state.coins[i]
+        self.cells.set(coin, column='Ask', value=round_decimal(state.askprice[i], state.ticksize[i]))
+        self.cells.set(coin, column='Bid', value=round_decimal(state.bidprice[i], state.ticksize[i]))
+        self.model_changed = True
+
+    def on_balance(self, i):
+        state = self.engine.state
+        coin = state.coins[i]
+        self.cells.set(coin, column='Exchange', value=round_decimal(state.exchange_balance[i], state.stepsize[i]))
+        self.cells.set(coin, column='Locked', value=round_decimal(state.locked_balance[i], state.stepsize[i]))
+        self.model_changed = True
+
+    def on_execution(self, i, side, filled, orderqty):
+        self.cells.set(self.engine.state.coins[i],
+                       column='Event',
+                       value = '{0} {1}/{2} {3}'.format(side, filled, orderqty,datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+    def on_order_event(self, i, text):
+        self.cells.set(self.engine.state.coins[i], column='Event', value=text)
+
+    def on_order_status(self, i, action, status):
+        coin = self.engine.state.coins[i]
+        self.cells.set(coin, column='Status', value=status)
+        self.cells.set(coin, column='Action', value=action)
+
+    def on_rebalance_time(self, elapsed):
+        self.rebalance_string.set('{0:.2f} s'.format(elapsed))
+
+    def on_metrics_error(self, message):
+        self.display_error('Metrics Error', message)
+
+    def on_profiling(self, enabled):
+        self.parent.wm_title(self.title + ' (profiling)' if enabled else self.title)
+
+    def on_profile_saved(self, path):
+        messagebox.showinfo('Profile Saved', 'Profile saved to {0}'.format(path))
+
+    def render(self):
+        '''
+        Bring the display up to date with the portfolio model and push
+        all changed cells to the portfolio view. Runs once per frame so
+        that Tk work is bounded by the frame rate rather than the rate at
+        which messages arrive.
+        '''
+        if self.model_changed:
+            self.model_changed = False
+            self.update_allocations()
+            self.update_actions()
+            self.update_status()
+        self.update_queue_status()
+        self.cells.flush()
+        self.parent.after(self.engine.frame_interval, self.render)
+
+    def update_status(self):
+        '''Update the statistics frame whenever a change occurs in balance or price'''
+        state = self.engine.state
+        value = '{0:.8f}'.format(state.total)
+        imbalance = '{0:.2f}%'.format(state.imbalance())
+        self.trade_currency_value_string.set(value)
+        self.imbalance_string.set(imbalance)
+
+    def update_queue_status(self):
+        ''' Show the message backlog and counters in the statistics frame '''
+        engine = self.engine
+        gauges = engine.metrics.gauges
+        self.messages_string.set('{0} ({1})'.format(engine.queue.qsize(), gauges.get('queue_depth_peak', 0)))
+        age = engine.metrics.histogram('age', '24hrTicker')
+        if age.count:
+            self.age_string.set('{0:.0f} / {1:.0f} ms'.format(1000 * age.quantile(0.5), 1000 * age.quantile(0.99)))
+        if 'decision_age_seconds' in gauges:
+            self.decision_string.set('{0:.2f} s'.format(gauges['decision_age_seconds']))
+        self.processed_count.set(engine.messages_processed)
+        self.coalesced_count.set(engine.messages_coalesced)
+        self.trades_count.set(engine.trades_completed)
+        connected, total = engine.stream_status()
+        if total:
+            self.streams_string.set('{0}/{1} Connected'.format(connected, total))
+
+    def update_allocations(self):
+        ''' Display the actual allocation of every coin '''
+        state = self.engine.state
+        for i, coin in enumerate(state.coins):
+            self.cells.set(coin, column='Actual', value='{0:.2f}%'.format(state.actual[i]))
+
+    def update_actions(self):
+        '''
+        Calcuate required trades and update the main GUI
+        '''
+        plan = plan_rebalance(self.engine.state)
+        for i, coin in enumerate(self.engine.state.coins):
+            self.cells.set(coin, column='Status', value=plan.reason(i))
+            self.cells.set(coin, column='Action', value=plan.action(i))
+
+
+class JsonFormatter(logging.Formatter):
+    ''' Format log records as one JSON object per line '''
+    def format(self, record):
+        entry = {'time': self.formatTime(record),
+                 'level': record.levelname,
+                 'event': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, sort_keys=True)
+
+
+class LogView(object):
+    '''
+    Headless counterpart of BalanceGUI which reports engine events as
+    structured log records instead of displaying them.
+    '''
+    def __init__(self, engine, logger):
+        self.engine = engine
+        self.logger = logger
+        engine.subscribe(self)
+
+    def log(self, event, level=logging.INFO, **fields):
+        if self.engine.name is not None:
+            fields['portfolio'] = self.engine.name
+        self.logger.log(level, event, extra={'fields': fields})
+
+    def on_progress(self, text, done, total):
+        self.log('progress', message=text, done=done, total=total)
+
+    def on_execution(self, i, side, filled, orderqty):
+        self.log('execution', symbol=self.engine.state.symbols[i], side=side,
+                 filled=filled, quantity=orderqty)
+
+    def on_order_event(self, i, text):
+        self.log('order', symbol=self.engine.state.symbols[i], message=text)
+
+    def on_order_status(self, i, action, status):
+        self.log('plan', level=logging.DEBUG, symbol=self.engine.state.symbols[i],
+                 action=action, status=status)
+
+    def on_rebalance_time(self, elapsed):
+        self.log('rebalance_time', seconds=elapsed)
+
+    def on_rebalance_trigger(self, reason):
+        self.log('rebalance_trigger', reason=reason)
+
+    def on_stream_status(self, name, status):
+        self.log('stream_status', level=logging.WARNING, stream=name, status=status)
+
+    def on_metrics_error(self, message):
+        self.log('metrics_error', level=logging.ERROR, message=message)
+
+    def on_profiling(self, enabled):
+        self.log('profiling', enabled=enabled)
+
+    def on_profiling_capture(self, mode, seconds):
+        self.log('profiling_capture', mode=mode, seconds=seconds)
+
+    def on_profile_saved(self, path):
+        self.log('profile_saved', path=path)
+
+    def on_trend(self, i, direction):
+        self.log('trend', level=logging.DEBUG, symbol=self.engine.state.symbols[i], direction=direction)
+
+    def on_rebalance(self, side, dryrun):
+        state = self.engine.state
+        self.log('rebalance', side=side, dryrun=dryrun, total=float(state.total),
+                 imbalance=float(state.imbalance()), queued=self.engine.queue.qsize())
+
+
+def read_credentials(keyfile=None):
+    '''
+    Read the API key and secret from 'keyfile' (key on the first line,
+    secret on the second) or from the BINANCE_API_KEY and
+    BINANCE_API_SECRET environment variables.
+    '''
+    if keyfile is not None:
+        with open(keyfile) as f:
+            lines = [line.strip() for line in f if line.strip()]
+        if len(lines) < 2:
+            raise ValueError('{0} must hold the API key and secret on separate lines'.format(keyfile))
+        return lines[0], lines[1]
+    api_key = os.environ.get('BINANCE_API_KEY')
+    api_secret = os.environ.get('BINANCE_API_SECRET')
+    if not api_key or not api_secret:
+        raise ValueError('Set BINANCE_API_KEY and BINANCE_API_SECRET or pass --keyfile')
+    return api_key, api_secret
+
+
+def use_exchange(config_file):
+    '''
+    Point every client and socket manager at the exchange given under
+    [exchange] in 'config_file', such as a local simulator, or leave
+    them on Binance when its URLs are empty.
+    '''
+    config = ConfigParser.RawConfigParser(allow_no_value=False)
+    config.read(config_file)
+    rest_url = config.get('exchange', 'rest_url').rstrip('/')
+    stream_url = config.get('exchange', 'stream_url').rstrip('/')
+    if rest_url:
+        Client.API_URL = rest_url + '/api'
+        Client.WITHDRAW_API_URL = rest_url + '/wapi'
+    if stream_url:
+        BinanceSocketManager.STREAM_URL = stream_url + '/'
+
+
+Portfolio = namedtuple('Portfolio', ['name', 'coins', 'keyfile', 'config'])
+
+
+def read_portfolios(path, config_file):
+    '''
+    Read the portfolios to run side by side from a CSV file with a row per
+    portfolio: its name and allocation file, and optionally the file with
+    its API keys and its own config file (default: 'config_file').
+    '''
+    table = pd.read_csv(path, dtype=str).fillna('')
+    if 'name' not in table or 'allocation' not in table:
+        raise ValueError('{0} must have name and allocation columns'.format(path))
+    portfolios = []
+    for row in table.to_dict('records'):
+        name = row['name'].strip()
+        if not name or name in [portfolio.name for portfolio in portfolios]:
+            raise ValueError('Portfolio names in {0} must be present and unique'.format(path))
+        portfolios.append(Portfolio(name,
+                                    pd.read_csv(row['allocation']),
+                                    row.get('keyfile') or None,
+                                    row.get('config') or config_file))
+    return portfolios
+
+
+def shutdown(engines):
+    ''' Shut down every engine, and with the last one their market data hub '''
+    for engine in engines:
+        engine.shutdown()
+
+
+def run_headless(portfolios, args):
+    '''
+    Run a rebalancing engine for every portfolio without a GUI, sharing
+    one market data hub, and log one JSON object per event to stderr.
+    Returns the process exit code.
+    '''
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger('binance-balance')
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    def error(event, message, portfolio=None):
+        fields = {'message': message}
+        if portfolio is not None:
+            fields['portfolio'] = portfolio
+        logger.error(event, extra={'fields': fields})
+
+    credentials = []
+    for portfolio in portfolios:
+        if not np.sum(portfolio.coins['allocation']) == 100:
+            error('config_error', 'Your coin allocations to not sum to 100%', portfolio.name)
+            return 1
+        try:
+            credentials.append(read_credentials(portfolio.keyfile))
+        except (IOError, ValueError) as e:
+            error('credentials_error', str(e), portfolio.name)
+            return 1
+    scheduler = LoopScheduler()
+    engines = []
+    try:
+        hub = MarketHub(scheduler, args.config)
+        for portfolio in portfolios:
+            engines.append(RebalanceEngine(portfolio.coins, scheduler, portfolio.config, hub, portfolio.name))
+    except ConfigError as e:
+        error('config_error', str(e))
+        shutdown(engines)
+        return 1
+    for engine in engines:
+        LogView(engine, logger)
+    for engine, (api_key, api_secret) in zip(engines, credentials):
+        try:
+            engine.login(api_key, api_secret)
+            engine.populate_portfolio()
+        except (BinanceRequestException,
+                BinanceAPIException) as e:
+            error('api_error', e.message, engine.name)
+            shutdown(engines)
+            return 1
+        except ConfigError as e:
+            error('config_error', str(e), engine.name)
+            shutdown(engines)
+            return 1
+    for engine in engines:
+        engine.start_websockets()
+        if not args.monitor:
+            engine.set_automation(True)
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    #SIGUSR1 toggles the profiling timers, SIGUSR2 captures a profile. The
+    #handlers run on the scheduler thread, which may be holding the scheduler
+    #lock, so the work is handed over from another thread
+    def deferred(func):
+        return lambda signum, frame: threading.Thread(target=scheduler.after_idle, args=(func,)).start()
+    def toggle_profiling():
+        for engine in engines:
+            engine.toggle_profiling()
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, deferred(toggle_profiling))
+        #a capture covers the whole main thread, so the engines of every portfolio
+        signal.signal(signal.SIGUSR2, deferred(engines[0].capture_profile))
+    if args.profile:
+        for engine in engines:
+            engine.set_profiling(True)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown(engines)
+    return 0
+
+
+def run_ingest(args):
+    '''
+    Run the market streams of the parent's MarketHub in this process.
+    The hub writes one JSON table command per line to stdin, which is
+    closed when the hub closes or the parent dies, ending the process.
+    Returns the process exit code.
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN) #a Ctrl-C is for the parent to handle
+    scheduler = LoopScheduler()
+    worker = IngestWorker(scheduler, args.config)
+    def read_commands():
+        for line in iter(sys.stdin.readline, ''):
+            scheduler.after_idle(worker.add_table, json.loads(line))
+        scheduler.after_idle(scheduler.stop)
+    reader = threading.Thread(target=read_commands)
+    reader.daemon = True
+    reader.start()
+    try:
+        scheduler.run()
+    finally:
+        worker.close()
+    return 0
+
+
+def csv_chunks(path, chunksize=100000):
+    ''' The (time, mid_price) arrays of a <PAIR>.csv record, one chunk at a time '''
+    for chunk in pd.read_csv(path, header=None, names=['time', 'avg_price', 'mid_price'],
+                             chunksize=chunksize):
+        yield chunk['time'].values, chunk['mid_price'].values
+
+
+class TickFile(object):
+    '''
+    Streaming reader for the ticks of one pair, taken from 'chunks' of
+    (time, mid_price) arrays so that months of ticks never have to fit in
+    memory. Ticks are expected in time order, as they are recorded.
+    '''
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.time = np.empty(0)
+        self.mid = np.empty(0)
+        self.price = np.nan
+        self.next_chunk()
+
+    def next_chunk(self):
+        try:
+            self.time, self.mid = next(self.chunks)
+        except StopIteration:
+            return
+
+    def start(self):
+        ''' Time of the first unread tick '''
+        return self.time[0] if len(self.time) else np.inf
+
+    def exhausted(self):
+        return len(self.time) == 0
+
+    def advance(self, until):
+        ''' Consume every tick up to time 'until' and return the latest mid price '''
+        while len(self.time):
+            k = np.searchsorted(self.time, until, side='right')
+            if k > 0:
+                self.price = self.mid[k - 1]
+            self.time = self.time[k:]
+            self.mid = self.mid[k:]
+            if len(self.time):
+                break
+            self.next_chunk()
+        return self.price
+
+
+def replay_ticks(files, step):
+    '''
+    Merge the tick files into one time-ordered stream sampled every
+    'step' ms, yielding the time and the latest mid price of each file.
+    The stream starts once every pair has ticked and ends after the
+    last tick of the longest file.
+    '''
+    t = max(f.start() for f in files)
+    prices = np.empty(len(files))
+    while True:
+        for k, f in enumerate(files):
+            prices[k] = f.advance(t)
+        yield t, prices
+        if all(f.exhausted() for f in files):
+            return
+        t += step
+
+
+class BacktestRun(object):
+    '''
+    A simulated portfolio which is rebalanced every 'period' seconds,
+    skipping trades worth less than 'min_trade_value'. Valuation and
+    planning go through PortfolioState and plan_rebalance as they do live,
+    and every ready order fills at the planned price less 'fee'.
+    '''
+    def __init__(self, coins, allocation, trade_currency, rules, period, min_trade_value, fee):
+        self.state = PortfolioState(coins, np.zeros(len(coins)), allocation, trade_currency)
+        state = self.state
+        for i, symbol in enumerate(state.symbols):
+            if symbol in rules:
+                state.set_row(state.coins[i], **rules[symbol]._asdict())
+        if min_trade_value > 0:
+            state.minnotional[:] = min_trade_value
+        state.maxqty[state.maxqty == 0] = np.inf
+        self.period = period * 1000
+        self.min_trade_value = min_trade_value
+        self.fee = fee
+        self.next_rebalance = None
+        self.trades = 0
+        self.traded = 0.0
+        self.fees = 0.0
+        self.total = 0.0
+        self.deviation = 0.0
+        self.samples = 0
+
+    def fund(self, capital, prices):
+        ''' Hold 'capital' of the trade currency at the target allocation '''
+        state = self.state
+        state.price[:] = prices
+        state.exchange_balance[:] = capital * state.allocation / 100.0 / prices
+        state.initialize_values()
+
+    def mark(self, t, prices):
+        ''' Revalue the portfolio at 'prices', sample it and rebalance when due '''
+        state = self.state
+        state.bidprice[:] = prices
+        state.askprice[:] = prices
+        state.price[:] = prices
+        state.initialize_values()
+        if self.next_rebalance is None:
+            self.next_rebalance = t + self.period
+        elif t >= self.next_rebalance:
+            self.rebalance()
+            self.next_rebalance += self.period
+        self.total += state.total
+        self.deviation += np.sum((state.actual - state.allocation) ** 2)
+        self.samples += 1
+
+    def rebalance(self):
+        ''' Fill every ready sell, then every ready buy, like a live pass '''
+        state = self.state
+        for side in (SIDE_SELL, SIDE_BUY):
+            plan = plan_rebalance(state)
+            for i in plan.rows(side):
+                if plan.status[i] == RebalancePlan.TRADE_READY:
+                    self.fill(i, side, plan.qty[i], plan.price[i])
+            state.initialize_values()
+
+    def fill(self, i, side, qty, price):
+        state = self.state
+        qty = float(round_decimal(qty, state.stepsize[i]))
+        value = qty * price
+        fee = value * self.fee
+        t = state.trade_index
+        if side == SIDE_SELL:
+            state.exchange_balance[i] -= qty
+            state.exchange_balance[t] += value - fee
+        else:
+            state.exchange_balance[i] += qty
+            state.exchange_balance[t] -= value + fee
+        self.trades += 1
+        self.traded += value
+        self.fees += fee
+
+    def report(self):
+        mean_total = self.total / max(1, self.samples)
+        return {'period': self.period // 1000,
+                'min_trade_value': self.min_trade_value,
+                'trades': self.trades,
+                'turnover': self.traded / mean_total if mean_total else 0.0,
+                'fees': self.fees,
+                'tracking_error': np.sqrt(self.deviation / max(1, self.samples)),
+                'final_value': self.state.total}
+
+
+def parse_grid(values, cast):
+    return [cast(v) for v in values.split(',') if v.strip()]
+
+
+def run_replay(coins, args):
+    '''
+    Replay the ticks recorded in 'args.ticks', or in the configured
+    records directory, through one simulated portfolio per combination of
+    rebalance period and minimum trade value, and print the turnover, fees
+    and tracking error of each. All combinations share a single pass over
+    the ticks. Directories without day segments are read as <PAIR>.csv
+    files.
+    '''
+    config = ConfigParser.RawConfigParser(allow_no_value=False)
+    config.read(args.config)
+    trade_currency = config.get('trades', 'trade_currency')
+    periods = parse_grid(args.periods or config.get('trades', 'rebalance_period'), int)
+    min_values = parse_grid(args.min_values or config.get('trades', 'min_trade_value'), float)
+    if not periods or min(periods) <= 0:
+        print('Rebalance periods must be positive integers (seconds)')
+        return 1
+    rules = SymbolRulesCache(config.get('rest', 'rules_cache'), 0).rules
+    directory = args.ticks or config.get('records', 'directory')
+    archive = TickArchive(directory) if segment_paths(directory) else None
+
+    coin_list = list(coins['coin'])
+    allocation = np.asarray(coins['allocation'], dtype=float)
+    if trade_currency not in coin_list:
+        print('{0} must be listed in the allocation file'.format(trade_currency))
+        return 1
+    rows = [i for i, coin in enumerate(coin_list) if coin != trade_currency]
+    files = []
+    missing = []
+    for i in rows:
+        pair = coin_list[i] + trade_currency
+        try:
+            if archive is not None:
+                f = TickFile(archive.chunks(pair))
+            else:
+                f = TickFile(csv_chunks(os.path.join(directory, pair + '.csv')))
+        except (IOError, ValueError):
+            f = None
+        if f is None or f.exhausted():
+            missing.append(pair)
+        else:
+            files.append(f)
+    if missing:
+        print('No ticks recorded for {0}'.format(', '.join(missing)))
+        return 1
+
+    runs = [BacktestRun(coin_list, allocation, trade_currency, rules, period, min_value, args.fee)
+            for period, min_value in itertools.product(periods, min_values)]
+    step = min(args.replay_step, min(periods)) * 1000
+    prices = np.ones(len(coin_list))
+    start = None
+    for t, mids in replay_ticks(files, step):
+        prices[rows] = mids
+        if start is None:
+            start = t
+            for run in runs:
+                run.fund(args.capital, prices)
+        for run in runs:
+            run.mark(t, prices)
+
+    print('Replayed {0} to {1}'.format(datetime.utcfromtimestamp(start / 1000.0),
+                                       datetime.utcfromtimestamp(t / 1000.0)))
+    columns = ['period', 'min_trade_value', 'trades', 'turnover', 'fees', 'tracking_error', 'final_value']
+    results = pd.DataFrame([run.report() for run in runs], columns=columns)
+    print(results.to_string(index=False))
+    return 0
+
+
+def run_convert(coins, args):
+    ''' Convert the <PAIR>.csv records of the allocation to binary ticks '''
+    config = ConfigParser.RawConfigParser(allow_no_value=False)
+    config.read(args.config)
+    trade_currency = config.get('trades', 'trade_currency')
+    directory = config.get('records', 'directory')
+    pairs = [coin + trade_currency for coin in coins['coin'] if coin != trade_currency]
+    recorder = TickRecorder(directory)
+    try:
+        count = convert_csv_records(pairs, args.convert_csv, recorder)
+    finally:
+        recorder.close()
+    print('Converted {0} ticks into {1}'.format(count, directory))
+    return 0
+
+
+def synthetic_state(n, trade_currency='BTC', seed=0):
+    '''
+    Build a PortfolioState of 'n' coins with random balances, prices and
+    symbol rules for benchmarking without an exchange connection.
+    '''
+    rng = np.random.RandomState(seed)
+    coins = [trade_currency] + ['C{0:04d}'.format(k) for k in range(n - 1)]
+    allocation = rng.uniform(1, 10, n)
+    allocation *= 100.0 / np.sum(allocation)
+    state = PortfolioState(coins, rng.uniform(0, 10, n), allocation, trade_currency)
+    price = 10 ** rng.uniform(-7, -1, n)
+    price[state.trade_index] = 1.0
+    state.exchange_balance[:] = rng.uniform(0, 100, n) / price * 1e-3
+    state.locked_balance[:] = 0.0
+    state.askprice[:] = price
+    state.bidprice[:] = price * 0.999
+    state.price[:] = price
+    state.ticksize[:] = price * 1e-3
+    state.stepsize[:] = 1e-3
+    state.minqty[:] = 1e-3
+    state.maxqty[:] = 1e9
+    state.minnotional[:] = 1e-3
+    state.initialize_values()
+    return state
+
+
+def benchmark_planner(args):
+    ''' Time plan_rebalance for portfolios of 10 to 1000 coins '''
+    print('{0:>8} {1:>14}'.format('coins', 'us per plan'))
+    for n in (10, 30, 100, 300, 1000):
+        state = synthetic_state(n)
+        repeats = max(10, 20000 // n)
+        best = min(timeit.repeat(lambda: plan_rebalance(state), number=repeats, repeat=5))
+        print('{0:>8} {1:>14.1f}'.format(n, 1e6 * best / repeats))
+    return 0
+
+
+class SyntheticExchange(object):
+    '''
+    Stand-in for the Binance client which lists 'n' coins quoted in
+    'trade_currency' and generates websocket payloads shaped like the real
+    ones, so the engine can be driven without an exchange connection.
+    '''
+    def __init__(self, n, trade_currency='BTC', seed=0):
+        self.rng = np.random.RandomState(seed)
+        self.trade_currency = trade_currency
+        self.coins = [trade_currency] + ['C{0:04d}'.format(k) for k in range(n - 1)]
+        self.symbols = [coin + trade_currency for coin in self.coins[1:]]
+        self.prices = dict(zip(self.symbols, 10 ** self.rng.uniform(-7, -1, n - 1)))
+        self.event_time = 1525000000000
+        self.order_id = 0
+
+    def allocation(self):
+        ''' An allocation file spreading the portfolio evenly over every coin '''
+        n = len(self.coins)
+        allocation = np.full(n, 100.0 / n)
+        return pd.DataFrame({'coin': self.coins, 'allocation': allocation, 'fixed_balance': np.zeros(n)})
+
+    def get_system_status(self):
+        return {'status': 0, 'msg': 'normal'}
+
+    def get_account(self):
+        return {'balances': [{'asset': coin, 'free': '{0:.8f}'.format(self.rng.uniform(1, 100)),
+                              'locked': '0.00000000'} for coin in self.coins]}
+
+    def get_orderbook_tickers(self):
+        return [{'symbol': symbol,
+                 'bidPrice': '{0:.8f}'.format(price * 0.999),
+                 'askPrice': '{0:.8f}'.format(price)} for symbol, price in self.prices.items()]
+
+    def get_exchange_info(self):
+        return {'symbols': [{'symbol': symbol,
+                             'filters': [{'filterType': 'PRICE_FILTER', 'minPrice': '0.00000001',
+                                          'maxPrice': '100000.0', 'tickSize': '0.00000001'},
+                                         {'filterType': 'LOT_SIZE', 'minQty': '0.001',
+                                          'maxQty': '10000000.0', 'stepSize': '0.001'},
+                                         {'filterType': 'MIN_NOTIONAL', 'minNotional': '0.001'}]}
+                            for symbol in self.symbols]}
+
+    def get_open_orders(self):
+        return []
+
+    def create_test_order(self, **params):
+        return {}
+
+    def create_order(self, **params):
+        self.order_id += 1
+        return {'symbol': params['symbol'], 'orderId': self.order_id}
+
+    def tick(self):
+        ''' Advance the event clock and pick a random symbol whose price moves '''
+        self.event_time += int(self.rng.randint(1, 50))
+        symbol = self.symbols[self.rng.randint(len(self.symbols))]
+        self.prices[symbol] *= np.exp(self.rng.normal(0, 1e-3))
+        return symbol, self.prices[symbol]
+
+    def ticker(self):
+        symbol, price = self.tick()
+        return {'e': '24hrTicker', 'E': self.event_time, 's': symbol,
+                'w': '{0:.8f}'.format(price), 'c': '{0:.8f}'.format(price),
+                'b': '{0:.8f}'.format(price * 0.999), 'B': '12.00000000',
+                'a': '{0:.8f}'.format(price), 'A': '9.00000000',
+                'o': '{0:.8f}'.format(price), 'h': '{0:.8f}'.format(price * 1.01),
+                'l': '{0:.8f}'.format(price * 0.99), 'v': '10000.00000000',
+                'q': '18.00000000', 'n': 18151}
+
+    def kline(self):
+        symbol, price = self.tick()
+        return {'e': 'kline', 'E': self.event_time, 's': symbol,
+                'k': {'t': self.event_time - 60000, 'T': self.event_time, 's': symbol, 'i': '1m',
+                      'o': '{0:.8f}'.format(price), 'c': '{0:.8f}'.format(price),
+                      'h': '{0:.8f}'.format(price), 'l': '{0:.8f}'.format(price),
+                      'v': '1000.00000000', 'n': 100, 'x': bool(self.rng.randint(2))}}
+
+    def account(self):
+        self.event_time += 1
+        return {'e': 'outboundAccountInfo', 'E': self.event_time,
+                'B': [{'a': coin, 'f': '{0:.8f}'.format(self.rng.uniform(1, 100)), 'l': '0.00000000'}
+                      for coin in self.coins]}
+
+    def execution(self):
+        symbol, price = self.tick()
+        self.order_id += 1
+        qty = '{0:.3f}'.format(self.rng.uniform(1, 100))
+        filled = self.rng.randint(2)
+        return {'e': 'executionReport', 'E': self.event_time, 's': symbol, 'c': 'bench',
+                'S': SIDE_BUY if self.rng.randint(2) else SIDE_SELL, 'o': 'MARKET', 'O': self.event_time,
+                'f': 'GTC', 'q': qty, 'p': '0.00000000', 'P': '0.00000000', 'F': '0.00000000',
+                'g': -1, 'C': 'null', 'x': 'TRADE', 'X': 'FILLED' if filled else 'PARTIALLY_FILLED',
+                'r': 'NONE', 'i': self.order_id, 'l': qty, 'z': qty if filled else '0.000',
+                'Z': '0.00000000', 'L': '{0:.8f}'.format(price), 'n': '0.00000000', 'N': 'BNB',
+                'T': self.event_time, 't': self.order_id, 'I': 0, 'w': False, 'm': False, 'M': True,
+                'Y': '0.00000000'}
+
+    def messages(self, count, mix=(('ticker', 0.6), ('kline', 0.38), ('account', 0.01), ('execution', 0.01))):
+        ''' A list of 'count' random payloads drawn from the event 'mix' '''
+        kinds, weights = zip(*mix)
+        picks = self.rng.choice(len(kinds), size=count, p=weights)
+        return [getattr(self, kinds[k])() for k in picks]
+
+
+def peak_memory():
+    ''' Peak resident set size of this process in kB, or None if unknown '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_isolated(conn, func, args):
+    try:
+        conn.send((func(*args), None))
+    except Exception as e:
+        conn.send((None, '{0}: {1}'.format(type(e).__name__, e)))
+    finally:
+        conn.close()
+
+
+def isolated(func, *args):
+    '''
+    Call 'func' with 'args' in a child process and return its result, so
+    that the peak memory of a run is not that of an earlier, larger one.
+    '''
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=run_isolated, args=(sender, func, args))
+    process.start()
+    sender.close()
+    try:
+        result, error = receiver.recv()
+    except EOFError:
+        result, error = None, 'exited with code {0}'.format(process.exitcode)
+    process.join()
+    if error is not None:
+        raise RuntimeError('Benchmark run failed: {0}'.format(error))
+    return result
+
+
+def message_load(n, count, config_file, gui):
+    '''
+    Feed 'count' synthetic websocket messages for a portfolio of 'n' coins
+    through queue_msg and get_msg one at a time, timing each one. With
+    'gui' the Tk view is attached and redrawn at the configured frame rate.
+    The memory use reported is how far the run raised the peak resident
+    set size, which only stands for the run itself in a fresh process.
+    '''
+    baseline = peak_memory()
+    exchange = SyntheticExchange(n)
+    coins = exchange.allocation()
+    msgs = exchange.messages(count)
+    root = None
+    if gui:
+        root = tk.Tk()
+        root.withdraw()
+        scheduler = root
+    else:
+        scheduler = LoopScheduler()
+    engine = RebalanceEngine(coins, scheduler, config_file)
+    engine.client = exchange
+    try:
+        if gui:
+            view = BalanceGUI(root, engine)
+            view.populate_portfolio()
+            root.update()
+        else:
+            engine.populate_portfolio()
+        latency = np.empty(count)
+        clock = timeit.default_timer
+        next_frame = 0.0
+        frame = engine.frame_interval / 1000.0
+        start = clock()
+        for k, msg in enumerate(msgs):
+            t = clock()
+            engine.queue_msg(msg)
+            engine.get_msg()
+            done = clock()
+            latency[k] = done - t
+            if gui and done >= next_frame:
+                root.update()
+                next_frame = done + frame
+        elapsed = clock() - start
+    finally:
+        engine.shutdown()
+        if root is not None:
+            root.destroy()
+    return {'coins': n,
+            'gui': gui,
+            'messages': count,
+            'messages_per_second': count / elapsed,
+            'p50_us': 1e6 * np.percentile(latency, 50),
+            'p99_us': 1e6 * np.percentile(latency, 99),
+            'peak_memory_delta_kb': None if baseline is None else peak_memory() - baseline}
+
+
+def benchmark_messages(args):
+    '''
+    Measure the websocket message handlers for portfolios of 10, 100 and
+    500 coins with and without the GUI, each in a process of its own.
+    Runs in a scratch directory so that no price records or caches are
+    left behind.
+    '''
+    config_file = os.path.abspath(args.config)
+    gui = tk is not None
+    if gui:
+        try:
+            tk.Tk().destroy()
+        except tk.TclError:
+            gui = False
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp()
+    os.chdir(scratch)
+    results = []
+    try:
+        print('{0:>6} {1:>5} {2:>12} {3:>10} {4:>10} {5:>12}'.format('coins', 'gui', 'msgs/sec',
+                                                                   'p50 us', 'p99 us', 'peak +kB'))
+        for n in (10, 100, 500):
+            for with_gui in ((False, True) if gui else (False,)):
+                result = isolated(message_load, n, args.messages, config_file, with_gui)
+                results.append(result)
+                print('{coins:>6} {gui!s:>5} {messages_per_second:>12.0f} {p50_us:>10.1f} '
+                      '{p99_us:>10.1f} {peak_memory_delta_kb!s:>12}'.format(**result))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    if not gui:
+        print('Tk display not available, GUI runs skipped')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'messages',
+                       'time': datetime.utcnow().isoformat(),
+                       'python': sys.version.split()[0],
+                       'numpy': np.__version__,
+                       'pandas': pd.__version__,
+                       'results': results}, f, indent=2, sort_keys=True)
+    return 0
+
+
+def benchmark_trendline(args):
+    '''
+    Time TrendLine updates for windows of 1000 to 20000 points on a random
+    walk and check the predicted change and local deviation against
+    np.polyfit and np.std over the same points. Errors are reported in
+    units of the local deviation, the threshold the trend is judged by.
+    '''
+    print('{0:>8} {1:>12} {2:>14} {3:>14} {4:>12}'.format('points', 'us/update', 'us/polyfit',
+                                                          'change error', 'std error'))
+    rng = np.random.RandomState(0)
+    for n in (1000, 5000, 20000):
+        t = 1525000000.0 + np.arange(4 * n)
+        y = 0.07 * np.exp(np.cumsum(rng.normal(0, 1e-3, len(t))))
+        trendline = TrendLine(n - 0.5, n // 10)
+        change_error = std_error = 0.0
+        for k in range(len(t)):
+            trendline.append(t[k], y[k])
+            if k >= n and k % (n // 4) == 0:
+                window = slice(k - n + 1, k + 1)
+                local = slice(k - n // 10, k + 1)
+                p = np.polyfit(t[window] - t[k], y[window], 2)
+                dt = trendline.dt
+                stdev = np.std(y[local])
+                change_error = max(change_error, abs(trendline.change() - (p[0] * dt * dt + p[1] * dt)) / stdev)
+                std_error = max(std_error, abs(trendline.local_stdev() - stdev) / stdev)
+        points = list(zip((t + 4 * n).tolist(), y.tolist()))
+        clock = timeit.default_timer
+        start = clock()
+        for t_k, y_k in points:
+            trendline.append(t_k, y_k)
+            trendline.trend()
+        update = (clock() - start) / len(points)
+        repeats = max(3, 20000 // n)
+        x = t[:n] - t[0]
+        polyfit = min(timeit.repeat(lambda: np.polyfit(x, y[:n], 2), number=repeats, repeat=3)) / repeats
+        print('{0:>8} {1:>12.2f} {2:>14.1f} {3:>14.2e} {4:>12.2e}'.format(n, 1e6 * update, 1e6 * polyfit,
+                                                                       change_error, std_error))
+    return 0
+
+
+def decoding_load(engine, exchange, count):
+    ''' Time the previous and the current handling of 'count' payloads of each event type on 'engine' '''
+    headers = RebalanceEngine.column_headers()
+    #the handlers before the journal renamed the report keys, word for word but for the headers
+    #and OrderIndex.update
+    def before_price(self, msg):
+        state = self.state
+        i = state.symbol_index[msg['s']]
+        state.set_price(i, float(msg['b']), float(msg['a']))
+        self.price_time[i] = msg['E'] / 1000.0
+        self.notify('price', i)
+    def before_trends(self, msg):
+        if msg['k']['x']:
+            i = self.state.symbol_index[msg['s']]
+            trendline = self.trendlines[self.state.coins[i]]
+            trendline.append(float(msg['k']['T'])/1000., float(msg['k']['c']))
+            self.notify('trend', i, trendline.trend())
+    def before_balance(self, msg):
+        balances = msg['B']
+        state = self.state
+        for balance in balances:
+            i = state.index.get(balance['a'])
+            if i is not None:
+                exchange_balance = float(balance['f']) + float(balance['l'])
+                locked_balance = float(balance['l'])
+                state.set_balance(i, exchange_balance, locked_balance)
+                self.notify('balance', i)
+    def before_trades(self, msg):
+        i = self.state.symbol_index[msg['s']]
+        savemsg = {headers[key] : value for key, value in msg.items()}
+        filled = float(savemsg['cumulative_filled_quantity'])
+        orderqty = float(savemsg['order_quantity'])
+        side = savemsg['side']
+        if filled >= orderqty:
+            self.state.last_execution[i] = time.mktime(datetime.now().timetuple())
+            self.trades_completed += 1
+        self.notify('execution', i, side, filled, orderqty)
+        self.journal.append(savemsg)
+        orders = self.orders
+        if msg['X'] in LIVE_ORDER_STATUSES:
+            orders.add(OpenOrder(msg['i'], msg['c'], msg['s'], msg['S'], msg['o'], float(msg['p']),
+                                 float(msg['q']), float(msg['z']), msg['O'] / 1000.0))
+            ended = None
+        else:
+            ended = orders.remove(msg['i'])
+        state = self.state
+        state.open_orders[i] = self.orders.count(msg['s'])
+        if ended is not None and state.open_orders[i] == 0:
+            #nothing left on the book, the coin may be traded again
+            state.last_placement[i] = np.nan
+            if i in self.repricing:
+                self.scheduler.after_idle(self.reprice)
+    #both called through a lambda so that neither saves the call
+    kinds = (('ticker', lambda msg: before_price(engine, msg), lambda msg: engine.update_price(msg)),
+             ('kline', lambda msg: before_trends(engine, msg), lambda msg: engine.update_trends(msg)),
+             ('account', lambda msg: before_balance(engine, msg), lambda msg: engine.update_balance(msg)),
+             ('execution', lambda msg: before_trades(engine, msg), lambda msg: engine.update_trades(msg)))
+    results = []
+    print('{0:>10} {1:>12} {2:>12}'.format('event', 'before us', 'current us'))
+    for kind, handle_before, handle_current in kinds:
+        msgs = [getattr(exchange, kind)() for _ in range(count)]
+        #alternate the two so that neither gets the warmer state, keep the best of each
+        best = [float('inf')] * 2
+        for _ in range(7):
+            for k, handle in enumerate((handle_before, handle_current)):
+                best[k] = min(best[k], timeit.timeit(lambda: [handle(msg) for msg in msgs], number=5))
+        result = {'event': kind, 'before_us': 1e6 * best[0] / (5 * count), 'current_us': 1e6 * best[1] / (5 * count)}
+        results.append(result)
+        print('{event:>10} {before_us:>12.2f} {current_us:>12.2f}'.format(**result))
+    return results
+
+
+def benchmark_decoding(args):
+    '''
+    Time the handling of every websocket event type for a portfolio of
+    100 coins: the handlers as they were before execution reports were
+    renamed for the journal on its writer thread and payloads of symbols
+    outside the portfolio were skipped, against the current handlers.
+    Both update the state of the same
+    engine, which has no views attached. Runs in a scratch directory so
+    that no price records or journals are left behind.
+    '''
+    config_file = os.path.abspath(args.config)
+    exchange = SyntheticExchange(100)
+    coins = exchange.allocation()
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp()
+    os.chdir(scratch)
+    results = []
+    try:
+        engine = RebalanceEngine(coins, LoopScheduler(), config_file)
+        engine.client = exchange
+        try:
+            engine.populate_portfolio()
+            results = decoding_load(engine, exchange, 2000)
+        finally:
+            engine.shutdown()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'decoding',
+                       'time': datetime.utcnow().isoformat(),
+                       'python': sys.version.split()[0],
+                       'results': results}, f, indent=2, sort_keys=True)
+    return 0
+
+
+BENCHMARKS = {'planner': benchmark_planner,
+              'trendline': benchmark_trendline,
+              'messages': benchmark_messages,
+              'decoding': benchmark_decoding}
+
+
+class SimulatorError(Exception):
+    ''' A request the simulated exchange turns down, answered with 'status' and Binance error 'code' '''
+    def __init__(self, status, code, message, retry_after=None):
+        Exception.__init__(self, message)
+        self.status = status
+        self.code = code
+        self.retry_after = retry_after
+
+
+class SimulatedExchange(object):
+    '''
+    Price process and matching engine of the local simulated exchange.
+    Lists 'coins' against 'trade_currency' at prices which follow a
+    geometric Brownian motion of 'volatility', the standard deviation of
+    the log return per minute, around a fixed relative 'spread'. A single
+    account starts with 'balance' of the trade currency. MARKET orders
+    and LIMIT orders which cross the spread fill at once at the bid or
+    ask, other LIMIT orders rest with their funds locked until a price
+    move reaches them. There are no fees and no partial fills.
+    'publish' is called with every user data event.
+    '''
+    min_notional = 0.001
+
+    def __init__(self, coins, trade_currency='BTC', balance=1.0, volatility=0.002, spread=0.001, seed=0):
+        self.rng = np.random.RandomState(seed)
+        self.trade_currency = trade_currency
+        self.coins = [coin for coin in coins if coin != trade_currency]
+        self.symbols = [coin + trade_currency for coin in self.coins]
+        self.symbol_index = {symbol: k for k, symbol in enumerate(self.symbols)}
+        n = len(self.symbols)
+        self.price = 10 ** self.rng.uniform(-6, -1, n)
+        #about four significant digits, and whole coins for the cheapest
+        self.ticksize = 10 ** np.floor(np.log10(self.price) - 3)
+        self.stepsize = np.where(self.price < 1e-4, 1.0, 0.001)
+        self.volatility = volatility
+        self.spread = spread
+        self.kline_start = int(time.time() * 1000)
+        self.open = self.price.copy()
+        self.high = self.price.copy()
+        self.low = self.price.copy()
+        self.balances = {coin: [0.0, 0.0] for coin in self.coins}
+        self.balances[trade_currency] = [float(balance), 0.0]
+        self.orders = {}
+        self.order_ids = itertools.count(1)
+        self.trade_ids = itertools.count(1)
+        self.publish = lambda event: None
+
+    def quotes(self):
+        ''' Bid and ask prices of every symbol, on their tick sizes '''
+        bid = np.floor(self.price * (1 - self.spread / 2) / self.ticksize) * self.ticksize
+        ask = np.ceil(self.price * (1 + self.spread / 2) / self.ticksize) * self.ticksize
+        return bid, ask
+
+    def step(self, minutes):
+        ''' Move every price on by 'minutes' and fill the resting orders the prices have reached '''
+        shocks = self.rng.normal(0, self.volatility * math.sqrt(minutes), len(self.price))
+        self.price *= np.exp(shocks - 0.5 * self.volatility ** 2 * minutes)
+        self.high = np.maximum(self.high, self.price)
+        self.low = np.minimum(self.low, self.price)
+        bid, ask = self.quotes()
+        for order in list(self.orders.values()):
+            k = self.symbol_index[order['symbol']]
+            if (order['side'] == SIDE_BUY and ask[k] <= order['price']
+                    or order['side'] == SIDE_SELL and bid[k] >= order['price']):
+                self.fill(order, order['price'])
+
+    def close_klines(self, now):
+        ''' Start new klines at 'now' (ms), returning the start time of the closed ones '''
+        start = self.kline_start
+        self.kline_start = now
+        self.open = self.price.copy()
+        self.high = self.price.copy()
+        self.low = self.price.copy()
+        return start
+
+    def place(self, params, test=False):
+        ''' Check an order request like the exchange would and execute it unless 'test' '''
+        k = self.symbol_index.get(params.get('symbol'))
+        if k is None:
+            raise SimulatorError(400, -1121, 'Invalid symbol.')
+        side = params.get('side')
+        order_type = params.get('type')
+        if side not in (SIDE_BUY, SIDE_SELL):
+            raise SimulatorError(400, -1117, 'Invalid side.')
+        if order_type not in (ORDER_TYPE_MARKET, ORDER_TYPE_LIMIT):
+            raise SimulatorError(400, -1116, 'Invalid orderType.')
+        try:
+            quantity = float(params['quantity'])
+            price = float(params['price']) if order_type == ORDER_TYPE_LIMIT else 0.0
+        except (KeyError, ValueError):
+            raise SimulatorError(400, -1102, 'Mandatory parameter was not sent, was empty/null, or malformed.')
+        steps = quantity / self.stepsize[k]
+        if steps < 1 or abs(steps - round(steps)) > 1e-6:
+            raise SimulatorError(400, FILTER_FAILURE, 'Filter failure: LOT_SIZE')
+        ticks = price / self.ticksize[k]
+        if abs(ticks - round(ticks)) > 1e-6:
+            raise SimulatorError(400, FILTER_FAILURE, 'Filter failure: PRICE_FILTER')
+        bid, ask = self.quotes()
+        market = ask[k] if side == SIDE_BUY else bid[k]
+        crosses = order_type == ORDER_TYPE_MARKET or (price >= market if side == SIDE_BUY else price <= market)
+        limit = price if order_type == ORDER_TYPE_LIMIT else market
+        if quantity * limit < self.min_notional:
+            raise SimulatorError(400, FILTER_FAILURE, 'Filter failure: MIN_NOTIONAL')
+        asset, amount = (self.trade_currency, quantity * limit) if side == SIDE_BUY else (self.coins[k], quantity)
+        if self.balances[asset][0] < amount:
+            raise SimulatorError(400, -2010, 'Account has insufficient balance for requested action.')
+        if test:
+            return {}
+        now = int(time.time() * 1000)
+        order = {'symbol': self.symbols[k],
+                 'orderId': next(self.order_ids),
+                 'clientOrderId': params.get('newClientOrderId') or 'sim{0}'.format(now),
+                 'side': side,
+                 'type': order_type,
+                 'price': price,
+                 'origQty': quantity,
+                 'executedQty': 0.0,
+                 'time': now,
+                 'reserved': (asset, amount)}
+        self.balances[asset][0] -= amount
+        self.balances[asset][1] += amount
+        self.report(order, 'NEW', 'NEW')
+        if crosses:
+            self.fill(order, market)
+        else:
+            self.orders[order['orderId']] = order
+            self.account_update()
+        return {'symbol': order['symbol'],
+                'orderId': order['orderId'],
+                'clientOrderId': order['clientOrderId'],
+                'transactTime': now,
+                'status': 'FILLED' if crosses else 'NEW'}
+
+    def fill(self, order, price):
+        ''' Execute all of 'order' at 'price' '''
+        self.orders.pop(order['orderId'], None)
+        asset, amount = order['reserved']
+        self.balances[asset][1] -= amount
+        quantity = order['origQty']
+        coin = order['symbol'][:-len(self.trade_currency)]
+        if order['side'] == SIDE_BUY:
+            #any price improvement goes back to the free balance
+            self.balances[self.trade_currency][0] += amount - quantity * price
+            self.balances[coin][0] += quantity
+        else:
+            self.balances[self.trade_currency][0] += quantity * price
+        order['executedQty'] = quantity
+        self.report(order, 'TRADE', 'FILLED', quantity, price)
+        self.account_update()
+
+    def cancel(self, params):
+        ''' Cancel a resting order given by orderId or origClientOrderId '''
+        order = None
+        for candidate in self.orders.values():
+            if (str(candidate['orderId']) == params.get('orderId')
+                    or candidate['clientOrderId'] == params.get('origClientOrderId')):
+                order = candidate
+        if order is None or order['symbol'] != params.get('symbol'):
+            raise SimulatorError(400, -2011, 'Unknown order sent.')
+        del self.orders[order['orderId']]
+        asset, amount = order['reserved']
+        self.balances[asset][0] += amount
+        self.balances[asset][1] -= amount
+        self.report(order, 'CANCELED', 'CANCELED')
+        self.account_update()
+        return {'symbol': order['symbol'],
+                'orderId': order['orderId'],
+                'origClientOrderId': order['clientOrderId'],
+                'status': 'CANCELED'}
+
+    def report(self, order, execution_type, status, last_quantity=0.0, last_price=0.0):
+        now = int(time.time() * 1000)
+        self.publish({'e': 'executionReport', 'E': now, 's': order['symbol'], 'c': order['clientOrderId'],
+                      'S': order['side'], 'o': order['type'], 'f': 'GTC',
+                      'q': '{0:.8f}'.format(order['origQty']), 'p': '{0:.8f}'.format(order['price']),
+                      'P': '0.00000000', 'F': '0.00000000', 'g': -1, 'C': 'null',
+                      'x': execution_type, 'X': status, 'r': 'NONE', 'i': order['orderId'],
+                      'l': '{0:.8f}'.format(last_quantity), 'z': '{0:.8f}'.format(order['executedQty']),
+                      'L': '{0:.8f}'.format(last_price), 'n': '0.00000000', 'N': None, 'T': now,
+                      't': next(self.trade_ids) if execution_type == 'TRADE' else -1, 'I': 0,
+                      'w': status == 'NEW', 'm': False, 'M': False, 'O': order['time'],
+                      'Z': '{0:.8f}'.format(order['executedQty'] * last_price), 'Y': '0.00000000'})
+
+    def account_update(self):
+        now = int(time.time() * 1000)
+        self.publish({'e': 'outboundAccountInfo', 'E': now, 'u': now,
+                      'B': [{'a': asset, 'f': '{0:.8f}'.format(free), 'l': '{0:.8f}'.format(locked)}
+                            for asset, (free, locked) in sorted(self.balances.items())]})
+
+    def account(self):
+        return {'makerCommission': 0, 'takerCommission': 0, 'canTrade': True,
+                'updateTime': int(time.time() * 1000),
+                'balances': [{'asset': asset, 'free': '{0:.8f}'.format(free), 'locked': '{0:.8f}'.format(locked)}
+                             for asset, (free, locked) in sorted(self.balances.items())]}
+
+    def open_orders(self, symbol=None):
+        return [{'symbol': order['symbol'], 'orderId': order['orderId'],
+                 'clientOrderId': order['clientOrderId'], 'price': '{0:.8f}'.format(order['price']),
+                 'origQty': '{0:.8f}'.format(order['origQty']), 'executedQty': '0.00000000',
+                 'status': 'NEW', 'timeInForce': 'GTC', 'type': order['type'], 'side': order['side'],
+                 'time': order['time'], 'isWorking': True}
+                for order in self.orders.values() if symbol is None or order['symbol'] == symbol]
+
+    def book_tickers(self, symbol=None):
+        ''' Quotes of every pair, or like the exchange only the one of 'symbol' if given '''
+        bid, ask = self.quotes()
+        def ticker(k):
+            return {'symbol': self.symbols[k], 'bidPrice': '{0:.8f}'.format(bid[k]), 'bidQty': '100.00000000',
+                    'askPrice': '{0:.8f}'.format(ask[k]), 'askQty': '100.00000000'}
+        if symbol is None:
+            return [ticker(k) for k in range(len(self.symbols))]
+        k = self.symbol_index.get(symbol)
+        if k is None:
+            raise SimulatorError(400, -1121, 'Invalid symbol.')
+        return ticker(k)
+
+    def exchange_info(self):
+        return {'timezone': 'UTC', 'serverTime': int(time.time() * 1000),
+                'symbols': [{'symbol': symbol, 'status': 'TRADING', 'baseAsset': self.coins[k],
+                             'quoteAsset': self.trade_currency,
+                             'filters': [{'filterType': 'PRICE_FILTER', 'minPrice': '{0:.8f}'.format(self.ticksize[k]),
+                                          'maxPrice': '100000.00000000', 'tickSize': '{0:.8f}'.format(self.ticksize[k])},
+                                         {'filterType': 'LOT_SIZE', 'minQty': '{0:.8f}'.format(self.stepsize[k]),
+                                          'maxQty': '90000000.00000000', 'stepSize': '{0:.8f}'.format(self.stepsize[k])},
+                                         {'filterType': 'MIN_NOTIONAL',
+                                          'minNotional': '{0:.8f}'.format(self.min_notional)}]}
+                            for k, symbol in enumerate(self.symbols)]}
+
+    def tickers(self, now):
+        ''' 24hrTicker payloads of every symbol by symbol, at time 'now' (ms) '''
+        bid, ask = self.quotes()
+        return {symbol: {'e': '24hrTicker', 'E': now, 's': symbol,
+                         'w': '{0:.8f}'.format(self.price[k]), 'c': '{0:.8f}'.format(self.price[k]),
+                         'b': '{0:.8f}'.format(bid[k]), 'B': '100.00000000',
+                         'a': '{0:.8f}'.format(ask[k]), 'A': '100.00000000',
+                         'o': '{0:.8f}'.format(self.open[k]), 'h': '{0:.8f}'.format(self.high[k]),
+                         'l': '{0:.8f}'.format(self.low[k]), 'v': '10000.00000000',
+                         'q': '1.00000000', 'n': 1000}
+                for k, symbol in enumerate(self.symbols)}
+
+    def klines(self, now, start, end, closed):
+        ''' kline payloads of every symbol by symbol for the kline from 'start' to 'end' (ms) '''
+        return {symbol: {'e': 'kline', 'E': now, 's': symbol,
+                         'k': {'t': start, 'T': end, 's': symbol, 'i': '1m',
+                               'o': '{0:.8f}'.format(self.open[k]), 'c': '{0:.8f}'.format(self.price[k]),
+                               'h': '{0:.8f}'.format(self.high[k]), 'l': '{0:.8f}'.format(self.low[k]),
+                               'v': '1000.00000000', 'n': 100, 'x': closed}}
+                for k, symbol in enumerate(self.symbols)}
+
+
+class SimulatorResource(Resource):
+    ''' Every REST request of the simulator, answered by its SimulatorServer after the injected latency '''
+    isLeaf = True
+
+    def __init__(self, simulator):
+        Resource.__init__(self)
+        self.simulator = simulator
+
+    def render(self, request):
+        finished = request.notifyFinish()
+        finished.addErrback(lambda failure: None) #the client went away, nothing to answer
+        reactor.callLater(self.simulator.delay(), self.simulator.respond, request, finished)
+        return NOT_DONE_YET
+
+
+class SimulatorStreamProtocol(WebSocketServerProtocol):
+    def onConnect(self, request):
+        self.factory.simulator.stream_opened(self, request.path, request.params)
+
+    def onClose(self, wasClean, code, reason):
+        self.factory.simulator.stream_closed(self)
+
+
+class SimulatorServer(object):
+    '''
+    Serves a SimulatedExchange the way Binance does on the reactor: the
+    REST endpoints the app uses on 'rest_port', and the combined market
+    streams and the user data stream on 'stream_port'. Prices move every
+    'tick_interval' seconds, which is when every market stream gets a
+    ticker and kline event, and klines close every 'kline_interval'
+    seconds. Every response and event is held back by 'latency' ms give
+    or take 'jitter', keeping the events of a stream in order. Requests
+    over the weight or order rate limits are answered with 429 and a
+    Retry-After header. There is one account, whatever the API key.
+    '''
+    def __init__(self, exchange, tick_interval=1.0, kline_interval=60.0, latency=0.0, jitter=0.0,
+                 weight_per_minute=1200, orders_per_second=10):
+        self.exchange = exchange
+        self.tick_interval = tick_interval
+        self.kline_interval = kline_interval
+        self.latency = latency
+        self.jitter = jitter
+        self.weight = TokenBucket(weight_per_minute / 60.0, weight_per_minute)
+        self.orders = TokenBucket(orders_per_second, orders_per_second)
+        self.market = {}
+        self.users = set()
+        self.pending = {}
+        self.loop = None
+        exchange.publish = self.publish
+        self.routes = {('GET', 'ping'): (1, False, lambda args: {}),
+                       ('GET', 'time'): (1, False, lambda args: {'serverTime': int(time.time() * 1000)}),
+                       ('GET', 'systemStatus.html'): (1, False, lambda args: {'status': 0, 'msg': 'normal'}),
+                       ('GET', 'exchangeInfo'): (1, False, lambda args: exchange.exchange_info()),
+                       ('GET', 'ticker/bookTicker'): (2, False,
+                                                      lambda args: exchange.book_tickers(args.get('symbol'))),
+                       ('GET', 'ticker/allBookTickers'): (2, False, lambda args: exchange.book_tickers()),
+                       ('GET', 'account'): (5, False, lambda args: exchange.account()),
+                       ('GET', 'openOrders'): (40, False, lambda args: exchange.open_orders(args.get('symbol'))),
+                       ('POST', 'order'): (1, True, exchange.place),
+                       ('POST', 'order/test'): (1, False, lambda args: exchange.place(args, test=True)),
+                       ('DELETE', 'order'): (1, False, exchange.cancel),
+                       ('POST', 'userDataStream'): (1, False, lambda args: {'listenKey': 'sim{0:x}'.format(
+                           self.exchange.rng.randint(1 << 30))}),
+                       ('PUT', 'userDataStream'): (1, False, lambda args: {}),
+                       ('DELETE', 'userDataStream'): (1, False, lambda args: {})}
+
+    def listen(self, rest_port, stream_port, interface='127.0.0.1'):
+        ''' Start serving and moving prices '''
+        reactor.listenTCP(rest_port, Site(SimulatorResource(self)), interface=interface)
+        factory = WebSocketServerFactory()
+        factory.protocol = SimulatorStreamProtocol
+        factory.simulator = self
+        reactor.listenTCP(stream_port, factory, interface=interface)
+        self.loop = task.LoopingCall(self.tick)
+        self.loop.start(self.tick_interval, now=False)
+
+    def delay(self):
+        ''' Seconds to hold back a response or event '''
+        if self.jitter:
+            return max(0.0, self.exchange.rng.normal(self.latency, self.jitter)) / 1000.0
+        return self.latency / 1000.0
+
+    def respond(self, request, finished):
+        if finished.called:
+            return
+        args = {key: values[-1] for key, values in request.args.items()}
+        #python-binance sends the parameters of PUT and DELETE requests in the body too
+        request.content.seek(0)
+        for key, value in parse_qsl(request.content.read()):
+            args.setdefault(key, value)
+        #/api/v3/order -> order, /wapi/v3/systemStatus.html -> systemStatus.html
+        endpoint = '/'.join(request.path.strip('/').split('/')[2:])
+        try:
+            route = self.routes.get((request.method, endpoint))
+            if route is None:
+                raise SimulatorError(404, -1000, 'Unknown endpoint {0} {1}'.format(request.method, request.path))
+            weight, order, handler = route
+            wait = self.weight.take(weight)
+            if not wait and order:
+                wait = self.orders.take(1)
+            if wait:
+                raise SimulatorError(TOO_MANY_REQUESTS, -1003, 'Too many requests.', int(math.ceil(wait)))
+            status, body = 200, handler(args)
+        except SimulatorError as e:
+            status, body = e.status, {'code': e.code, 'msg': str(e)}
+            if e.retry_after is not None:
+                request.setHeader('Retry-After', str(e.retry_after))
+        request.setResponseCode(status)
+        request.setHeader('Content-Type', 'application/json')
+        request.write(json.dumps(body).encode('utf-8'))
+        request.finish()
+
+    def stream_opened(self, protocol, path, params):
+        ''' Register a websocket: /stream?streams=a/b combined, /ws/<stream> raw, /ws/<listen key> user data '''
+        if path == '/stream':
+            self.market[protocol] = (params.get('streams', [''])[0].split('/'), True)
+        elif '@' in path:
+            self.market[protocol] = ([path[len('/ws/'):]], False)
+        else:
+            self.users.add(protocol)
+
+    def stream_closed(self, protocol):
+        self.market.pop(protocol, None)
+        self.users.discard(protocol)
+        self.pending.pop(protocol, None)
+
+    def send(self, protocol, payload):
+        ''' Send 'payload' after the injected latency, but never ahead of earlier ones '''
+        pending = self.pending.setdefault(protocol, deque())
+        now = time.time()
+        at = max(pending[-1][0] if pending else now, now + self.delay())
+        pending.append((at, payload))
+        if len(pending) == 1:
+            reactor.callLater(at - now, self.deliver, protocol)
+
+    def deliver(self, protocol):
+        pending = self.pending.get(protocol)
+        if not pending:
+            return
+        now = time.time()
+        while pending and pending[0][0] <= now:
+            protocol.sendMessage(pending.popleft()[1])
+        if pending:
+            reactor.callLater(pending[0][0] - now, self.deliver, protocol)
+
+    def publish(self, event):
+        payload = json.dumps(event).encode('utf-8')
+        for protocol in self.users:
+            self.send(protocol, payload)
+
+    def tick(self):
+        ''' Move the prices and push a ticker and kline of every symbol to the streams carrying it '''
+        self.exchange.step(self.tick_interval / 60.0)
+        now = int(time.time() * 1000)
+        start = self.exchange.kline_start
+        closed = now - start >= self.kline_interval * 1000
+        events = {'ticker': self.exchange.tickers(now),
+                  'kline': self.exchange.klines(now, start, now if closed else start + int(self.kline_interval * 1000),
+                                                closed)}
+        if closed:
+            self.exchange.close_klines(now)
+        for protocol, (streams, combined) in list(self.market.items()):
+            for stream in streams:
+                symbol, _, kind = stream.partition('@')
+                event = events['kline' if kind.startswith('kline') else 'ticker'].get(symbol.upper())
+                if event is not None:
+                    self.send(protocol, json.dumps({'stream': stream, 'data': event} if combined else event).encode('utf-8'))
+
+
+def run_simulator(args):
+    '''
+    Run a simulated exchange on this machine for the app to be pointed at
+    under [exchange], until interrupted. It lists the coins of the
+    allocation file, or if there is none makes up [simulator] coins and
+    writes an allocation file spreading the portfolio about evenly over them.
+    Returns the process exit code.
+    '''
+    config = ConfigParser.RawConfigParser(allow_no_value=False)
+    config.read(args.config)
+    rest_port = int(config.get('simulator', 'rest_port'))
+    stream_port = int(config.get('simulator', 'stream_port'))
+    n = int(config.get('simulator', 'coins'))
+    balance = float(config.get('simulator', 'balance'))
+    volatility = float(config.get('simulator', 'volatility'))
+    tick_interval = float(config.get('simulator', 'tick_interval'))
+    kline_interval = float(config.get('simulator', 'kline_interval'))
+    latency = float(config.get('simulator', 'latency'))
+    jitter = float(config.get('simulator', 'jitter'))
+    weight_per_minute = int(config.get('simulator', 'weight_per_minute'))
+    orders_per_second = int(config.get('simulator', 'orders_per_second'))
+    seed = int(config.get('simulator', 'seed'))
+    trade_currency = config.get('trades', 'trade_currency')
+    if tick_interval <= 0 or kline_interval <= 0 or weight_per_minute <= 0 or orders_per_second <= 0:
+        raise ConfigError('Simulator intervals and rate limits must be positive')
+    if os.path.exists(args.allocation):
+        coins = list(pd.read_csv(args.allocation)['coin'])
+    else:
+        coins = [trade_currency] + ['C{0:04d}'.format(k) for k in range(n)]
+        #in 1/64 percent so the allocations add up to exactly 100, the rest going to the trade currency
+        allocation = np.full(len(coins), 6400 // len(coins)) / 64.0
+        allocation[0] += 100 - allocation.sum()
+        pd.DataFrame({'coin': coins,
+                      'fixed_balance': np.zeros(len(coins)),
+                      'allocation': allocation},
+                     columns=['coin', 'fixed_balance', 'allocation']).to_csv(args.allocation, index=False)
+        print('Wrote an allocation of {0} simulated coins to {1}'.format(n, args.allocation))
+    exchange = SimulatedExchange(coins, trade_currency, balance, volatility, seed=seed)
+    simulator = SimulatorServer(exchange, tick_interval, kline_interval, latency, jitter,
+                                weight_per_minute, orders_per_second)
+    simulator.listen(rest_port, stream_port)
+    print('Simulating {0} symbols, REST on http://127.0.0.1:{1} and streams on ws://127.0.0.1:{2}'.format(
+        len(exchange.symbols), rest_port, stream_port))
+    reactor.run()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep a Binance portfolio at a fixed allocation')
+    parser.add_argument('--allocation', default='allocation.csv',
+                        help='coin allocation file (default: allocation.csv)')
+    parser.add_argument('--config', default='config.ini',
+                        help='configuration file (default: config.ini)')
+    parser.add_argument('--portfolios',
+                        help='CSV file of portfolios (name, allocation[, keyfile, config]) to run side by side')
+    parser.add_argument('--headless', action='store_true',
+                        help='run without the GUI, taking API keys from the environment or --keyfile')
+    parser.add_argument('--keyfile',
+                        help='file holding the API key and secret on separate lines (headless only)')
+    parser.add_argument('--monitor', action='store_true',
+                        help='follow the portfolio without starting automated trading (headless only)')
+    parser.add_argument('--verbose', action='store_true',
+                        help='also log the planned action for every coin (headless only)')
+    parser.add_argument('--profile', action='store_true',
+                        help='start with the profiling timers on (headless only, SIGUSR1 toggles them)')
+    parser.add_argument('--benchmark', choices=sorted(BENCHMARKS),
+                        help='run a benchmark on synthetic data and exit')
+    parser.add_argument('--messages', type=int, default=20000,
+                        help='synthetic messages per run (messages benchmark only, default: 20000)')
+    parser.add_argument('--output',
+                        help='also write the benchmark results to this file as JSON')
+    parser.add_argument('--replay', action='store_true',
+                        help='backtest the allocation on recorded <PAIR>.csv ticks and exit')
+    parser.add_argument('--ticks',
+                        help='directory holding the recorded ticks (replay only, default: config)')
+    parser.add_argument('--periods',
+                        help='comma separated rebalance periods in seconds (replay only, default: config)')
+    parser.add_argument('--min-values',
+                        help='comma separated minimum trade values (replay only, default: config)')
+    parser.add_argument('--capital', type=float, default=1.0,
+                        help='starting portfolio value in the trade currency (replay only, default: 1)')
+    parser.add_argument('--fee', type=float, default=0.001,
+                        help='fee charged on every fill as a fraction of its value (replay only, default: 0.001)')
+    parser.add_argument('--replay-step', type=int, default=60,
+                        help='seconds between portfolio samples (replay only, default: 60)')
+    parser.add_argument('--convert-csv', metavar='DIR',
+                        help='convert the <PAIR>.csv records in DIR to the binary tick format and exit')
+    parser.add_argument('--simulate', action='store_true',
+                        help='run a simulated exchange for the app to be pointed at under [exchange]')
+    parser.add_argument('--ingest', action='store_true',
+                        help=argparse.SUPPRESS) #the child process of [websockets] ingest_process
+    args = parser.parse_args()
+    if args.simulate:
+        return run_simulator(args)
+    use_exchange(args.config)
+    if args.ingest:
+        return run_ingest(args)
+    if args.benchmark:
+        return BENCHMARKS[args.benchmark](args)
+    if args.portfolios:
+        try:
+            portfolios = read_portfolios(args.portfolios, args.config)
+        except (IOError, ValueError) as e:
+            parser.error(str(e))
+    else:
+        coins = pd.read_csv(args.allocation)
+        if args.replay:
+            return run_replay(coins, args)
+        if args.convert_csv:
+            return run_convert(coins, args)
+        portfolios = [Portfolio(None, coins, args.keyfile, args.config)]
+    if args.headless:
+        return run_headless(portfolios, args)
+    if tk is None:
+        parser.error('Tkinter is not available, use --headless')
+    for portfolio in portfolios:
+        if not np.sum(portfolio.coins['allocation']) == 100:
+            messagebox.showinfo('Bad Configuration','Your coin allocations to not sum to 100%')
+            return 1
+    root = tk.Tk()
+    root.withdraw()
+    engines = []
+    try:
+        hub = MarketHub(root, args.config)
+        for portfolio in portfolios:
+            engines.append(RebalanceEngine(portfolio.coins, root, portfolio.config, hub, portfolio.name))
+    except ConfigError as e:
+        messagebox.showinfo('Config Error', str(e))
+        shutdown(engines)
+        return 1
+    #a single portfolio lives in the root window, several get a window each
+    for engine in engines:
+        window = root if len(engines) == 1 else tk.Toplevel(root)
+        BalanceGUI(window, engine).grid(row=0, column=0)
+    root.mainloop()
+    return 0
 
 if __name__=='__main__':
-    main()
+    sys.exit(main())